@@ -0,0 +1,38 @@
+"""Shims over the differences between Python 2 and Python 3."""
+
+import abc
+import functools
+
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+try:
+  from collections import abc as collections_abc
+except ImportError:
+  import collections as collections_abc
+
+# Base class for abstract classes; `__metaclass__` is ignored by Python 3.
+ABC = abc.ABCMeta('ABC', (object,), {})
+
+reduce = functools.reduce
+
+try:
+  import BaseHTTPServer as http_server
+  import SocketServer as socketserver
+except ImportError:
+  from http import server as http_server
+  import socketserver
+
+try:
+  import httplib as http_client
+  import urlparse as urllib_parse
+except ImportError:
+  from http import client as http_client
+  from urllib import parse as urllib_parse
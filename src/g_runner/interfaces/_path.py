@@ -1,8 +1,9 @@
 import abc
 
+from g_runner import _compat
 
-class Path(object):
-  __metaclass__ = abc.ABCMeta
+
+class Path(_compat.ABC):
 
   @abc.abstractmethod
   def __iter__(self):
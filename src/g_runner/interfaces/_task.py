@@ -1,14 +1,15 @@
 import abc
 
+from g_runner import _compat
 
-class Task(object):
+
+class Task(_compat.ABC):
   """A task to perform.
 
   Implementors should provide value semantics with respect to the interface.
   Running the task should not cause the internal state of the task to change
   (i.e. a task is a record representation of a purely side-effect operation
   affecting only non-g_runner objects)."""
-  __metaclass__ = abc.ABCMeta
 
   @abc.abstractmethod
   def run(self):
@@ -25,6 +26,17 @@ class Task(object):
     """Get an iterable over the output paths of this task."""
     raise NotImplementedError()
 
+  def resources(self):
+    """Get the resources the task holds while running.
+
+    Returns:
+      A dict from resource names to amounts, e.g. {'cpus': 8, 'memory': 16e9}
+      or {'db_connections': 1}. The runner only starts the task while its
+      resource budget has the amounts to spare; resources the budget doesn't
+      name are unlimited. Tasks need nothing by default.
+    """
+    return {}
+
   @abc.abstractmethod
   def __eq__(self, other):
     raise NotImplementedError()
@@ -1,11 +1,11 @@
 import abc
 
+from g_runner import _compat
 from g_runner.interfaces import _path
 from g_runner.interfaces import _task
 
 
-class Tracker(object):
-  __metaclass__ = abc.ABCMeta
+class Tracker(_compat.ABC):
 
   @abc.abstractmethod
   def tasks(self):
@@ -1,6 +1,12 @@
 from g_runner.runner import _event
 from g_runner.runner import _run
 
+try:
+  from g_runner.runner import _run_async
+except ImportError:
+  # asyncio needs Python 3
+  _run_async = None
+
 # exports
 
 PathState = _event.PathState
@@ -10,3 +16,6 @@ Event = _event.Event
 RunnerError = _run.RunnerError
 RunnerCallbacks = _run.RunnerCallbacks
 run_tracker = _run.run_tracker
+
+if _run_async is not None:
+  run_tracker_async = _run_async.run_tracker_async
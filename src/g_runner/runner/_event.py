@@ -1,4 +1,5 @@
 import collections
+import threading
 
 from g_runner import interfaces
 
@@ -57,13 +58,15 @@ class Event(
 
   Attributes:
     path_selector (callable): a callable accepting an `interfaces.Tracker`
-      object and returning a sequence of paths in that tracker.
+      object and returning a sequence of paths in that tracker; see
+      `selectors` for ones resolved through the tracker's indices.
     path_regenerator (callable): a callable accepting an `interfaces.Tracker`
       and a sequence of paths returned by `path_selector` and returning a new
       sequence of paths with which the old paths will be replaced. If None,
       selected paths aren't regenerated (are maintained).
     task_selector (callable): a callable accepting an `interfaces.Tracker`
-      object and returning a sequence of tasks in that tracker.
+      object and returning a sequence of tasks in that tracker; see
+      `selectors`.
     task_regenerator (callable): a callable accepting an `interfaces.Tracker`
       and a sequence of tasks returned by `task_selector` and returning a new
       sequence of tasks with which the old tasks will be replaced. If None,
@@ -74,3 +77,70 @@ class Event(
               task_selector=None, task_regenerator=None, flags=EventFlags()):
     return super(Event, cls).__new__(cls, path_selector, path_regenerator,
                                      task_selector, task_regenerator, flags)
+
+
+class EventQueue(object):
+  """A queue of events for the runner to wait on.
+
+  Producers (the event iterator's poll thread and finished tasks) `put` events,
+  `wake` the consumer when something other than an event changed, and `close`
+  the queue when no more external events will come; closing also wakes the
+  consumer. The runner `drain`s the queue, and `wait`s on it until there's
+  something to look at instead of spinning."""
+
+  def __init__(self, on_wake=None):
+    """
+    Arguments:
+      on_wake (callable): called without arguments (and without the queue's
+        lock held) after every put, wakeup and close, e.g. to schedule the
+        consumer on an event loop rather than have it block in `wait`.
+    """
+    self._condition = threading.Condition(threading.Lock())
+    self._events = collections.deque()
+    self._woken = False
+    self._closed = False
+    self._on_wake = on_wake
+
+  def put(self, event):
+    with self._condition:
+      self._events.append(event)
+      self._condition.notify()
+    if self._on_wake is not None:
+      self._on_wake()
+
+  def wake(self):
+    with self._condition:
+      self._woken = True
+      self._condition.notify()
+    if self._on_wake is not None:
+      self._on_wake()
+
+  def close(self):
+    with self._condition:
+      self._closed = True
+      self._woken = True
+      self._condition.notify()
+    if self._on_wake is not None:
+      self._on_wake()
+
+  def drain(self):
+    """Take all queued events and clear any pending wakeup.
+
+    Returns:
+      A 2-tuple of the list of events and whether or not the queue was closed
+      before they were taken (in which case no more events will follow from
+      the event iterator)."""
+    with self._condition:
+      events = list(self._events)
+      self._events.clear()
+      self._woken = False
+      return events, self._closed
+
+  def wait(self):
+    """Block until there's an event or a wakeup that hasn't been drained."""
+    with self._condition:
+      while not (self._events or self._woken):
+        self._condition.wait()
+
+  def __len__(self):
+    return len(self._events)
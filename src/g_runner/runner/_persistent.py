@@ -0,0 +1,412 @@
+"""Persistent (immutable, structurally shared) maps and sets.
+
+Both are hash array mapped tries: every node holds up to 32 entries selected by
+successive 5-bit chunks of the key's hash, so a lookup touches O(log32(n))
+nodes and an update copies only the nodes on the path to its key. Everything
+else is shared between the old and the new collection.
+
+Bulk edits go through transients (see `PersistentMap.transient`), which mutate
+nodes they created themselves in place and hand back a persistent collection
+when done."""
+
+from g_runner._compat import collections_abc
+
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+_HASH_MASK = (1 << 64) - 1
+
+_absent = object()
+
+
+def _hash(key):
+  return hash(key) & _HASH_MASK
+
+
+def _bit_index(bitmap, bit):
+  return bin(bitmap & (bit - 1)).count('1')
+
+
+class _BitmapNode(object):
+  """A trie node with entries for the set bits of `bitmap`.
+
+  Entries are either leaves, 3-tuples of (hash, key, value), or child nodes. The
+  node may be mutated in place only by the transient whose token is `owner`."""
+  __slots__ = ('bitmap', 'entries', 'owner')
+
+  def __init__(self, bitmap, entries, owner):
+    self.bitmap = bitmap
+    self.entries = entries
+    self.owner = owner
+
+
+class _CollisionNode(object):
+  """A node of leaves whose keys have identical (full) hashes."""
+  __slots__ = ('hash', 'entries', 'owner')
+
+  def __init__(self, hash, entries, owner):
+    self.hash = hash
+    self.entries = entries
+    self.owner = owner
+
+
+def _editable(node, owner):
+  if owner is not None and node.owner is owner:
+    return node
+  if node.__class__ is _BitmapNode:
+    return _BitmapNode(node.bitmap, list(node.entries), owner)
+  return _CollisionNode(node.hash, list(node.entries), owner)
+
+
+def _merge(leaf1, leaf2, shift, owner):
+  """Make a node holding two leaves with different keys."""
+  hash1, hash2 = leaf1[0], leaf2[0]
+  if hash1 == hash2:
+    return _CollisionNode(hash1, [leaf1, leaf2], owner)
+  index1 = (hash1 >> shift) & _MASK
+  index2 = (hash2 >> shift) & _MASK
+  if index1 == index2:
+    return _BitmapNode(
+        1 << index1, [_merge(leaf1, leaf2, shift + _BITS, owner)], owner)
+  entries = [leaf1, leaf2] if index1 < index2 else [leaf2, leaf1]
+  return _BitmapNode((1 << index1) | (1 << index2), entries, owner)
+
+
+def _get(node, shift, key_hash, key, default):
+  while True:
+    if node.__class__ is _CollisionNode:
+      for (unused_hash, entry_key, entry_value) in node.entries:
+        if entry_key == key:
+          return entry_value
+      return default
+    bit = 1 << ((key_hash >> shift) & _MASK)
+    if not node.bitmap & bit:
+      return default
+    entry = node.entries[_bit_index(node.bitmap, bit)]
+    if entry.__class__ is tuple:
+      if entry[0] == key_hash and (entry[1] is key or entry[1] == key):
+        return entry[2]
+      return default
+    node = entry
+    shift += _BITS
+
+
+def _assoc(node, shift, key_hash, key, value, owner):
+  """Associate `key` with `value` under `node`.
+
+  Returns:
+    A 2-tuple of the resulting node (`node` itself if nothing changed) and
+    whether or not the key was newly added."""
+  leaf = (key_hash, key, value)
+  if node.__class__ is _CollisionNode:
+    if key_hash != node.hash:
+      wrapper = _BitmapNode(1 << ((node.hash >> shift) & _MASK), [node], owner)
+      return _assoc(wrapper, shift, key_hash, key, value, owner)
+    for (index, entry) in enumerate(node.entries):
+      if entry[1] == key:
+        if entry[2] is value:
+          return node, False
+        new_node = _editable(node, owner)
+        new_node.entries[index] = leaf
+        return new_node, False
+    new_node = _editable(node, owner)
+    new_node.entries.append(leaf)
+    return new_node, True
+  bit = 1 << ((key_hash >> shift) & _MASK)
+  index = _bit_index(node.bitmap, bit)
+  if not node.bitmap & bit:
+    new_node = _editable(node, owner)
+    new_node.entries.insert(index, leaf)
+    new_node.bitmap |= bit
+    return new_node, True
+  entry = node.entries[index]
+  if entry.__class__ is tuple:
+    if entry[0] == key_hash and (entry[1] is key or entry[1] == key):
+      if entry[2] is value:
+        return node, False
+      new_entry, added = leaf, False
+    else:
+      new_entry, added = _merge(entry, leaf, shift + _BITS, owner), True
+  else:
+    new_entry, added = _assoc(
+        entry, shift + _BITS, key_hash, key, value, owner)
+    if new_entry is entry:
+      return node, added
+  new_node = _editable(node, owner)
+  new_node.entries[index] = new_entry
+  return new_node, added
+
+
+def _dissoc(node, shift, key_hash, key, owner):
+  """Remove `key` from under `node`.
+
+  Returns:
+    A 2-tuple of the result and whether or not the key was removed. The result
+    is `node` itself if nothing changed (or it was edited in place), else the
+    new node, a lone leaf that the parent should inline, or None if nothing is
+    left."""
+  if node.__class__ is _CollisionNode:
+    for (index, entry) in enumerate(node.entries):
+      if entry[1] == key:
+        if len(node.entries) == 2:
+          return node.entries[1 - index], True
+        new_node = _editable(node, owner)
+        del new_node.entries[index]
+        return new_node, True
+    return node, False
+  bit = 1 << ((key_hash >> shift) & _MASK)
+  if not node.bitmap & bit:
+    return node, False
+  index = _bit_index(node.bitmap, bit)
+  entry = node.entries[index]
+  if entry.__class__ is tuple:
+    if not (entry[0] == key_hash and (entry[1] is key or entry[1] == key)):
+      return node, False
+    new_entry = None
+  else:
+    new_entry, removed = _dissoc(entry, shift + _BITS, key_hash, key, owner)
+    if not removed:
+      return node, False
+    if new_entry is entry:
+      return node, True
+  if new_entry is None:
+    if node.bitmap == bit:
+      return None, True
+    new_node = _editable(node, owner)
+    del new_node.entries[index]
+    new_node.bitmap ^= bit
+  else:
+    new_node = _editable(node, owner)
+    new_node.entries[index] = new_entry
+  if (shift > 0 and len(new_node.entries) == 1 and
+      new_node.entries[0].__class__ is tuple):
+    return new_node.entries[0], True
+  return new_node, True
+
+
+def _iter_leaves(node):
+  stack = [iter(node.entries)]
+  while stack:
+    for entry in stack[-1]:
+      if entry.__class__ is tuple:
+        yield entry
+      else:
+        stack.append(iter(entry.entries))
+        break
+    else:
+      stack.pop()
+
+
+def _empty_root():
+  return _BitmapNode(0, [], None)
+
+
+class PersistentMap(collections_abc.Mapping):
+  """An immutable mapping; 'modifying' methods return new maps."""
+  __slots__ = ('_root', '_len', '_hash_value')
+
+  def __init__(self, items=()):
+    if isinstance(items, PersistentMap):
+      self._root, self._len = items._root, items._len
+    else:
+      transient = _TransientMap(_empty_root(), 0)
+      for (key, value) in (
+          items.items() if isinstance(items, dict) else items):
+        transient[key] = value
+      self._root, self._len = transient._root, transient._len
+      transient.persistent()
+    self._hash_value = None
+
+  @classmethod
+  def _make(cls, root, length):
+    persistent_map = cls.__new__(cls)
+    persistent_map._root = root
+    persistent_map._len = length
+    persistent_map._hash_value = None
+    return persistent_map
+
+  def __len__(self):
+    return self._len
+
+  def __iter__(self):
+    for leaf in _iter_leaves(self._root):
+      yield leaf[1]
+
+  def iteritems(self):
+    for leaf in _iter_leaves(self._root):
+      yield leaf[1], leaf[2]
+
+  def items(self):
+    return list(self.iteritems())
+
+  def __contains__(self, key):
+    return _get(self._root, 0, _hash(key), key, _absent) is not _absent
+
+  def __getitem__(self, key):
+    value = _get(self._root, 0, _hash(key), key, _absent)
+    if value is _absent:
+      raise KeyError(key)
+    return value
+
+  def get(self, key, default=None):
+    return _get(self._root, 0, _hash(key), key, default)
+
+  def set(self, key, value):
+    """Get a map with `key` associated with `value`."""
+    root, added = _assoc(self._root, 0, _hash(key), key, value, None)
+    if root is self._root:
+      return self
+    return PersistentMap._make(root, self._len + 1 if added else self._len)
+
+  def discard(self, key):
+    """Get a map without `key`."""
+    root, removed = _dissoc(self._root, 0, _hash(key), key, None)
+    if not removed:
+      return self
+    return PersistentMap._make(
+        _empty_root() if root is None else root, self._len - 1)
+
+  def transient(self):
+    """Get a mutable copy of this map sharing its structure."""
+    return _TransientMap(self._root, self._len)
+
+  def __eq__(self, other):
+    if isinstance(other, PersistentMap) and self._root is other._root:
+      return True
+    return collections_abc.Mapping.__eq__(self, other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    if self._hash_value is None:
+      self._hash_value = hash(frozenset(self.iteritems()))
+    return self._hash_value
+
+  def __repr__(self):
+    return 'PersistentMap(%r)' % (dict(self.iteritems()),)
+
+
+class _TransientMap(object):
+  """A mutable map that may share structure with persistent maps.
+
+  Nodes are only mutated in place if they were created by this transient; all
+  others are copied on first write."""
+
+  def __init__(self, root, length):
+    self._owner = object()
+    self._root = root
+    self._len = length
+
+  def __len__(self):
+    return self._len
+
+  def __contains__(self, key):
+    return _get(self._root, 0, _hash(key), key, _absent) is not _absent
+
+  def get(self, key, default=None):
+    return _get(self._root, 0, _hash(key), key, default)
+
+  def __setitem__(self, key, value):
+    self._root, added = _assoc(
+        self._root, 0, _hash(key), key, value, self._owner)
+    if added:
+      self._len += 1
+
+  def discard(self, key):
+    root, removed = _dissoc(self._root, 0, _hash(key), key, self._owner)
+    if removed:
+      self._root = _BitmapNode(0, [], self._owner) if root is None else root
+      self._len -= 1
+
+  def persistent(self):
+    """Get a persistent map of the contents; ends this transient's edits."""
+    self._owner = object()
+    return PersistentMap._make(self._root, self._len)
+
+
+class PersistentSet(collections_abc.Set):
+  """An immutable set; 'modifying' methods return new sets."""
+  __slots__ = ('_map', '_hash_value')
+
+  def __init__(self, iterable=()):
+    if isinstance(iterable, PersistentSet):
+      self._map = iterable._map
+    else:
+      self._map = PersistentMap((element, None) for element in iterable)
+    self._hash_value = None
+
+  @classmethod
+  def _make(cls, persistent_map):
+    persistent_set = cls.__new__(cls)
+    persistent_set._map = persistent_map
+    persistent_set._hash_value = None
+    return persistent_set
+
+  def __len__(self):
+    return len(self._map)
+
+  def __iter__(self):
+    return iter(self._map)
+
+  def __contains__(self, element):
+    return element in self._map
+
+  def add(self, element):
+    """Get a set with `element` in it."""
+    persistent_map = self._map.set(element, None)
+    return self if persistent_map is self._map else PersistentSet._make(
+        persistent_map)
+
+  def discard(self, element):
+    """Get a set without `element` in it."""
+    persistent_map = self._map.discard(element)
+    return self if persistent_map is self._map else PersistentSet._make(
+        persistent_map)
+
+  def _edited(self, transient):
+    if transient._root is self._map._root:
+      return self
+    return PersistentSet._make(transient.persistent())
+
+  def union(self, *iterables):
+    transient = self._map.transient()
+    for iterable in iterables:
+      for element in iterable:
+        transient[element] = None
+    return self._edited(transient)
+
+  def difference(self, *iterables):
+    transient = self._map.transient()
+    for iterable in iterables:
+      for element in iterable:
+        transient.discard(element)
+    return self._edited(transient)
+
+  def intersection(self, *iterables):
+    result = self
+    for iterable in iterables:
+      if not isinstance(iterable, collections_abc.Set):
+        iterable = set(iterable)
+      smaller, larger = (
+          (result, iterable) if len(result) <= len(iterable) else
+          (iterable, result))
+      result = PersistentSet(
+          element for element in smaller if element in larger)
+    return result
+
+  def __eq__(self, other):
+    if isinstance(other, PersistentSet) and self._map is other._map:
+      return True
+    return collections_abc.Set.__eq__(self, other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    if self._hash_value is None:
+      self._hash_value = self._hash()
+    return self._hash_value
+
+  def __repr__(self):
+    return 'PersistentSet(%r)' % (list(self),)
@@ -0,0 +1,98 @@
+import random
+import unittest
+
+from g_runner.runner import _persistent
+
+
+class CollidingKey(object):
+
+  def __init__(self, name, hash_value):
+    self.name = name
+    self.hash_value = hash_value
+
+  def __eq__(self, other):
+    return isinstance(other, CollidingKey) and self.name == other.name
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return self.hash_value
+
+
+class PersistentMapTest(unittest.TestCase):
+
+  def assertMapEqual(self, expected, persistent_map):
+    self.assertEqual(len(expected), len(persistent_map))
+    self.assertEqual(expected, dict(persistent_map.iteritems()))
+    for (key, value) in expected.items():
+      self.assertIn(key, persistent_map)
+      self.assertEqual(value, persistent_map[key])
+
+  def test_random_operations(self):
+    rng = random.Random(42)
+    expected = {}
+    persistent_map = _persistent.PersistentMap()
+    for i in range(5000):
+      key = rng.randint(0, 1000)
+      if rng.random() < 0.6:
+        expected[key] = i
+        persistent_map = persistent_map.set(key, i)
+      else:
+        expected.pop(key, None)
+        persistent_map = persistent_map.discard(key)
+    self.assertMapEqual(expected, persistent_map)
+
+  def test_old_versions_are_unchanged(self):
+    versions = [_persistent.PersistentMap()]
+    for i in range(200):
+      versions.append(versions[-1].set(i, str(i)))
+    for (length, persistent_map) in enumerate(versions):
+      self.assertMapEqual(
+          dict((i, str(i)) for i in range(length)), persistent_map)
+
+  def test_collisions(self):
+    keys = [CollidingKey(str(i), i % 3) for i in range(30)]
+    persistent_map = _persistent.PersistentMap((key, key.name) for key in keys)
+    self.assertMapEqual(dict((key, key.name) for key in keys), persistent_map)
+    for key in keys[:25]:
+      persistent_map = persistent_map.discard(key)
+    self.assertMapEqual(
+        dict((key, key.name) for key in keys[25:]), persistent_map)
+    self.assertNotIn(CollidingKey('0', 0), persistent_map)
+
+  def test_transient_does_not_affect_source(self):
+    persistent_map = _persistent.PersistentMap((i, i) for i in range(100))
+    transient = persistent_map.transient()
+    for i in range(50):
+      transient.discard(i)
+    transient[1000] = 1000
+    edited_map = transient.persistent()
+    transient[2000] = 2000
+    self.assertMapEqual(dict((i, i) for i in range(100)), persistent_map)
+    self.assertMapEqual(
+        dict([(i, i) for i in range(50, 100)] + [(1000, 1000)]), edited_map)
+
+  def test_unchanged_returns_self(self):
+    value = object()
+    persistent_map = _persistent.PersistentMap([(1, value)])
+    self.assertIs(persistent_map, persistent_map.set(1, value))
+    self.assertIs(persistent_map, persistent_map.discard(2))
+
+
+class PersistentSetTest(unittest.TestCase):
+
+  def test_set_operations(self):
+    persistent_set = _persistent.PersistentSet(range(10))
+    self.assertEqual(set(range(10)), persistent_set)
+    self.assertEqual(persistent_set, set(range(10)))
+    self.assertEqual(set(range(5)), persistent_set.difference(range(5, 20)))
+    self.assertEqual(set(range(12)), persistent_set.union([10], [11]))
+    self.assertEqual(set([3, 4]), persistent_set.intersection([3, 4, 11]))
+    self.assertEqual(set(range(10)), persistent_set)
+    self.assertEqual(
+        hash(persistent_set), hash(_persistent.PersistentSet(range(10))))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
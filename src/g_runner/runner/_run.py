@@ -1,11 +1,22 @@
+import array
 import collections
 import copy
+import heapq
 import itertools
 import os
 import threading
+import time
 
 from g_runner import interfaces
 from g_runner.runner import _event
+from g_runner.runner import action_cache as _action_cache
+from g_runner.runner import callbacks as _callbacks
+from g_runner.runner import executor as _executor
+from g_runner.runner import resources as _resources
+from g_runner.runner import scheduling as _scheduling
+from g_runner.runner import selectors as _selectors
+from g_runner.runner import _state_tables
+from g_runner.runner import subprocesses as _subprocesses
 from g_runner.runner import tracker as _tracker
 
 
@@ -28,6 +39,10 @@ class _PathState(_event.PathState):
   updated = 'updated'
   poisoned = 'poisoned'
 
+_PATH_STATES = (
+    _PathState.outdated, _PathState.updating, _PathState.updated,
+    _PathState.up_to_date, _PathState.poisoned)
+
 
 class _TaskState(object):
   """State of a task during a run."""
@@ -37,169 +52,412 @@ class _TaskState(object):
   # The task is running but we want to remove it
   zombie = 'zombie'
 
+_TASK_STATES = (_TaskState.stopped, _TaskState.running, _TaskState.zombie)
+
+# The runner keeps states as their indices in `_PATH_STATES` and
+# `_TASK_STATES`, in `bytearray`s; `_ABSENT` is the code of paths that tasks
+# refer to but that aren't tracked, and of ids that are free.
+_PATH_STATE_CODES = dict(
+    (state, code) for (code, state) in enumerate(_PATH_STATES))
+_TASK_STATE_CODES = dict(
+    (state, code) for (code, state) in enumerate(_TASK_STATES))
+_OUTDATED = _PATH_STATE_CODES[_PathState.outdated]
+_UPDATING = _PATH_STATE_CODES[_PathState.updating]
+_UP_TO_DATE = _PATH_STATE_CODES[_PathState.up_to_date]
+_POISONED = _PATH_STATE_CODES[_PathState.poisoned]
+_STOPPED = _TASK_STATE_CODES[_TaskState.stopped]
+_RUNNING = _TASK_STATE_CODES[_TaskState.running]
+_ZOMBIE = _TASK_STATE_CODES[_TaskState.zombie]
+_ABSENT = 255
+
 
-class RunnerCallbacks(object):
-  """Edge-triggered callbacks during a run of tracked tasks.
+RunnerCallbacks = _callbacks.RunnerCallbacks
 
-  Useful for verbose output of the run state. Note that callbacks have no
-  explicit locking from the runner, thus thread safety must be ensured by the
-  callee."""
 
-  def on_task_running(self, tracker, task):
-    """Called when a task enters the running state."""
-    pass
+def _only_sets_path_states(event):
+  """Whether an event only sets the states of paths it selects."""
+  return (event.path_selector is not None and
+          event.path_regenerator is None and event.task_selector is None)
 
-  def on_task_stopped(self, tracker, task):
-    """Called when a task enters the stopped state."""
-    pass
 
-  def on_task_failed(self, tracker, task, error):
-    """Called when a task failed.
+def _path_state_event(paths, state, hint_local):
+  return _event.Event(
+      path_selector=_selectors.Literal(paths),
+      flags=_event.EventFlags(hint_local=hint_local, paths_state=state))
 
-    Note that this is a refinement of a task stopping; it is called in addition
-    to on_task_stopped."""
-    pass
 
-  def on_path_added(self, tracker, path):
-    """Called when a path is added to the tracker."""
-    pass
+# How many cache lookups may be under way at once; they're mostly I/O.
+_CACHE_LOOKUP_WORKERS = 8
 
-  def on_path_outdated(self, tracker, path):
-    """Called when a path enters the outdated state."""
-    pass
 
-  def on_path_updating(self, tracker, path):
-    """Called when a path enters the updating state."""
-    pass
+class _CacheRestore(object):
+  """Restores a task's outputs from the action cache when run."""
 
-  def on_path_up_to_date(self, tracker, path):
-    """Called when a path enters the up-to-date state."""
-    pass
+  def __init__(self, action_cache, task):
+    self.action_cache = action_cache
+    self.task = task
+    self.restored = False
 
-  def on_event(self, tracker, event):
-    """Called when the runner processes an event."""
-    pass
+  def run(self):
+    self.restored = self.action_cache.restore(self.task)
 
-  def on_event_wait(self, tracker):
-    """Called when the only thing keeping the run from terminating is the open
-    event queue. Note that this may be spuriously called; it's up to the
-    callback-callee to determine whether or not there's something to do with
-    respect to the waiting runner."""
-    pass
 
-def _run_tracker_poll_event_iterator(event_iterator, out_event_deque):
-  for event in event_iterator:
-    out_event_deque.append(event)
+def _run_through_cache(action_cache, lookup_executor, executor, task, done):
+  """Restore a task's outputs from the cache, else run it and record them.
+
+  The lookup runs on `lookup_executor` and the task on `executor`. `done` gets
+  the task's error (or None) and whether it was restored."""
+  restore = _CacheRestore(action_cache, task)
+  def looked_up(error):
+    if error is not None:
+      done(error, False)
+    elif restore.restored:
+      done(None, True)
+    else:
+      executor.submit(task, ran)
+  def ran(error):
+    if error is None:
+      try:
+        action_cache.record(task)
+      except Exception as e:
+        error = e
+    done(error, False)
+  lookup_executor.submit(restore, looked_up)
+
+
+def _run_tracker_poll_event_iterator(event_iterator, out_event_queue):
+  try:
+    for event in event_iterator:
+      out_event_queue.put(event)
+  finally:
+    out_event_queue.close()
 
 
 class _TrackerRunner(object):
 
   def __init__(self, tracker, outdated=True, callbacks=RunnerCallbacks(),
-               keep_going=False):
+               keep_going=False, executor=None, tagged_executors=(),
+               scheduling_policy=None, resource_budget=None,
+               state_store=None, action_cache=None, trace=None):
     if not isinstance(callbacks, RunnerCallbacks):
       raise TypeError('expected `callbacks` to be a `RunnerCallbacks`')
-    self.tracker = _tracker.Tracker(tracker)
-    if outdated:
-      self.path_states = dict(
-          (path, _PathState.outdated) for path in tracker.paths())
-      self.paths_by_state = {
-          _PathState.outdated: set(tracker.paths()),
-          _PathState.updating: set(),
-          _PathState.up_to_date: set(),
-          _PathState.poisoned: set()
-      }
+    if scheduling_policy is None:
+      scheduling_policy = _scheduling.FifoPolicy()
+    elif not isinstance(scheduling_policy, _scheduling.SchedulingPolicy):
+      raise TypeError(
+          'expected `scheduling_policy` to be a `scheduling.SchedulingPolicy`')
+    if executor is None:
+      executor = _executor.ThreadExecutor()
+    elif not isinstance(executor, _executor.Executor):
+      raise TypeError('expected `executor` to be an `executor.Executor`')
+    tagged_executors = tuple(tagged_executors)
+    for (unused_tag, tagged_executor) in tagged_executors:
+      if not isinstance(tagged_executor, _executor.Executor):
+        raise TypeError('expected tagged executors to be `executor.Executor`s')
+    if (isinstance(tracker, _tracker.Tracker) and
+        _tracker.is_tracker_valid(tracker)):
+      # our own trackers are immutable, so there's no need to copy them
+      self.tracker = tracker
+    else:
+      self.tracker = _tracker.Tracker(tracker)
+    tracker = self.tracker
+    initial_state = _PathState.outdated if outdated else _PathState.up_to_date
+    self.state_store = state_store
+    # Paths and tasks get dense ids when the runner first meets them, and their
+    # states, scheduling counts and adjacency are kept in tables indexed by id
+    # (see `_state_tables`), so that state changes don't hash user objects.
+    # Paths that tasks refer to but that aren't tracked have ids too, with the
+    # state `_ABSENT`; ids are released once nothing refers to them.
+    self.path_ids = _state_tables.Interner()
+    self.path_codes = bytearray()
+    self.path_consumers = _state_tables.Adjacency()
+    self.path_producers = _state_tables.Adjacency()
+    # the number of tracked paths in each state
+    self.path_state_counts = [0] * len(_PATH_STATES)
+    if state_store is None:
+      path_states = ((path, initial_state) for path in tracker.paths())
     else:
-      self.path_states = dict(
-          (path, _PathState.up_to_date) for path in tracker.paths())
-      self.paths_by_state = {
-          _PathState.outdated: set(),
-          _PathState.updating: set(),
-          _PathState.up_to_date: set(tracker.paths()),
-      }
-
-    self.task_states = dict(
-        (task, _TaskState.stopped) for task in tracker.tasks())
-    self.tasks_by_state = {
-        _TaskState.stopped: set(tracker.tasks()),
-        _TaskState.running: set(),
-    }
+      path_states = state_store.initial_path_states(
+          tracker, initial_state).items()
+    for (path, state) in path_states:
+      code = _PATH_STATE_CODES[state]
+      self.path_codes[self._intern_path(path)] = code
+      self.path_state_counts[code] += 1
+
+    self.task_ids = _state_tables.Interner()
+    self.task_codes = bytearray()
+    self.task_inputs = _state_tables.Adjacency()
+    self.task_outputs = _state_tables.Adjacency()
+    # The scheduler keeps, per task, counts of the distinct inputs that aren't
+    # up to date and of the distinct outputs that are outdated. A task is ready
+    # when it's stopped, has no unready inputs, and has some outdated output;
+    # ready tasks are queued as the counts change so that scheduling never has
+    # to scan for them. Queued tasks are revalidated on dequeue.
+    self.task_unready_inputs = array.array('i')
+    self.task_outdated_outputs = array.array('i')
+    self.task_queued = bytearray()
+    # Ready tasks wait in a heap per executor of (-priority, sequence, task id,
+    # task), so that each executor with room starts its highest priority tasks
+    # first and those of equal priority in the order they became ready.
+    self.ready_tasks = {}
+    self.ready_sequence = itertools.count()
+    # task ids of running tasks to their executors, start times and resources
+    self.running_counts = collections.defaultdict(int)
+    self.task_executors = {}
+    self.task_start_times = {}
+    self.scheduling_policy = scheduling_policy
+    self.resource_budget = _resources.ResourceBudget(resource_budget)
+    self.task_resources = {}
+    self.action_cache = action_cache
+    # Restoring outputs takes I/O, which mustn't hold up the runner, so cache
+    # lookups run on a small pool of the runner's own.
+    self.cache_lookup_executor = None
+    if action_cache is not None:
+      self.cache_lookup_executor = _executor.ThreadPoolExecutor(
+          _CACHE_LOOKUP_WORKERS)
+    # a trace.TraceRecorder, or None; when there's one, task ids to the times
+    # tasks became ready at, and those of running tasks to their lanes and
+    # the times they were dispatched at
+    self.trace = trace
+    self.task_ready_times = {}
+    self.task_lanes = {}
     self.task_generated_events = {}
     self.callbacks = callbacks
+    # State changes not yet reported to the callbacks, which get them in bulk
+    # once per event and per round of dispatching: state codes to the paths
+    # or tasks that entered them, in order.
+    self.unreported_path_codes = collections.OrderedDict()
+    self.unreported_task_codes = collections.OrderedDict()
+    self.executor = executor
+    self.tagged_executors = tagged_executors
     self.keep_going = keep_going
     self.failures_deque = []
     self.lock = threading.RLock()
+    for task in tracker.tasks():
+      self._add_task(task)
+
+  def _intern_path(self, path):
+    """Get the id of a path, tracked or not, giving it one if it has none."""
+    path_id = self.path_ids.intern(path)
+    if path_id == len(self.path_codes):
+      self.path_codes.append(_ABSENT)
+      self.path_consumers.grow(path_id + 1)
+      self.path_producers.grow(path_id + 1)
+    return path_id
+
+  def _intern_task(self, task):
+    task_id = self.task_ids.intern(task)
+    if task_id == len(self.task_codes):
+      self.task_codes.append(_ABSENT)
+      self.task_unready_inputs.append(0)
+      self.task_outdated_outputs.append(0)
+      self.task_queued.append(0)
+      self.task_inputs.grow(task_id + 1)
+      self.task_outputs.grow(task_id + 1)
+    return task_id
+
+  def _tracked_path_id(self, path):
+    """Get the id of a tracked path; raises KeyError for untracked paths."""
+    path_id = self.path_ids.get(path)
+    if path_id is None or self.path_codes[path_id] == _ABSENT:
+      raise KeyError(path)
+    return path_id
+
+  def _task_id(self, task):
+    task_id = self.task_ids.get(task)
+    if task_id is None:
+      raise KeyError(task)
+    return task_id
+
+  def _release_path_if_unused(self, path_id):
+    if (self.path_codes[path_id] == _ABSENT and
+        self.path_consumers.is_empty(path_id) and
+        self.path_producers.is_empty(path_id)):
+      self.path_ids.release(path_id)
+
+  def _path_state(self, path):
+    """Get the state of a path, or None if it isn't tracked."""
+    path_id = self.path_ids.get(path)
+    if path_id is None or self.path_codes[path_id] == _ABSENT:
+      return None
+    return _PATH_STATES[self.path_codes[path_id]]
+
+  def _path_states(self):
+    """Get a dict of the tracked paths to their states."""
+    with self.lock:
+      return dict((self.path_ids[path_id], _PATH_STATES[code])
+                  for (path_id, code) in enumerate(self.path_codes)
+                  if code != _ABSENT)
 
   def _remove_path(self, path):
+    """Forget a path's state.
+
+    The path must separately be removed from the tracker."""
     with self.lock:
-      self.tracker = self.tracker.replaced(old_paths=[path])
-      self.paths_by_state[self.path_states[path]].remove(path)
-      del self.path_states[path]
+      path_id = self._tracked_path_id(path)
+      self._change_path_code(path_id, _ABSENT)
+      self._release_path_if_unused(path_id)
 
   def _add_path(self, path, state):
+    """Start tracking a path's state.
+
+    The path must already have been added to the tracker."""
+    code = _PATH_STATE_CODES[state]
     with self.lock:
-      self.tracker = self.tracker.replaced(new_paths=[path])
-      self.paths_by_state[state].add(path)
-      self.path_states[path] = state
+      self._change_path_code(self._intern_path(path), code)
+      self.unreported_path_codes.setdefault(code, []).append(path)
     self.callbacks.on_path_added(self.tracker, path)
-    if state == _PathState.outdated:
-      self.callbacks.on_path_outdated(self.tracker, path)
-    elif state == _PathState.up_to_date:
-      self.callbacks.on_path_up_to_date(self.tracker, path)
-    # note that there's no case where a path can be added in the 'updating'
-    # state.
-
-  def _remove_task(self, task):
+
+  def _remove_task(self, task, transaction):
     """Remove a task.
 
-    If we're running the task currently, its status is updated to 'zombie'."""
+    If we're running the task currently, its status is updated to 'zombie' and
+    it stays in the tracker until it stops running."""
     with self.lock:
-      if self.task_states[task] == _TaskState.running:
-        self._set_task_state(task, _TaskState.zombie)
-      elif self.task_states[task] == _TaskState.zombie:
+      task_id = self._task_id(task)
+      if self.task_codes[task_id] == _RUNNING:
+        self._set_task_code(task_id, _ZOMBIE)
+      elif self.task_codes[task_id] == _ZOMBIE:
         # don't need to do anything
         pass
       else:
-        self.tracker = self.tracker.replaced(old_tasks=[task])
-        self.tasks_by_state[self.task_states[task]].remove(task)
-        del self.task_states[task]
+        transaction.remove_tasks([task])
+        self._forget_task(task_id)
 
   def _add_task(self, task):
+    """Start tracking a task's state.
+
+    The task must already have been added to the tracker."""
     with self.lock:
-      self.tracker = self.tracker.replaced(new_tasks=[task])
-      self.task_states[task] = _TaskState.stopped
-      self.tasks_by_state[_TaskState.stopped].add(task)
+      if task in self.task_ids:
+        return
+      task_id = self._intern_task(task)
+      self.task_codes[task_id] = _STOPPED
+      self._count_task(task_id, task)
+
+  def _forget_task(self, task_id):
+    self.task_ready_times.pop(task_id, None)
+    self.task_codes[task_id] = _ABSENT
+    self.task_queued[task_id] = 0
+    for path_id in self.task_inputs.values(task_id):
+      self.path_consumers.remove(path_id, task_id)
+      self._release_path_if_unused(path_id)
+    self.task_inputs.clear(task_id)
+    for path_id in self.task_outputs.values(task_id):
+      self.path_producers.remove(path_id, task_id)
+      self._release_path_if_unused(path_id)
+    self.task_outputs.clear(task_id)
+    self.task_ids.release(task_id)
+
+  def _is_task_ready(self, task_id):
+    return (self.task_codes[task_id] == _STOPPED and
+            self.task_unready_inputs[task_id] == 0 and
+            self.task_outdated_outputs[task_id] > 0)
+
+  def _enqueue_if_ready(self, task_id):
+    if not self.task_queued[task_id] and self._is_task_ready(task_id):
+      self.task_queued[task_id] = 1
+      if self.trace is not None:
+        self.task_ready_times[task_id] = self.trace.now()
+      task = self.task_ids[task_id]
+      heapq.heappush(
+          self.ready_tasks.setdefault(self._executor_for(task), []),
+          (-self.scheduling_policy.priority(self.tracker, task),
+           next(self.ready_sequence), task_id, task))
+
+  def _count_task(self, task_id, task):
+    """Link a task to its paths and initialize its scheduling counts from their
+    current states."""
+    unready_inputs = 0
+    for path in set(task.input_paths()):
+      path_id = self._intern_path(path)
+      self.task_inputs.add(task_id, path_id)
+      self.path_consumers.add(path_id, task_id)
+      if self.path_codes[path_id] != _UP_TO_DATE:
+        unready_inputs += 1
+    outdated_outputs = 0
+    for path in set(task.output_paths()):
+      path_id = self._intern_path(path)
+      self.task_outputs.add(task_id, path_id)
+      self.path_producers.add(path_id, task_id)
+      if self.path_codes[path_id] == _OUTDATED:
+        outdated_outputs += 1
+    self.task_unready_inputs[task_id] = unready_inputs
+    self.task_outdated_outputs[task_id] = outdated_outputs
+    self._enqueue_if_ready(task_id)
+
+  def _count_path_state_change(self, path_id, old_code, new_code):
+    """Update the scheduling counts of tasks adjacent to a path.
+
+    Costs time proportional to the number of tasks that use the path."""
+    was_up_to_date = old_code == _UP_TO_DATE
+    if was_up_to_date != (new_code == _UP_TO_DATE):
+      delta = 1 if was_up_to_date else -1
+      for task_id in self.path_consumers.values(path_id):
+        self.task_unready_inputs[task_id] += delta
+        self._enqueue_if_ready(task_id)
+    was_outdated = old_code == _OUTDATED
+    if was_outdated != (new_code == _OUTDATED):
+      delta = -1 if was_outdated else 1
+      for task_id in self.path_producers.values(path_id):
+        self.task_outdated_outputs[task_id] += delta
+        self._enqueue_if_ready(task_id)
+
+  def _change_path_code(self, path_id, code):
+    old_code = self.path_codes[path_id]
+    self.path_codes[path_id] = code
+    if old_code != _ABSENT:
+      self.path_state_counts[old_code] -= 1
+    if code != _ABSENT:
+      self.path_state_counts[code] += 1
+    self._count_path_state_change(path_id, old_code, code)
 
   def _set_path_state(self, path, state):
     with self.lock:
-      self.paths_by_state[self.path_states[path]].discard(path)
-      self.path_states[path] = state
-      self.paths_by_state[state].add(path)
-    if state == _PathState.outdated:
-      self.callbacks.on_path_outdated(self.tracker, path)
-    elif state == _PathState.updating:
-      self.callbacks.on_path_updating(self.tracker, path)
-    elif state == _PathState.up_to_date:
-      self.callbacks.on_path_up_to_date(self.tracker, path)
-
-  def _set_task_state(self, task, state):
+      self._set_path_code(self._tracked_path_id(path), _PATH_STATE_CODES[state])
+    self._report_state_changes()
+
+  def _set_path_code(self, path_id, code):
+    """Change a path's state, leaving the change to be reported."""
+    with self.lock:
+      self._change_path_code(path_id, code)
+      self.unreported_path_codes.setdefault(code, []).append(
+          self.path_ids[path_id])
+
+  def _set_task_code(self, task_id, code):
+    """Change a task's state, leaving the change to be reported."""
     with self.lock:
-      self.tasks_by_state[self.task_states[task]].discard(task)
-      self.task_states[task] = state
-      self.tasks_by_state[state].add(task)
-    if state == _TaskState.stopped:
-      self.callbacks.on_task_stopped(self.tracker, task)
-    elif state == _TaskState.running:
-      self.callbacks.on_task_running(self.tracker, task)
-
-  def _replace_task_tags(self, task, tags):
+      self.task_codes[task_id] = code
+      self._enqueue_if_ready(task_id)
+      self.unreported_task_codes.setdefault(code, []).append(
+          self.task_ids[task_id])
+
+  def _report_state_changes(self):
+    """Report the state changes made since the last report to the callbacks,
+    with a call per state."""
     with self.lock:
-      self.tracker = self.tracker.replaced(
-          old_tasks=[task],
-          new_tagged_tasks={task:tags})
+      if not (self.unreported_path_codes or self.unreported_task_codes):
+        return
+      tracker = self.tracker
+      task_changes = self.unreported_task_codes
+      path_changes = self.unreported_path_codes
+      self.unreported_task_codes = collections.OrderedDict()
+      self.unreported_path_codes = collections.OrderedDict()
+    for (code, tasks) in task_changes.items():
+      self.callbacks.on_tasks_state_changed(
+          tracker, _TASK_STATES[code], tuple(tasks))
+    for (code, paths) in path_changes.items():
+      self.callbacks.on_paths_state_changed(
+          tracker, _PATH_STATES[code], tuple(paths))
 
   def _handle_events(self, events):
     """Applies the events.
 
+    Each event's changes to the tracker are made in a single transaction, so
+    that an event publishes at most one new tracker no matter how many paths
+    and tasks it regenerates. Selectors and regenerators of an event all see
+    the tracker as it was before the event.
+
     Note: does not handle the events beyond applying them, e.g. does not run
     tasks for newly outdated paths. Not thread safe.
 
@@ -209,62 +467,145 @@ class _TrackerRunner(object):
     with self.lock:
       for event in events:
         self.callbacks.on_event(self.tracker, event)
+        transaction = self.tracker.transaction()
+        paths = ()
+        removed_paths = ()
+        new_new_paths = ()
         if event.path_selector is not None:
-          paths = set(event.path_selector(self.tracker))
+          paths = _selectors.select(event.path_selector, self.tracker)
           if event.path_regenerator is not None:
             new_paths = set(event.path_regenerator(self.tracker, paths))
             # replace paths with new_paths both in the tracker and in this scope
             removed_paths = paths.difference(new_paths)
             new_new_paths = new_paths.difference(paths)
-            for path in removed_paths:
-              self._remove_path(path)
-            for path in new_new_paths:
-              self._add_path(path, event.flags.paths_state)
+            transaction.remove_paths(removed_paths)
+            transaction.add_paths(new_new_paths)
             paths = new_paths
-          # Note that we only allow transitions to the 'updated' from
-          # 'updating', in which case we consider the state transition as being
-          # from 'updating' to `up_to_date`, else it's a reset to 'outdated'.
-          if event.flags.paths_state == _PathState.updated:
-            for path in paths:
-              if self.path_states[path] == _PathState.updating:
-                self._set_path_state(path, _PathState.up_to_date)
-              else:
-                self._set_path_state(path, _PathState.outdated)
-          else:
-            for path in paths:
-              self._set_path_state(path, event.flags.paths_state)
+        removed_tasks = ()
+        new_new_tasks = ()
         if event.task_selector is not None:
-          tasks = set(event.task_selector(self.tracker))
+          tasks = _selectors.select(event.task_selector, self.tracker)
           if event.task_regenerator is not None:
             new_tasks = set(event.task_regenerator(self.tracker, tasks))
             removed_tasks = tasks.difference(new_tasks)
             new_new_tasks = new_tasks.difference(tasks)
             for task in removed_tasks:
-              self._remove_task(task)
-              if event.flags.removed_tasks_outdate_paths:
-                for path in task.output_paths():
-                  self._set_path_state(path, _PathState.outdated)
-            for task in new_new_tasks:
-              self._add_task(task)
+              self._remove_task(task, transaction)
+            transaction.add_tasks(new_new_tasks)
             tasks = new_tasks
           if event.flags.tasks_tags is not None:
-            for task in tasks:
-              self._replace_task_tags(task, event.flags.tasks_tags)
+            transaction.retag_tasks(tasks, event.flags.tasks_tags)
+        self.tracker = transaction.commit()
+
+        for path in removed_paths:
+          self._remove_path(path)
+        for path in new_new_paths:
+          self._add_path(path, event.flags.paths_state)
+        # Note that we only allow transitions to the 'updated' from
+        # 'updating', in which case we consider the state transition as being
+        # from 'updating' to `up_to_date`, else it's a reset to 'outdated'.
+        if event.flags.paths_state == _PathState.updated:
+          for path in paths:
+            path_id = self._tracked_path_id(path)
+            if self.path_codes[path_id] == _UPDATING:
+              self._set_path_code(path_id, _UP_TO_DATE)
+            else:
+              self._set_path_code(path_id, _OUTDATED)
+        else:
+          code = _PATH_STATE_CODES[event.flags.paths_state]
+          for path in paths:
+            self._set_path_code(self._tracked_path_id(path), code)
+        for task in new_new_tasks:
+          self._add_task(task)
+        if event.flags.removed_tasks_outdate_paths:
+          for task in removed_tasks:
+            for path in task.output_paths():
+              self._set_path_code(self._tracked_path_id(path), _OUTDATED)
+        self._report_state_changes()
     return []
 
-  def _run_task_handle_updated_event(self, task, event_deque):
+  def _coalesce_events(self, events):
+    """Merge runs of consecutive events that only set the states of paths.
+
+    Such events don't change the tracker, so within a run each path ends up in
+    the state that the last of the run's events selecting it leaves it in. The
+    run is replaced by events setting the paths straight to those states, in
+    the order the paths were last selected, leaving out the paths that end up
+    as they started. Other events stay as they are, in place.
+
+    Where a run starts depends on the events before it, so this is a
+    generator for `_handle_events`: a run is merged only once it has applied
+    the events before it, and merged runs are applied before what follows
+    them is looked at."""
+    run = []
+    for event in events:
+      if _only_sets_path_states(event):
+        run.append(event)
+        continue
+      for merged_event in self._merge_path_state_events(run):
+        yield merged_event
+      run = []
+      yield event
+    for merged_event in self._merge_path_state_events(run):
+      yield merged_event
+
+  def _merge_path_state_events(self, events):
+    if len(events) < 2:
+      return events
+    final_states = collections.OrderedDict()
+    for event in events:
+      state = event.flags.paths_state
+      for path in event.path_selector(self.tracker):
+        if path in final_states:
+          old_state = final_states.pop(path)
+        else:
+          old_state = self._path_state(path)
+        # as `_handle_events` treats `updated`
+        if state == _PathState.updated:
+          final_states[path] = (_PathState.up_to_date
+                                if old_state == _PathState.updating
+                                else _PathState.outdated)
+        else:
+          final_states[path] = state
+    hint_local = all(event.flags.hint_local for event in events)
+    merged = []
+    paths = []
+    for (path, state) in final_states.items():
+      current_state = self._path_state(path)
+      if current_state is not None and current_state == state:
+        continue
+      if paths and state != merged_state:
+        merged.append(_path_state_event(paths, merged_state, hint_local))
+        paths = []
+      paths.append(path)
+      merged_state = state
+    if paths:
+      merged.append(_path_state_event(paths, merged_state, hint_local))
+    return merged
+
+  def _handle_task_done(self, task_id, error, event_queue, restored=False):
+    """Report a finished task's outcome; called from the executor.
+
+    `restored` tasks had their outputs restored by the action cache rather
+    than running."""
     with self.lock:
-      self._set_task_state(task, _TaskState.running)
-    successful = False
-    try:
-      task.run()
-      successful = True
-    except Exception as e:
-      self.callbacks.on_task_failed(self.tracker, task, e)
-      self.failures_deque.append(e)
-    # the deque structure doesn't need locking! woo!
-    if successful:
-      event_deque.append(
+      task = self.task_ids[task_id]
+      self.running_counts[self.task_executors.pop(task_id)] -= 1
+      self.resource_budget.release(self.task_resources.pop(task_id))
+      seconds = time.time() - self.task_start_times.pop(task_id)
+      if self.trace is not None:
+        (lane, started, waited) = self.task_lanes.pop(task_id)
+        self.trace.task_span(task, lane, started, {
+            'waited for dispatch (ms)': waited * 1e3,
+            'restored': restored,
+            'error': None if error is None else repr(error)})
+    if not restored:
+      self.scheduling_policy.on_task_finished(task, seconds, error)
+    if error is not None:
+      self.callbacks.on_task_failed(self.tracker, task, error)
+      self.failures_deque.append(error)
+    if error is None:
+      event_queue.put(
           _event.Event(
               path_selector=lambda ignored_tracker: task.output_paths(),
               flags=_event.EventFlags(
@@ -272,7 +613,7 @@ class _TrackerRunner(object):
                   paths_state=_PathState.updated)
           ))
     else:
-      event_deque.append(
+      event_queue.put(
           _event.Event(
               path_selector=lambda ignored_tracker: task.output_paths(),
               flags=_event.EventFlags(
@@ -280,46 +621,126 @@ class _TrackerRunner(object):
                   paths_state=_PathState.poisoned)
           ))
     with self.lock:
-      if self.task_states[task] == _TaskState.zombie:
-        self._remove_task(task)
+      if self.task_codes[task_id] == _ZOMBIE:
+        self.tracker = self.tracker.replaced(old_tasks=[task])
+        self._forget_task(task_id)
       else:
-        self._set_task_state(task, _TaskState.stopped)
-
-  def _dispatch_task(self, task, event_deque):
-    event_deque.append(
-        _event.Event(
-            path_selector=lambda ignored_tracker: task.output_paths(),
-            flags=_event.EventFlags(
-                hint_local=True,
-                paths_state=_PathState.updating)
-        ))
-    threading.Thread(
-        target=self._run_task_handle_updated_event,
-        args=(task, event_deque)
-    ).start()
-
-  def _run_update(self, event_deque):
-    """Begin running a round of tasks to update paths."""
-    available_tasks = set(self.tasks_by_state[_TaskState.stopped])
-    available_paths = set(self.paths_by_state[_PathState.outdated])
-    nixed_paths = set()
-    for path in available_paths:
-      if path not in nixed_paths:
-        for task in available_tasks:
-          if path in task.output_paths() and reduce(
-              lambda a, b: a and b,
-              (self.path_states[input_path] == _PathState.up_to_date
-               for input_path in task.input_paths()), True):
-            # if we are here then we know that this task updates the outdated
-            # path and all of its inputs are up to date.
-            nixed_paths.update(set(task.output_paths()))
-            self._dispatch_task(task, event_deque)
+        self._set_task_code(task_id, _STOPPED)
+    self._report_state_changes()
+    # stopping may have made the task ready again, and the executor and budget
+    # have room
+    event_queue.wake()
+
+  def _executor_for(self, task):
+    """Get the executor of the first tagged executor the task has the tag of.
+
+    Falls back to the default executor."""
+    if self.tagged_executors:
+      tags = self.tracker.task_tags(task)
+      for (tag, executor) in self.tagged_executors:
+        if tag in tags:
+          return executor
+    return self.executor
+
+  def _dispatch_task(self, task_id, amounts, event_queue):
+    """Start running a task holding some amounts of the resource budget.
+
+    The task and its outputs leave the states that made it ready immediately,
+    so that neither it nor other producers of its outputs are dispatched again
+    in the meantime."""
+    task = self.task_ids[task_id]
+    if self.trace is not None:
+      now = self.trace.now()
+      self.task_lanes[task_id] = (
+          self.trace.acquire_lane(), now,
+          now - self.task_ready_times.pop(task_id, now))
+    self.resource_budget.acquire(amounts)
+    self.task_resources[task_id] = amounts
+    self._set_task_code(task_id, _RUNNING)
+    for path_id in self.task_outputs.values(task_id):
+      if self.path_codes[path_id] != _ABSENT:
+        self._set_path_code(path_id, _UPDATING)
+    executor = self._executor_for(task)
+    self.running_counts[executor] += 1
+    self.task_executors[task_id] = executor
+    self.task_start_times[task_id] = time.time()
+    if (self.action_cache is None or _action_cache.NON_CACHEABLE_TAG in
+        self.tracker.task_tags(task)):
+      executor.submit(
+          task,
+          lambda error: self._handle_task_done(task_id, error, event_queue))
+    else:
+      _run_through_cache(
+          self.action_cache, self.cache_lookup_executor, executor, task,
+          lambda error, restored: self._handle_task_done(
+              task_id, error, event_queue, restored))
+
+  def _run_update(self, event_queue):
+    """Begin running ready tasks while their executors have room for them.
+
+    Ready tasks are packed into what's left of the resource budget in priority
+    order: a task that doesn't fit waits for running tasks to release enough,
+    while lower priority tasks that do fit start in the meantime.
+
+    We do not directly support multiple tasks producing the same path; only
+    the first of them to become ready is run."""
+    with self.lock:
+      # Dispatching may ready tasks for executors we've already been through.
+      dispatched = True
+      while dispatched:
+        dispatched = False
+        for (executor, ready_tasks) in list(self.ready_tasks.items()):
+          capacity = executor.capacity()
+          unfit_entries = []
+          while ready_tasks and (
+              capacity is None or self.running_counts[executor] < capacity):
+            entry = heapq.heappop(ready_tasks)
+            (task_id, task) = entry[2:]
+            if self.task_ids[task_id] is not task:
+              # the task was removed since, and its id may be another's now
+              continue
+            if not self._is_task_ready(task_id):
+              self.task_queued[task_id] = 0
+              continue
+            amounts = self.resource_budget.clamp(task.resources())
+            if not self.resource_budget.fits(amounts):
+              unfit_entries.append(entry)
+              continue
+            self.task_queued[task_id] = 0
+            self._dispatch_task(task_id, amounts, event_queue)
+            dispatched = True
+          for entry in unfit_entries:
+            heapq.heappush(ready_tasks, entry)
+        self._report_state_changes()
+
+  def _trace_counters(self, event_count):
+    with self.lock:
+      ready = sum(len(ready_tasks) for ready_tasks in self.ready_tasks.values())
+      running = len(self.task_start_times)
+    self.trace.counter('queue depth', {'events': event_count,
+                                       'ready tasks': ready})
+    self.trace.counter('running tasks', {'running tasks': running})
+
+  def _shutdown(self):
+    """Stop the runner's own workers, once lookups under way are done."""
+    if self.cache_lookup_executor is not None:
+      self.cache_lookup_executor.shutdown()
+
+  def _record_states(self):
+    """Record the path states to the state store, if there's one."""
+    if self.state_store is not None:
+      with self.lock:
+        (tracker, path_states) = (self.tracker, self._path_states())
+      self.state_store.record(tracker, path_states)
 
   def _up_to_date(self):
-    return reduce(
-        lambda a, b: a and b,
-        (state == _PathState.up_to_date or state == _PathState.poisoned
-         for state in self.path_states.values()), True)
+    """Whether or not all paths are either up to date or poisoned.
+
+    Answered from the numbers of paths in each state in constant time."""
+    with self.lock:
+      return (self.path_state_counts[_UP_TO_DATE] +
+              self.path_state_counts[_POISONED] ==
+              sum(self.path_state_counts))
 
   def run(self, runner_event_iterator):
     """Run the passed tracker.
@@ -335,55 +756,140 @@ class _TrackerRunner(object):
         that the tracker's tasks will continue to run as long as this iterator
         is live.
     """
-    runner_event_deque = collections.deque()
+    runner_event_queue = _event.EventQueue()
     runner_event_poll_thread = threading.Thread(
         target=_run_tracker_poll_event_iterator,
-        args=(runner_event_iterator, runner_event_deque))
+        args=(runner_event_iterator, runner_event_queue))
     runner_event_poll_thread.start()
-    runner_events = []
+    # Sleep until a task finishes, an event arrives or the iterator ends.
+    while not self._advance(runner_event_queue):
+      runner_event_queue.wait()
+
+  def _advance(self, event_queue):
+    """Handle queued events and dispatch ready tasks until we'd have to wait.
+
+    Returns:
+      Whether or not the run is over.
 
-    # Pump the queue's initial events
+    Raises:
+      RunnerError: if tasks failed and the run shouldn't go on because of it, or
+        if it's over and tasks failed."""
     while True:
-      try:
-        runner_events.append(runner_event_deque.popleft())
-      except:
-        break
-    all_up_to_date = self._up_to_date()
-
-    # There's no race condition here w.r.t. the poll thread and empty initial
-    # queues, because as long as the thread is alive, we'll run, and if the
-    # thread is dead, even if runner_events is empty, it will have filled
-    # runner_event_deque if there were any events to be processed.  Furthermore,
-    # the interpreter will evaluate the terms left to right, so the ordering of
-    # events is maintained.
-    while (runner_event_poll_thread.is_alive() or len(runner_events) > 0 or
-           len(runner_event_deque) > 0 or not all_up_to_date):
+      # The queue tells us whether it was closed before we took its events, so
+      # if it was, and there's nothing left to do after handling them, no event
+      # can have slipped in between.
+      runner_events, closed = event_queue.drain()
       if len(self.failures_deque) > 0 and not self.keep_going:
         raise RunnerError(self.failures_deque)
-      runner_events = self._handle_events(runner_events)
+      trace = self.trace
+      if trace is not None:
+        started = trace.now()
+      self._handle_events(self._coalesce_events(runner_events))
+      if trace is not None:
+        trace.runner_span('handle events', started,
+                          {'events': len(runner_events)})
+        started = trace.now()
       # Now run the tasks that we know affect targets that are out of date. We
       # do not directly support multiple tasks producing the same path; that has
       # to be handled a layer above us via user event generators (and really
       # only for cycle-inducing tasks).
-      self._run_update(runner_event_deque)
-
-      # Pump the queue
-      while True:
-        try:
-          runner_events.append(runner_event_deque.popleft())
-        except:
-          break
+      self._run_update(event_queue)
+      if trace is not None:
+        trace.runner_span('run update', started)
+        self._trace_counters(len(runner_events))
+      if len(event_queue) > 0:
+        continue
       all_up_to_date = self._up_to_date()
-      if (runner_event_poll_thread.is_alive() and all_up_to_date and
-          len(runner_events) == 0 and len(runner_event_deque) == 0):
+      if closed and all_up_to_date:
+        if len(self.failures_deque) > 0:
+          raise RunnerError(self.failures_deque)
+        return True
+      if all_up_to_date:
         self.callbacks.on_event_wait(self.tracker)
-
-    if len(self.failures_deque) > 0:
-      raise RunnerError(self.failures_deque)
+      return False
 
 
 def run_tracker(tracker, runner_event_iterator, outdated=False,
-                keep_going=False, callbacks=RunnerCallbacks()):
-  tracker_runner = _TrackerRunner(
-      tracker, outdated=outdated, keep_going=keep_going, callbacks=callbacks)
-  return tracker_runner.run(runner_event_iterator)
+                keep_going=False, callbacks=RunnerCallbacks(),
+                max_workers=None, executor=None, tagged_executors=(),
+                scheduling_policy=None, resource_budget=None,
+                state_store=None, action_cache=None, dispatch_callbacks=None,
+                trace=None):
+  """Run a tracker's tasks until its paths are up to date.
+
+  Arguments:
+    tracker (interfaces.Tracker): the tracker to run.
+    runner_event_iterator (iterator): an iterator over Event objects; the run
+      lasts at least as long as this iterator does.
+    outdated (bool): whether all paths start outdated (else up to date); with a
+      `state_store`, only those paths it has no record of.
+    keep_going (bool): whether to keep running other tasks after a failure.
+    callbacks (RunnerCallbacks): callbacks for the progress of the run.
+    max_workers (int): the number of threads to run tasks on. Tasks that are
+      ready while all threads are busy wait for one to free up. If None (and
+      there's no `executor`), every task gets a thread of its own, except for
+      `subprocesses.CommandTask`s, whose processes are all waited on from one
+      thread (see `subprocesses.SubprocessExecutor`).
+    executor (executor.Executor): what to run tasks with, in place of a thread
+      pool of `max_workers`. The caller keeps ownership of it (it isn't shut
+      down at the end of the run).
+    tagged_executors (iterable): 2-sequences of tags and `executor.Executor`s.
+      A task runs on the executor of the first pair whose tag it has (e.g. a
+      `executor.ProcessPoolExecutor` for CPU-bound tasks), or on the default
+      executor if it has none of the tags. These are owned by the caller.
+    scheduling_policy (scheduling.SchedulingPolicy): which ready tasks to start
+      first when more are ready than their executor has room for; defaults to
+      `scheduling.FifoPolicy`. See also `scheduling.CriticalPathPolicy`.
+    resource_budget (dict): resource names to the amounts that running tasks
+      may hold together (see `interfaces.Task.resources`), e.g.
+      `resources.host_budget()` or {'db_connections': 4}. Tasks needing more
+      than is left wait for it; resources not named are unlimited.
+    state_store (state_store.StateStore): where to start the path states from,
+      and to record them to when the run ends (whether or not it succeeded),
+      so that the next run only redoes what's stale.
+    action_cache (action_cache.ActionCache): consulted before running each
+      task, so that tasks whose outputs it can restore don't run; e.g. a
+      `scripting.cache.LocalActionCache` or a
+      `scripting.remote_cache.RemoteActionCache`. Tasks tagged
+      `action_cache.NON_CACHEABLE_TAG` bypass it.
+    dispatch_callbacks (str): if given, `callbacks` are called from a thread
+      of their own rather than from the runner's, through a queue of
+      `callbacks.DEFAULT_MAX_QUEUED` calls that overflows as this
+      `callbacks.Overflow` policy says (see `callbacks.DispatchedCallbacks`).
+      Exceptions they raise then fail the run once it's over.
+    trace (trace.TraceRecorder): records the run's timeline, to be written
+      as a Chrome trace once it's over.
+  """
+  if max_workers is not None and executor is not None:
+    raise ValueError('expected at most one of `max_workers` and `executor`')
+  owned_executor = None
+  if max_workers is not None:
+    owned_executor = executor = _executor.ThreadPoolExecutor(max_workers)
+  elif executor is None:
+    owned_executor = executor = _subprocesses.SubprocessExecutor()
+  owned_callbacks = None
+  try:
+    if dispatch_callbacks is not None:
+      owned_callbacks = callbacks = _callbacks.DispatchedCallbacks(
+          callbacks, overflow=dispatch_callbacks)
+    tracker_runner = _TrackerRunner(
+        tracker, outdated=outdated, keep_going=keep_going, callbacks=callbacks,
+        executor=executor, tagged_executors=tagged_executors,
+        scheduling_policy=scheduling_policy, resource_budget=resource_budget,
+        state_store=state_store, action_cache=action_cache, trace=trace)
+    try:
+      tracker_runner.run(runner_event_iterator)
+    finally:
+      tracker_runner._record_states()
+      tracker_runner._shutdown()
+  finally:
+    if owned_executor is not None:
+      owned_executor.shutdown()
+    if scheduling_policy is not None:
+      scheduling_policy.on_run_finished()
+    if action_cache is not None:
+      action_cache.on_run_finished()
+    if owned_callbacks is not None:
+      owned_callbacks.close()
+  if owned_callbacks is not None and owned_callbacks.errors:
+    raise RunnerError(owned_callbacks.errors)
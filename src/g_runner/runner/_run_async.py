@@ -0,0 +1,161 @@
+"""Running trackers on an asyncio event loop (requires Python 3)."""
+
+import asyncio
+import threading
+
+from g_runner.runner import _event
+from g_runner.runner import _run
+from g_runner.runner import callbacks as _callbacks
+from g_runner.runner import executor as _executor
+from g_runner.runner import subprocesses as _subprocesses
+
+
+def _poll_async_event_iterator(loop, event_iterator, out_event_queue):
+  """Feed the events of an asynchronous iterator to the queue from the loop."""
+  iterator = event_iterator.__aiter__()
+
+  def next_event():
+    asyncio.ensure_future(
+        iterator.__anext__(), loop=loop).add_done_callback(got_event)
+
+  def got_event(future):
+    if not future.cancelled() and future.exception() is None:
+      out_event_queue.put(future.result())
+      next_event()
+      return
+    if (not future.cancelled() and
+        not isinstance(future.exception(), StopAsyncIteration)):
+      loop.call_exception_handler({
+          'message': 'runner event iterator failed',
+          'exception': future.exception(),
+      })
+    out_event_queue.close()
+
+  next_event()
+
+
+def _running_loop():
+  get_running_loop = getattr(asyncio, 'get_running_loop', None)
+  if get_running_loop is None:
+    # Before Python 3.7, where the current loop is the running one if any.
+    return asyncio.get_event_loop()
+  return get_running_loop()
+
+
+def run_tracker_async(tracker, runner_event_iterator, outdated=False,
+                      keep_going=False, callbacks=_run.RunnerCallbacks(),
+                      executor=None, tagged_executors=(),
+                      scheduling_policy=None, resource_budget=None,
+                      state_store=None, action_cache=None,
+                      dispatch_callbacks=None, trace=None, loop=None):
+  """Run a tracker's tasks on an asyncio event loop.
+
+  The counterpart of `run_tracker`: scheduling happens on the loop whenever a
+  task finishes or an event arrives, and no thread is needed to wait on either.
+
+  Arguments:
+    runner_event_iterator: an asynchronous iterator over Event objects (polled
+      on the loop), or a plain iterator (polled on a thread of its own).
+    executor (executor.Executor): what to run tasks with; defaults to an
+      `executor.AsyncioExecutor` on `loop`, so that tasks whose `run` is a
+      coroutine run on the loop, `subprocesses.CommandTask`s' processes are
+      waited on from a single thread, and the others each run on a thread.
+    loop (asyncio.AbstractEventLoop): the loop to run on; defaults to the
+      running loop, so must be given unless called on the loop (e.g. from a
+      coroutine).
+    Other arguments are as for `run_tracker`.
+
+  Returns:
+    An asyncio.Future that's done when the run is, with the `RunnerError` of
+    failed tasks as its exception if any.
+
+  Raises:
+    RuntimeError: if `loop` isn't given and no loop is running.
+  """
+  if loop is None:
+    loop = _running_loop()
+  owned_executor = None
+  if executor is None:
+    owned_executor = executor = _subprocesses.SubprocessExecutor(
+        _executor.AsyncioExecutor(loop))
+  owned_callbacks = None
+  if dispatch_callbacks is not None:
+    owned_callbacks = callbacks = _callbacks.DispatchedCallbacks(
+        callbacks, overflow=dispatch_callbacks)
+  tracker_runner = _run._TrackerRunner(
+      tracker, outdated=outdated, keep_going=keep_going, callbacks=callbacks,
+      executor=executor, tagged_executors=tagged_executors,
+      scheduling_policy=scheduling_policy, resource_budget=resource_budget,
+      state_store=state_store, action_cache=action_cache, trace=trace)
+  finished = loop.create_future()
+  finished.add_done_callback(
+      lambda unused_future: tracker_runner._record_states())
+  if scheduling_policy is not None:
+    finished.add_done_callback(
+        lambda unused_future: scheduling_policy.on_run_finished())
+  def finish_caching():
+    # Lookups under way after a failure may still record to the cache.
+    tracker_runner._shutdown()
+    action_cache.on_run_finished()
+  if action_cache is not None:
+    finished.add_done_callback(
+        lambda unused_future: loop.run_in_executor(None, finish_caching))
+  if owned_executor is not None:
+    # Shutting down waits for processes still running after a failure.
+    finished.add_done_callback(
+        lambda unused_future: loop.run_in_executor(
+            None, owned_executor.shutdown))
+  # Wakeups that arrive while a step is pending are folded into that step.
+  step_lock = threading.Lock()
+  step_pending = [False]
+
+  def step():
+    with step_lock:
+      step_pending[0] = False
+    if finished.done():
+      return
+    try:
+      if tracker_runner._advance(event_queue):
+        finished.set_result(None)
+    except Exception as e:
+      finished.set_exception(e)
+
+  def schedule_step():
+    with step_lock:
+      if step_pending[0]:
+        return
+      step_pending[0] = True
+    loop.call_soon_threadsafe(step)
+
+  event_queue = _event.EventQueue(on_wake=schedule_step)
+  if hasattr(runner_event_iterator, '__aiter__'):
+    _poll_async_event_iterator(loop, runner_event_iterator, event_queue)
+  else:
+    threading.Thread(
+        target=_run._run_tracker_poll_event_iterator,
+        args=(runner_event_iterator, event_queue)).start()
+  schedule_step()
+  if owned_callbacks is None:
+    return finished
+  # The run is over once the queued callbacks have been made; waiting for them
+  # mustn't hold up the loop.
+  done = loop.create_future()
+
+  def callbacks_closed(unused_future):
+    if done.done():
+      return
+    if finished.cancelled():
+      done.cancel()
+    elif finished.exception() is not None:
+      done.set_exception(finished.exception())
+    elif owned_callbacks.errors:
+      done.set_exception(_run.RunnerError(owned_callbacks.errors))
+    else:
+      done.set_result(None)
+
+  finished.add_done_callback(
+      lambda unused_future: loop.run_in_executor(
+          None, owned_callbacks.close).add_done_callback(callbacks_closed))
+  done.add_done_callback(
+      lambda unused_future: finished.cancel() if done.cancelled() else None)
+  return done
@@ -0,0 +1,193 @@
+import threading
+import unittest
+
+try:
+  import asyncio
+except ImportError:
+  asyncio = None
+
+from g_runner import interfaces
+from g_runner import runner
+from g_runner.runner import executor
+from g_runner.runner import tracker as _tracker
+
+
+class CoroutineTask(interfaces.Task):
+  """Its `run` returns a coroutine, as a ScriptedTask of an async def would."""
+
+  def __init__(self, inputs, outputs, error=None):
+    self.inputs = tuple(inputs)
+    self.outputs = tuple(outputs)
+    self.error = error
+    self.threads = []
+    self.awaited_count = 0
+
+  def run(self):
+    self.threads.append(threading.current_thread())
+    return self._run()
+
+  def _run(self):
+    # A generator-based awaitable, so the module still compiles on Python 2.
+    yield
+    self.threads.append(threading.current_thread())
+    self.awaited_count += 1
+    if self.error is not None:
+      raise self.error
+
+  def input_paths(self):
+    return self.inputs
+
+  def output_paths(self):
+    return self.outputs
+
+  def __eq__(self, other):
+    return self is other
+
+  def __hash__(self):
+    return id(self)
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+
+class _Awaitable(object):
+
+  def __init__(self, generator):
+    self.generator = generator
+
+  def __await__(self):
+    return self.generator
+
+
+class AwaitableTask(CoroutineTask):
+
+  def run(self):
+    return _Awaitable(super(AwaitableTask, self).run())
+
+
+class AsyncEventIterator(object):
+
+  def __init__(self, loop, events):
+    self.loop = loop
+    self.events = list(events)
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    future = self.loop.create_future()
+    if self.events:
+      future.set_result(self.events.pop(0))
+    else:
+      future.set_exception(StopAsyncIteration())
+    return future
+
+
+def up_to_date_event(path):
+  return runner.Event(
+      path_selector=lambda unused_tracker: [path],
+      flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+
+
+@unittest.skipIf(asyncio is None, 'asyncio needs Python 3')
+class RunTrackerAsyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+
+  def tearDown(self):
+    self.loop.close()
+
+  def test_line_run_awaits_on_loop(self):
+    task12 = AwaitableTask([(1,)], [(2,)])
+    task23 = AwaitableTask([(2,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,), (3,)], new_tasks=[task12, task23])
+    self.loop.run_until_complete(runner.run_tracker_async(
+        tracker, AsyncEventIterator(self.loop, [up_to_date_event((1,))]),
+        outdated=True, loop=self.loop))
+    self.assertEqual(1, task12.awaited_count)
+    self.assertEqual(1, task23.awaited_count)
+    loop_thread = threading.current_thread()
+    self.assertNotEqual(loop_thread, task12.threads[0])
+    self.assertEqual(loop_thread, task12.threads[1])
+
+  def test_defaults_to_the_running_loop(self):
+    task12 = AwaitableTask([(1,)], [(2,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,)], new_tasks=[task12])
+    self.assertRaises(RuntimeError, runner.run_tracker_async, tracker, [])
+    finished = self.loop.create_future()
+    def start():
+      run = runner.run_tracker_async(
+          tracker, [up_to_date_event((1,))], outdated=True)
+      run.add_done_callback(
+          lambda run: finished.set_result(run.exception()))
+    self.loop.call_soon(start)
+    self.assertIsNone(self.loop.run_until_complete(finished))
+    self.assertEqual(1, task12.awaited_count)
+
+  def test_plain_event_iterator(self):
+    task12 = AwaitableTask([(1,)], [(2,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,)], new_tasks=[task12])
+    self.loop.run_until_complete(runner.run_tracker_async(
+        tracker, [up_to_date_event((1,))], outdated=True, loop=self.loop))
+    self.assertEqual(1, task12.awaited_count)
+
+  def test_failure_is_raised(self):
+    error = Exception('failed')
+    task12 = AwaitableTask([(1,)], [(2,)], error=error)
+    task23 = AwaitableTask([(2,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,), (3,)], new_tasks=[task12, task23])
+    with self.assertRaises(runner.RunnerError):
+      self.loop.run_until_complete(runner.run_tracker_async(
+          tracker, AsyncEventIterator(self.loop, [up_to_date_event((1,))]),
+          outdated=True, loop=self.loop))
+    self.assertEqual(1, task12.awaited_count)
+    self.assertEqual(0, task23.awaited_count)
+
+  def test_plain_tasks_run_on_executor(self):
+    task12 = CoroutineTask([(1,)], [(2,)])
+    task12.run = lambda: task12.threads.append(threading.current_thread())
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,)], new_tasks=[task12])
+    pool = executor.ThreadPoolExecutor(1)
+    try:
+      self.loop.run_until_complete(runner.run_tracker_async(
+          tracker, AsyncEventIterator(self.loop, [up_to_date_event((1,))]),
+          outdated=True, executor=executor.AsyncioExecutor(self.loop, pool),
+          loop=self.loop))
+    finally:
+      pool.shutdown()
+    self.assertEqual(1, len(task12.threads))
+    self.assertNotEqual(threading.current_thread(), task12.threads[0])
+
+  def test_dispatched_callbacks(self):
+    class UpToDateCallbacks(runner.RunnerCallbacks):
+      def __init__(self):
+        self.threads = set()
+        self.paths = []
+      def on_path_up_to_date(self, tracker, path):
+        self.threads.add(threading.current_thread())
+        self.paths.append(path)
+    task12 = AwaitableTask([(1,)], [(2,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,)], new_tasks=[task12])
+    callbacks = UpToDateCallbacks()
+    self.loop.run_until_complete(runner.run_tracker_async(
+        tracker, AsyncEventIterator(self.loop, [up_to_date_event((1,))]),
+        outdated=True, callbacks=callbacks, dispatch_callbacks='block',
+        loop=self.loop))
+    # every call was made, from the dispatching thread, by the time it's over
+    self.assertEqual([(1,), (2,)], callbacks.paths)
+    self.assertEqual(1, len(callbacks.threads))
+    self.assertNotIn(threading.current_thread(), callbacks.threads)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
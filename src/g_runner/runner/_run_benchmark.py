@@ -0,0 +1,149 @@
+"""Timings of the runner's main loop.
+
+Covers the cost of an idle loop iteration against path count, the CPU used
+while waiting on the event iterator, and the latency from an event arriving to
+the task it readies starting.
+
+Run with `python -m g_runner.runner._run_benchmark`."""
+
+import os
+import time
+import timeit
+
+from g_runner import runner
+from g_runner.runner import _event
+from g_runner.runner import _run
+from g_runner.runner import _run_test
+from g_runner.runner import tracker as _tracker
+
+
+def _scan_up_to_date(tracker_runner):
+  """The completion check as a scan over all path states, for comparison."""
+  return all(code == _run._UP_TO_DATE or code == _run._POISONED or
+             code == _run._ABSENT for code in tracker_runner.path_codes)
+
+
+def _loop_iteration(tracker_runner, event_queue):
+  tracker_runner._handle_events([])
+  tracker_runner._run_update(event_queue)
+  return tracker_runner._up_to_date()
+
+
+class _StartTimesTask(_run_test.TestTask):
+
+  def __init__(self, task_name, inputs, outputs, start_times):
+    super(_StartTimesTask, self).__init__(task_name, inputs, outputs)
+    self.start_times = start_times
+
+  def run(self):
+    self.start_times.append(time.time())
+
+
+def _idle_cpu(seconds):
+  """CPU seconds used by a run only waiting on its event iterator."""
+  def idle_events():
+    time.sleep(seconds)
+    return
+    yield
+  tracker = _tracker.Tracker().replaced(new_paths=[(1,)])
+  times_before = os.times()
+  runner.run_tracker(tracker, idle_events())
+  times_after = os.times()
+  return (times_after[0] - times_before[0]) + (times_after[1] - times_before[1])
+
+
+def _wake_latencies(samples):
+  """Seconds from an event outdating a path to its producer starting."""
+  start_times = []
+  event_times = []
+  tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,)],
+      new_tasks=[_StartTimesTask('12', [(1,)], [(2,)], start_times)])
+  def outdating_events():
+    for i in range(samples):
+      time.sleep(0.01)
+      event_times.append(time.time())
+      yield runner.Event(
+          path_selector=lambda unused_tracker: [(2,)],
+          flags=runner.EventFlags(paths_state=runner.PathState.outdated))
+  runner.run_tracker(tracker, outdating_events())
+  return sorted(start - event for (start, event) in
+                zip(start_times, event_times))
+
+
+def _fan_out_seconds(width, max_workers):
+  """Wall time of running `width` trivial tasks that become ready at once."""
+  paths = [(i,) for i in range(width + 1)]
+  tasks = [_StartTimesTask(str(i), [paths[0]], [paths[i]], [])
+           for i in range(1, width + 1)]
+  tasks.append(_StartTimesTask('root', [], [paths[0]], []))
+  tracker = _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+  start = time.time()
+  runner.run_tracker(tracker, [], outdated=True, max_workers=max_workers)
+  return time.time() - start
+
+
+def _state_bytes_per_path(path_count):
+  """Bytes of runner state per path of a chain of tasks, or None where
+  tracemalloc is unavailable."""
+  try:
+    import tracemalloc
+  except ImportError:
+    return None
+  paths = [('src', str(i // 100), str(i)) for i in range(path_count)]
+  tasks = [_run_test.TestTask(str(i), [paths[i - 1]], [paths[i]])
+           for i in range(1, path_count)]
+  tracker = _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+  _tracker.is_tracker_valid(tracker)
+  tracemalloc.start()
+  try:
+    tracker_runner = _run._TrackerRunner(tracker, outdated=True)
+    (size, unused_peak) = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return size / float(path_count)
+
+
+def _state_change_seconds(path_count):
+  """Seconds per path state change of paths read by one task each."""
+  paths = [(i,) for i in range(path_count)]
+  tasks = [_run_test.TestTask(str(i), [paths[i - 1]], [paths[i]])
+           for i in range(1, path_count)]
+  tracker = _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+  tracker_runner = _run._TrackerRunner(tracker, outdated=True)
+  start = time.time()
+  for path in paths:
+    tracker_runner._set_path_state(path, _run._PathState.poisoned)
+  return (time.time() - start) / path_count
+
+
+def main():
+  print('idle CPU over 2s of waiting: %.3fs' % _idle_cpu(2.0))
+  latencies = _wake_latencies(200)
+  print('wake-to-dispatch latency: median %.6fs, p99 %.6fs' % (
+      latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100]))
+  for max_workers in (None, 4):
+    print('5000-task fan-out with max_workers=%s: %.3fs' % (
+        max_workers, _fan_out_seconds(5000, max_workers)))
+  print('%10s %20s %20s' % ('paths', 'loop iteration (s)', 'scan check (s)'))
+  for path_count in (1000, 10000, 100000, 1000000):
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(path_count)])
+    tracker_runner = _run._TrackerRunner(tracker, outdated=False)
+    event_queue = _event.EventQueue()
+    iteration = min(timeit.repeat(
+        lambda: _loop_iteration(tracker_runner, event_queue),
+        repeat=5, number=1000)) / 1000
+    scan = min(timeit.repeat(
+        lambda: _scan_up_to_date(tracker_runner), repeat=3, number=1))
+    print('%10d %20.9f %20.6f' % (path_count, iteration, scan))
+  print('%10s %20s %20s' % ('paths', 'state change (s)', 'bytes per path'))
+  for path_count in (10000, 100000):
+    state_bytes = _state_bytes_per_path(path_count)
+    print('%10d %20.9f %20s' % (
+        path_count, _state_change_seconds(path_count),
+        'n/a' if state_bytes is None else '%.1f' % state_bytes))
+
+
+if __name__ == '__main__':
+  main()
@@ -5,6 +5,8 @@ import unittest
 
 from g_runner import interfaces
 from g_runner import runner
+from g_runner.runner import _run
+from g_runner.runner import executor
 from g_runner.runner import tracker as _tracker
 
 
@@ -55,6 +57,19 @@ class FailingTestTask(TestTask):
     raise self.error
 
 
+class RecordingCallbacks(runner.RunnerCallbacks):
+
+  def __init__(self):
+    self.added = []
+    self.event_wait_count = 0
+
+  def on_path_added(self, tracker, path):
+    self.added.append((tracker, path))
+
+  def on_event_wait(self, tracker):
+    self.event_wait_count += 1
+
+
 class RunnerTest(unittest.TestCase):
 
   def test_not_a_tracker(self):
@@ -197,5 +212,200 @@ class RunnerTest(unittest.TestCase):
     self.assertEqual(1, task2.ran_count)
     self.assertEqual(1, task23.ran_count)
 
+  def test_shared_output_run_once(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    other_task12 = TestTask('other 12', [(1,)], [(2,)])
+    task23 = TestTask('23', [(2,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,), (3,)],
+        new_tasks=[task12, other_task12, task23]
+    )
+    runner.run_tracker(tracker, [
+        runner.Event(
+            path_selector=lambda unused_tracker: [(1,)],
+            flags=runner.EventFlags(
+                paths_state=runner.PathState.up_to_date
+            )
+        )
+    ], outdated=True)
+    self.assertEqual(1, task12.ran_count + other_task12.ran_count)
+    self.assertEqual(1, task23.ran_count)
+
+  def test_wide_run(self):
+    task0 = TestTask('0', [], [(0,)])
+    tasks = [TestTask(str(i), [(0,)], [(i,)]) for i in range(1, 50)]
+    join_task = TestTask('join', [(i,) for i in range(50)], [('join',)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(50)] + [('join',)],
+        new_tasks=[task0, join_task] + tasks
+    )
+    runner.run_tracker(tracker, [], outdated=True)
+    for task in [task0, join_task] + tasks:
+      self.assertEqual(1, task.ran_count)
+    self.assertLessEqual(
+        max(task.run_time for task in tasks), join_task.run_time)
+
+  def test_event_publishes_single_tracker(self):
+    callbacks = RecordingCallbacks()
+    runner.run_tracker(_tracker.Tracker(), [
+        runner.Event(
+            path_selector=lambda unused_tracker: [],
+            path_regenerator=(
+                lambda unused_tracker, unused_paths: [(i,) for i in range(10)])
+        )
+    ], callbacks=callbacks)
+    self.assertEqual(10, len(callbacks.added))
+    trackers = set(id(tracker) for (tracker, unused_path) in callbacks.added)
+    self.assertEqual(1, len(trackers))
+    tracker = callbacks.added[0][0]
+    self.assertEqual(set((i,) for i in range(10)), tracker.paths())
+
+  def test_idle_runner_blocks(self):
+    callbacks = RecordingCallbacks()
+    def slow_events():
+      time.sleep(0.2)
+      yield runner.Event(
+          path_selector=lambda unused_tracker: [(1,)],
+          flags=runner.EventFlags(paths_state=runner.PathState.outdated))
+      time.sleep(0.2)
+    task0 = TestTask('0', [], [(1,)])
+    tracker = _tracker.Tracker().replaced(new_paths=[(1,)], new_tasks=[task0])
+    runner.run_tracker(tracker, slow_events(), callbacks=callbacks)
+    self.assertEqual(1, task0.ran_count)
+    # the runner waits once before the event and once after handling it, give
+    # or take a wakeup for the finished task, rather than spinning
+    self.assertLessEqual(callbacks.event_wait_count, 4)
+
+  def test_max_workers(self):
+    task0 = TestTask('0', [], [(0,)])
+    tasks = [TestTask(str(i), [(0,)], [(i,)]) for i in range(1, 30)]
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(30)],
+        new_tasks=[task0] + tasks
+    )
+    runner.run_tracker(tracker, [], outdated=True, max_workers=2)
+    for task in [task0] + tasks:
+      self.assertEqual(1, task.ran_count)
+
+  def test_tagged_executors(self):
+    task0 = TestTask('0', [], [(0,)])
+    task01 = TestTask('01', [(0,)], [(1,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(0,), (1,)],
+        new_tagged_tasks={task0: ['pooled'], task01: []}
+    )
+    pool = executor.ThreadPoolExecutor(1)
+    runner.run_tracker(
+        tracker, [], outdated=True, tagged_executors=[('pooled', pool)])
+    self.assertEqual(1, len(pool._workers))
+    pool.shutdown()
+    self.assertEqual(1, task0.ran_count)
+    self.assertEqual(1, task01.ran_count)
+
+  def test_max_workers_and_executor(self):
+    with self.assertRaises(ValueError):
+      runner.run_tracker(_tracker.Tracker(), [], max_workers=2,
+                         executor=executor.ThreadExecutor())
+
+  def test_coalesced_events(self):
+    def state_event(paths, state):
+      return runner.Event(path_selector=lambda unused_tracker: paths,
+                          flags=runner.EventFlags(paths_state=state))
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(4)])
+    tracker_runner = _run._TrackerRunner(tracker, outdated=True)
+    tracker_runner._set_path_state((3,), _run._PathState.updating)
+    structural_event = runner.Event(
+        path_selector=lambda unused_tracker: [],
+        path_regenerator=lambda unused_tracker, unused_paths: [(4,)])
+    events = list(tracker_runner._coalesce_events([
+        state_event([(0,), (1,)], runner.PathState.up_to_date),
+        state_event([(2,), (3,)], _run._PathState.updated),
+        state_event([(1,)], runner.PathState.outdated),
+        structural_event,
+        state_event([(0,)], runner.PathState.outdated),
+    ]))
+    # (1,) ends up as it started, and (2,) wasn't updating so stays outdated
+    self.assertEqual(3, len(events))
+    self.assertEqual(((0,), (3,)), events[0].path_selector(tracker))
+    self.assertEqual(runner.PathState.up_to_date, events[0].flags.paths_state)
+    self.assertIs(structural_event, events[1])
+    self.assertEqual([(0,)], events[2].path_selector(tracker))
+
+  def test_coalescing_sees_the_events_before(self):
+    def state_event(paths, state):
+      return runner.Event(path_selector=lambda unused_tracker: paths,
+                          flags=runner.EventFlags(paths_state=state))
+    tracker = _tracker.Tracker().replaced(new_paths=[('p',), ('q',)])
+    tracker_runner = _run._TrackerRunner(tracker, outdated=True)
+    tracker_runner._set_path_state(('p',), _run._PathState.updating)
+    tracker_runner._handle_events(tracker_runner._coalesce_events([
+        runner.Event(
+            path_selector=lambda unused_tracker: [('p',)],
+            path_regenerator=lambda unused_tracker, paths: paths,
+            flags=runner.EventFlags(paths_state=runner.PathState.outdated)),
+        state_event([('p',)], _run._PathState.updated),
+        state_event([('q',)], runner.PathState.up_to_date),
+    ]))
+    # as if handled one by one: `p` was no longer updating once updated
+    self.assertEqual({('p',): runner.PathState.outdated,
+                      ('q',): runner.PathState.up_to_date},
+                     tracker_runner._path_states())
+
+  def test_bursts_of_events_are_coalesced(self):
+    class EventCountingCallbacks(runner.RunnerCallbacks):
+      def __init__(self):
+        self.events = 0
+      def on_event(self, tracker, event):
+        self.events += 1
+    tasks = [TestTask(str(i), [(0,)], [(i,)]) for i in range(1, 50)]
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(50)], new_tasks=tasks)
+    def events():
+      for unused_repeat in range(100):
+        yield runner.Event(
+            path_selector=lambda unused_tracker: [(0,)],
+            flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+    callbacks = EventCountingCallbacks()
+    runner.run_tracker(tracker, events(), outdated=True, callbacks=callbacks)
+    for task in tasks:
+      self.assertEqual(1, task.ran_count)
+    self.assertLess(callbacks.events, 100 + len(tasks))
+
+  def test_removed_tasks_and_paths_free_their_ids(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    task13 = TestTask('13', [(1,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,), (3,)], new_tasks=[task12, task13])
+    tracker_runner = _run._TrackerRunner(tracker, outdated=False)
+    self.assertEqual(3, len(tracker_runner.path_ids))
+    tracker_runner._handle_events([
+        runner.Event(
+            path_selector=lambda unused_tracker: [(3,)],
+            path_regenerator=lambda unused_tracker, unused_paths: [],
+            task_selector=lambda unused_tracker: [task13],
+            task_regenerator=lambda unused_tracker, unused_tasks: []),
+    ])
+    self.assertEqual(set([task12]), tracker_runner.tracker.tasks())
+    self.assertEqual(2, len(tracker_runner.path_ids))
+    self.assertEqual(1, len(tracker_runner.task_ids))
+    self.assertIsNone(tracker_runner._path_state((3,)))
+    self.assertEqual({(1,): runner.PathState.up_to_date,
+                      (2,): runner.PathState.up_to_date},
+                     tracker_runner._path_states())
+    # a task added later may reuse the ids, but starts afresh
+    task14 = TestTask('14', [(1,)], [(4,)])
+    tracker_runner._handle_events([
+        runner.Event(
+            path_selector=lambda unused_tracker: [],
+            path_regenerator=lambda unused_tracker, unused_paths: [(4,)],
+            task_selector=lambda unused_tracker: [],
+            task_regenerator=lambda unused_tracker, unused_tasks: [task14],
+            flags=runner.EventFlags(paths_state=runner.PathState.outdated)),
+    ])
+    task14_id = tracker_runner.task_ids.get(task14)
+    self.assertEqual(0, tracker_runner.task_unready_inputs[task14_id])
+    self.assertEqual(1, tracker_runner.task_outdated_outputs[task14_id])
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
@@ -0,0 +1,136 @@
+"""Compact tables for the runner's per-path and per-task state.
+
+A run hands its paths and tasks dense integer ids (`Interner`) when it first
+meets them, and keeps their states in `bytearray`s and their adjacency in
+`Adjacency` lists indexed by those ids. Paths and tasks are thus hashed once,
+at the boundary with the tracker, events and callbacks, rather than every time
+a state changes, and each path costs a few bytes in the tables besides its
+entry in the interner."""
+
+import array
+
+# Large enough for any id, yet half the size of a C long on 64-bit Linux.
+_ID_TYPECODE = 'i'
+
+
+class Interner(object):
+  """Dense integer ids for hashable objects.
+
+  Ids count up from 0, and released ids are reused before new ones are handed
+  out, so tables indexed by id need only be as long as the most objects
+  interned at once."""
+  __slots__ = ('_ids', '_objects', '_free')
+
+  def __init__(self):
+    self._ids = {}
+    self._objects = []
+    self._free = []
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __contains__(self, obj):
+    return obj in self._ids
+
+  def __getitem__(self, ident):
+    """Get the object of an id."""
+    return self._objects[ident]
+
+  def get(self, obj, default=None):
+    """Get the id of an object, or a default if it has none."""
+    return self._ids.get(obj, default)
+
+  def intern(self, obj):
+    """Get the id of an object, giving it one if it has none.
+
+    New ids are one past the largest yet, so tables may grow by appending."""
+    ident = self._ids.get(obj)
+    if ident is None:
+      if self._free:
+        ident = self._free.pop()
+        self._objects[ident] = obj
+      else:
+        ident = len(self._objects)
+        self._objects.append(obj)
+      self._ids[obj] = ident
+    return ident
+
+  def release(self, ident):
+    """Forget an object, freeing its id for reuse."""
+    del self._ids[self._objects[ident]]
+    self._objects[ident] = None
+    self._free.append(ident)
+
+
+class Adjacency(object):
+  """Lists of ids per id, e.g. of the tasks taking each path as input.
+
+  The lists are linked through flat arrays of entries rather than being
+  objects of their own, so an id with a short list (or none) costs a handful
+  of bytes. Lists are in no particular order and hold each value at most once
+  as long as it's only added once."""
+  __slots__ = ('_heads', '_values', '_next', '_free')
+
+  def __init__(self):
+    # key -> first entry, or -1
+    self._heads = array.array(_ID_TYPECODE)
+    # entry -> value, and the key's next entry (or the next free entry)
+    self._values = array.array(_ID_TYPECODE)
+    self._next = array.array(_ID_TYPECODE)
+    self._free = -1
+
+  def grow(self, size):
+    """Make room for keys below some size."""
+    if size > len(self._heads):
+      self._heads.extend([-1] * (size - len(self._heads)))
+
+  def add(self, key, value):
+    entry = self._free
+    if entry >= 0:
+      self._free = self._next[entry]
+      self._values[entry] = value
+      self._next[entry] = self._heads[key]
+    else:
+      entry = len(self._values)
+      self._values.append(value)
+      self._next.append(self._heads[key])
+    self._heads[key] = entry
+
+  def remove(self, key, value):
+    """Remove a value from a key's list; costs the list's length."""
+    previous = -1
+    entry = self._heads[key]
+    while entry >= 0:
+      if self._values[entry] == value:
+        if previous < 0:
+          self._heads[key] = self._next[entry]
+        else:
+          self._next[previous] = self._next[entry]
+        self._next[entry] = self._free
+        self._free = entry
+        return
+      previous = entry
+      entry = self._next[entry]
+    raise KeyError((key, value))
+
+  def clear(self, key):
+    """Empty a key's list."""
+    entry = self._heads[key]
+    while entry >= 0:
+      next_entry = self._next[entry]
+      self._next[entry] = self._free
+      self._free = entry
+      entry = next_entry
+    self._heads[key] = -1
+
+  def values(self, key):
+    """Get a list of a key's values."""
+    values = []
+    entry = self._heads[key]
+    while entry >= 0:
+      values.append(self._values[entry])
+      entry = self._next[entry]
+    return values
+
+  def is_empty(self, key):
+    return self._heads[key] < 0
@@ -0,0 +1,51 @@
+import random
+import unittest
+
+from g_runner.runner import _state_tables
+
+
+class InternerTest(unittest.TestCase):
+
+  def test_released_ids_are_reused(self):
+    interner = _state_tables.Interner()
+    self.assertEqual(0, interner.intern(('a',)))
+    self.assertEqual(1, interner.intern(('b',)))
+    self.assertEqual(0, interner.intern(('a',)))
+    interner.release(0)
+    self.assertNotIn(('a',), interner)
+    self.assertIsNone(interner.get(('a',)))
+    self.assertEqual(0, interner.intern(('c',)))
+    self.assertEqual(('c',), interner[0])
+    self.assertEqual(2, interner.intern(('a',)))
+    self.assertEqual(3, len(interner))
+
+
+class AdjacencyTest(unittest.TestCase):
+
+  def test_random_operations(self):
+    rng = random.Random(42)
+    expected = dict((key, set()) for key in range(20))
+    adjacency = _state_tables.Adjacency()
+    adjacency.grow(len(expected))
+    for _ in range(2000):
+      key = rng.randrange(len(expected))
+      value = rng.randrange(50)
+      operation = rng.random()
+      if operation < 0.05:
+        adjacency.clear(key)
+        expected[key].clear()
+      elif value in expected[key]:
+        adjacency.remove(key, value)
+        expected[key].remove(value)
+      else:
+        adjacency.add(key, value)
+        expected[key].add(value)
+      for (checked_key, values) in expected.items():
+        self.assertEqual(values, set(adjacency.values(checked_key)))
+        self.assertEqual(not values, adjacency.is_empty(checked_key))
+    with self.assertRaises(KeyError):
+      adjacency.remove(0, 50)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,150 @@
+"""A persistent trie of paths keyed by their components.
+
+Paths are sequences (e.g. `(FILE_PATH_TAG, 'src', 'net', 'socket.c')`), and
+each node of the trie stands for a prefix: it holds the paths equal to its
+prefix, the number of paths under it, and its children in a `PersistentMap`
+keyed by the next component. Finding the paths under a prefix thus costs the
+prefix's length plus the number of paths found, and counting them only the
+prefix's length.
+
+Like `_persistent`'s collections, tries are immutable; `changed` copies only
+the nodes on the way to the changed paths and shares the rest."""
+
+from g_runner.runner import _persistent
+
+_EMPTY_MAP = _persistent.PersistentMap()
+
+
+class _Node(object):
+  __slots__ = ('count', 'paths', 'children')
+
+  def __init__(self, count, paths, children):
+    # the number of paths under the node, its own included
+    self.count = count
+    # the paths equal to the node's prefix; usually none or one, but e.g. a
+    # tuple and a list of the same components would share a node
+    self.paths = paths
+    self.children = children
+
+
+_EMPTY_NODE = _Node(0, (), _EMPTY_MAP)
+
+
+def _build(paths):
+  """Build the root of a trie of some paths, bottom up."""
+  # Mutable nodes are [count, paths, children] with children in a dict.
+  root = [0, [], {}]
+  for path in paths:
+    node = root
+    node[0] += 1
+    for component in path:
+      children = node[2]
+      child = children.get(component)
+      if child is None:
+        child = children[component] = [0, [], {}]
+      node = child
+      node[0] += 1
+    node[1].append(path)
+  # Freeze children before their parents, without recursing, as paths may be
+  # long (e.g. strings, whose components are characters).
+  frozen = {}
+  stack = [(root, False)]
+  while stack:
+    (node, children_frozen) = stack.pop()
+    if not children_frozen:
+      stack.append((node, True))
+      stack.extend((child, False) for child in node[2].values())
+      continue
+    children = _persistent.PersistentMap(
+        (component, frozen.pop(id(child)))
+        for (component, child) in node[2].items())
+    frozen[id(node)] = _Node(node[0], tuple(node[1]), children)
+  return frozen[id(root)]
+
+
+def _changed(root, path, added):
+  """Get the root of a trie with a path added to or removed from it."""
+  components = tuple(path)
+  nodes = [root]
+  node = root
+  for component in components:
+    node = node.children.get(component, _EMPTY_NODE)
+    nodes.append(node)
+  if added:
+    if path in node.paths:
+      return root
+    new_node = _Node(node.count + 1, node.paths + (path,), node.children)
+  else:
+    if path not in node.paths:
+      return root
+    new_node = _Node(node.count - 1,
+                     tuple(other for other in node.paths if other != path),
+                     node.children)
+  delta = 1 if added else -1
+  for index in range(len(components) - 1, -1, -1):
+    parent = nodes[index]
+    if new_node.count:
+      children = parent.children.set(components[index], new_node)
+    else:
+      children = parent.children.discard(components[index])
+    new_node = _Node(parent.count + delta, parent.paths, children)
+  return new_node
+
+
+class PathTrie(object):
+  """An immutable trie of paths; `changed` returns new tries."""
+  __slots__ = ('_root',)
+
+  def __init__(self, paths=()):
+    self._root = _build(paths)
+
+  @classmethod
+  def _make(cls, root):
+    trie = cls.__new__(cls)
+    trie._root = root
+    return trie
+
+  def changed(self, removed_paths=(), added_paths=()):
+    """Get a trie with paths removed and then paths added.
+
+    Costs the total length of the changed paths; when most of the trie
+    changes, rebuilding it with `PathTrie` is faster."""
+    root = self._root
+    for path in removed_paths:
+      root = _changed(root, path, False)
+    for path in added_paths:
+      root = _changed(root, path, True)
+    if root is self._root:
+      return self
+    return PathTrie._make(root)
+
+  def __len__(self):
+    return self._root.count
+
+  def _find(self, prefix):
+    node = self._root
+    for component in prefix:
+      node = node.children.get(component)
+      if node is None:
+        return _EMPTY_NODE
+    return node
+
+  def count(self, prefix=()):
+    """Get the number of paths starting with a prefix."""
+    return self._find(prefix).count
+
+  def paths(self, prefix=()):
+    """Iterate over the paths starting with a prefix."""
+    stack = [self._find(prefix)]
+    while stack:
+      node = stack.pop()
+      for path in node.paths:
+        yield path
+      stack.extend(child for (unused_component, child)
+                   in node.children.iteritems())
+
+  def children(self, prefix=()):
+    """Get a dict from the components following a prefix to the numbers of
+    paths starting with the prefix and then the component."""
+    return dict((component, child.count) for (component, child)
+                in self._find(prefix).children.iteritems())
@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from g_runner.runner import _trie
+
+
+class PathTrieTest(unittest.TestCase):
+
+  def assertTrieMatches(self, paths, trie, prefixes):
+    self.assertEqual(len(paths), len(trie))
+    for prefix in prefixes:
+      expected = set(path for path in paths
+                     if tuple(path[:len(prefix)]) == prefix)
+      self.assertEqual(expected, set(trie.paths(prefix)))
+      self.assertEqual(len(expected), trie.count(prefix))
+
+  def test_random_changes(self):
+    rng = random.Random(42)
+    components = ['a', 'b', 'c']
+    def random_path():
+      return tuple(rng.choice(components) for _ in range(rng.randint(0, 4)))
+    prefixes = set(random_path() for _ in range(50))
+    paths = set()
+    trie = _trie.PathTrie()
+    for _ in range(300):
+      removed_paths = [random_path() for _ in range(rng.randint(0, 3))]
+      added_paths = [random_path() for _ in range(rng.randint(0, 3))]
+      previous_trie = trie
+      previous_paths = set(paths)
+      trie = trie.changed(removed_paths, added_paths)
+      paths.difference_update(removed_paths)
+      paths.update(added_paths)
+      self.assertTrieMatches(paths, trie, prefixes)
+      self.assertTrieMatches(previous_paths, previous_trie, prefixes)
+    self.assertTrieMatches(paths, _trie.PathTrie(paths), prefixes)
+
+  def test_children(self):
+    trie = _trie.PathTrie([('src', 'net', 'socket.c'), ('src', 'net', 'dns.c'),
+                           ('src', 'main.c'), ('docs',)])
+    self.assertEqual({'net': 2, 'main.c': 1}, trie.children(('src',)))
+    self.assertEqual({'src': 3, 'docs': 1}, trie.children())
+    self.assertEqual({}, trie.children(('missing',)))
+    self.assertIs(trie, trie.changed([('missing',)], [('docs',)]))
+    self.assertEqual({'main.c': 1},
+                     trie.changed([('src', 'net', 'socket.c'),
+                                   ('src', 'net', 'dns.c')]).children(('src',)))
+
+  def test_long_paths(self):
+    # strings are paths whose components are characters
+    paths = ['x' * 5000, 'x' * 4999 + 'y']
+    trie = _trie.PathTrie(paths)
+    self.assertEqual(2, trie.count('x' * 4999))
+    self.assertEqual(set(paths), set(trie.paths('x' * 4000)))
+    trie = trie.changed([paths[0]], ['x' * 6000])
+    self.assertEqual(['x' * 6000], list(trie.paths('x' * 5000)))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,41 @@
+"""Caches of tasks' outcomes, consulted so as not to run tasks needlessly.
+
+Before running a task the runner asks its action cache to `restore` the task's
+outputs as some earlier run with the same task and inputs left them. If it can,
+the task counts as having run successfully without running; else the task runs
+and, if it succeeds, the cache gets to `record` its outputs.
+
+Caching a task is only sound if its outputs are all that it affects and they
+only depend on the task and its inputs; tasks for which it isn't should be
+tagged `NON_CACHEABLE_TAG`, and then always run."""
+
+from g_runner.runner import identity
+
+NON_CACHEABLE_TAG = identity.Sentinel(__name__, 'NON_CACHEABLE_TAG')
+
+
+class ActionCache(object):
+  """The base action cache, which never has anything."""
+
+  def restore(self, task):
+    """Bring a task's outputs to what running it would.
+
+    Called off the runner's lock, possibly concurrently for different tasks.
+
+    Returns:
+      Whether or not the outputs were restored (else the task needs to run).
+    """
+    return False
+
+  def record(self, task):
+    """Remember a task's outputs after it ran successfully.
+
+    Called from the executor the task ran on. Caches should cope with their
+    own storage failing (e.g. by not recording); errors raised fail the task."""
+    pass
+
+  def on_run_finished(self):
+    """Called once the run is over, e.g. to finish recording in the background.
+
+    Called off the event loop by `run_tracker_async`, so it may block."""
+    pass
@@ -0,0 +1,344 @@
+"""Callbacks following the progress of a run.
+
+The runner calls `RunnerCallbacks` on whichever of its threads made the change
+they report, often with its lock held, so slow callbacks (e.g. printing
+progress to a terminal) hold up scheduling and the threads reporting finished
+tasks. `DispatchedCallbacks` call callbacks on a thread of their own instead,
+fed by a bounded queue whose `Overflow` policy says what happens when the
+callbacks can't keep up."""
+
+import collections
+import threading
+
+from g_runner.runner import _event
+
+# The per-item callbacks of the states that have them; the runner's own
+# intermediary states ('updating', and those of tasks) are spelled out, as
+# they're the runner's business.
+_PATH_STATE_CALLBACKS = {
+    _event.PathState.outdated: 'on_path_outdated',
+    'updating': 'on_path_updating',
+    _event.PathState.up_to_date: 'on_path_up_to_date',
+}
+_TASK_STATE_CALLBACKS = {
+    'stopped': 'on_task_stopped',
+    'running': 'on_task_running',
+}
+
+class RunnerCallbacks(object):
+  """Edge-triggered callbacks during a run of tracked tasks.
+
+  Useful for verbose output of the run state. Note that callbacks have no
+  explicit locking from the runner, thus thread safety must be ensured by the
+  callee.
+
+  State changes are reported in bulk, to `on_paths_state_changed` and
+  `on_tasks_state_changed`, which by default call the per-item callbacks
+  (`on_path_outdated` etc.) for each path or task. Override them instead when
+  an event may change many states at once."""
+
+  def on_paths_state_changed(self, tracker, state, paths):
+    """Called with paths that entered a state.
+
+    Called once per state per event the runner applies and per round of
+    starting tasks, with every path that entered the state in it, in order.
+    States include the runner's own ('updating', 'poisoned').
+
+    Arguments:
+      tracker (interfaces.Tracker): the tracker as of the changes.
+      state (str): the state the paths entered.
+      paths (tuple): the paths.
+    """
+    name = _PATH_STATE_CALLBACKS.get(state)
+    if name is not None:
+      callback = getattr(self, name)
+      for path in paths:
+        callback(tracker, path)
+
+  def on_tasks_state_changed(self, tracker, state, tasks):
+    """Called with tasks that entered a state ('stopped', 'running' or
+    'zombie'), in bulk as for `on_paths_state_changed`."""
+    name = _TASK_STATE_CALLBACKS.get(state)
+    if name is not None:
+      callback = getattr(self, name)
+      for task in tasks:
+        callback(tracker, task)
+
+  def on_task_running(self, tracker, task):
+    """Called when a task enters the running state."""
+    pass
+
+  def on_task_stopped(self, tracker, task):
+    """Called when a task enters the stopped state."""
+    pass
+
+  def on_task_failed(self, tracker, task, error):
+    """Called when a task failed.
+
+    Note that this is a refinement of a task stopping; it is called in addition
+    to on_task_stopped."""
+    pass
+
+  def on_path_added(self, tracker, path):
+    """Called when a path is added to the tracker."""
+    pass
+
+  def on_path_outdated(self, tracker, path):
+    """Called when a path enters the outdated state."""
+    pass
+
+  def on_path_updating(self, tracker, path):
+    """Called when a path enters the updating state."""
+    pass
+
+  def on_path_up_to_date(self, tracker, path):
+    """Called when a path enters the up-to-date state."""
+    pass
+
+  def on_event(self, tracker, event):
+    """Called when the runner processes an event."""
+    pass
+
+  def on_event_wait(self, tracker):
+    """Called when the only thing keeping the run from terminating is the open
+    event queue. Note that this may be spuriously called; it's up to the
+    callback-callee to determine whether or not there's something to do with
+    respect to the waiting runner."""
+    pass
+
+
+class Overflow(object):
+  """What `DispatchedCallbacks` do with calls that find their queue full."""
+  # The runner waits for room; nothing is lost, but the run goes no faster
+  # than the callbacks once the queue has filled up.
+  block = 'block'
+  # The call is dropped.
+  drop = 'drop'
+  # A call reporting the state of a path or task replaces the queued call
+  # reporting an earlier state of it, if there's one. A bulk report takes its
+  # paths or tasks out of the queued bulk reports of earlier states and joins
+  # the last queued report of its state; if there's none, it's queued anyway,
+  # so the queue may go over its bound by a report per state. Other calls are
+  # dropped.
+  coalesce = 'coalesce'
+
+_OVERFLOWS = (Overflow.block, Overflow.drop, Overflow.coalesce)
+
+DEFAULT_MAX_QUEUED = 1024
+
+# Calls reporting states, to what they report the state of. Calls of a kind
+# about the same path or task supersede one another when coalescing.
+_STATE_CALL_KINDS = {
+    'on_task_running': 'task',
+    'on_task_stopped': 'task',
+    'on_path_outdated': 'path',
+    'on_path_updating': 'path',
+    'on_path_up_to_date': 'path',
+}
+
+
+_BULK_CALLS = frozenset(['on_paths_state_changed', 'on_tasks_state_changed'])
+
+
+def _coalescing_key(name, args):
+  if name == 'on_event_wait':
+    return (name,)
+  kind = _STATE_CALL_KINDS.get(name)
+  if kind is None:
+    return None
+  return (kind, args[1])
+
+
+class DispatchedCallbacks(RunnerCallbacks):
+  """Callbacks calling other callbacks from a thread of their own.
+
+  Calls are queued, and the other callbacks are called in the order they were
+  queued in. Pass these to a runner in place of the callbacks they call, and
+  `close` them once the run is over (the `dispatch_callbacks` argument of
+  `run_tracker` and `run_tracker_async` does both).
+
+  Attributes:
+    dropped (int): the number of calls dropped for the queue being full or
+      the callbacks being closed.
+    errors (list): the exceptions raised by the other callbacks.
+  """
+
+  def __init__(self, callbacks, max_queued=DEFAULT_MAX_QUEUED,
+               overflow=Overflow.block):
+    """
+    Arguments:
+      callbacks (RunnerCallbacks): the callbacks to call.
+      max_queued (int): how many calls may wait to be made.
+      overflow (str): what to do with calls once that many are waiting, from
+        `Overflow`.
+    """
+    if not isinstance(callbacks, RunnerCallbacks):
+      raise TypeError('expected `callbacks` to be a `RunnerCallbacks`')
+    if overflow not in _OVERFLOWS:
+      raise ValueError('unknown overflow policy %r' % (overflow,))
+    if max_queued < 1:
+      raise ValueError('expected `max_queued` to be positive')
+    self._callbacks = callbacks
+    self._max_queued = max_queued
+    self._overflow = overflow
+    self._condition = threading.Condition(threading.Lock())
+    # [coalescing key (or None), method name, arguments] lists
+    self._queue = collections.deque()
+    # coalescing keys to their queued calls
+    self._queued_by_key = {}
+    # When coalescing, bulk reports are queued with an OrderedDict of their
+    # items, which the runner's later reports take items out of; these map
+    # (method name, state) to the last queued report of a state, and (method
+    # name, item) to the queued reports holding an item.
+    self._queued_by_state = {}
+    self._queued_by_item = {}
+    self._calling = False
+    self._closed = False
+    self.dropped = 0
+    self.errors = []
+    self._thread = threading.Thread(target=self._call_queued)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, name, args):
+    key = _coalescing_key(name, args)
+    with self._condition:
+      if self._closed:
+        # e.g. tasks on a caller's executor finishing after a failed run
+        self.dropped += 1
+        return
+      while len(self._queue) >= self._max_queued:
+        if self._overflow == Overflow.block:
+          self._condition.wait()
+          continue
+        if self._overflow == Overflow.coalesce:
+          if key is not None:
+            queued = self._queued_by_key.get(key)
+            if queued is not None:
+              queued[1:] = (name, args)
+              return
+          elif name in _BULK_CALLS:
+            self._coalesce_bulk(name, args)
+            return
+        self.dropped += 1
+        return
+      if name in _BULK_CALLS and self._overflow == Overflow.coalesce:
+        self._queue_bulk(name, args)
+        return
+      queued = [key, name, args]
+      self._queue.append(queued)
+      if key is not None:
+        self._queued_by_key[key] = queued
+      self._condition.notify_all()
+
+  def _queue_bulk(self, name, args):
+    (tracker, state, items) = args
+    queued = [None, name,
+              (tracker, state, collections.OrderedDict.fromkeys(items))]
+    self._queue.append(queued)
+    self._queued_by_state[(name, state)] = queued
+    for item in items:
+      self._queued_by_item.setdefault((name, item), []).append(queued)
+    self._condition.notify_all()
+
+  def _coalesce_bulk(self, name, args):
+    (tracker, state, items) = args
+    for item in items:
+      for queued in self._queued_by_item.pop((name, item), ()):
+        del queued[2][2][item]
+    queued = self._queued_by_state.get((name, state))
+    if queued is None:
+      self._queue_bulk(name, args)
+      return
+    queued_items = queued[2][2]
+    queued[2] = (tracker, state, queued_items)
+    for item in items:
+      queued_items[item] = None
+      self._queued_by_item[(name, item)] = [queued]
+
+  def _unqueue_bulk(self, queued):
+    """Forget a bulk report taken off the queue; get its arguments."""
+    (unused_key, name, (tracker, state, items)) = queued
+    if self._queued_by_state.get((name, state)) is queued:
+      del self._queued_by_state[(name, state)]
+    for item in items:
+      others = [other for other in self._queued_by_item[(name, item)]
+                if other is not queued]
+      if others:
+        self._queued_by_item[(name, item)] = others
+      else:
+        del self._queued_by_item[(name, item)]
+    return (tracker, state, tuple(items))
+
+  def _call_queued(self):
+    while True:
+      with self._condition:
+        while not self._queue and not self._closed:
+          self._condition.wait()
+        if not self._queue:
+          return
+        queued = self._queue.popleft()
+        (key, name, args) = queued
+        if key is not None and self._queued_by_key.get(key) is queued:
+          del self._queued_by_key[key]
+        if name in _BULK_CALLS and self._overflow == Overflow.coalesce:
+          args = self._unqueue_bulk(queued)
+        self._calling = True
+        # there's room for a blocked call
+        self._condition.notify_all()
+      try:
+        if name not in _BULK_CALLS or args[2]:
+          getattr(self._callbacks, name)(*args)
+      except Exception as e:
+        self.errors.append(e)
+      finally:
+        with self._condition:
+          self._calling = False
+          self._condition.notify_all()
+
+  def flush(self):
+    """Wait until the calls queued so far have been made."""
+    with self._condition:
+      while self._queue or self._calling:
+        self._condition.wait()
+
+  def close(self):
+    """Make the queued calls and stop the thread making them; calls after
+    this are dropped."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._thread.join()
+
+  def on_paths_state_changed(self, tracker, state, paths):
+    self._put('on_paths_state_changed', (tracker, state, paths))
+
+  def on_tasks_state_changed(self, tracker, state, tasks):
+    self._put('on_tasks_state_changed', (tracker, state, tasks))
+
+  def on_task_running(self, tracker, task):
+    self._put('on_task_running', (tracker, task))
+
+  def on_task_stopped(self, tracker, task):
+    self._put('on_task_stopped', (tracker, task))
+
+  def on_task_failed(self, tracker, task, error):
+    self._put('on_task_failed', (tracker, task, error))
+
+  def on_path_added(self, tracker, path):
+    self._put('on_path_added', (tracker, path))
+
+  def on_path_outdated(self, tracker, path):
+    self._put('on_path_outdated', (tracker, path))
+
+  def on_path_updating(self, tracker, path):
+    self._put('on_path_updating', (tracker, path))
+
+  def on_path_up_to_date(self, tracker, path):
+    self._put('on_path_up_to_date', (tracker, path))
+
+  def on_event(self, tracker, event):
+    self._put('on_event', (tracker, event))
+
+  def on_event_wait(self, tracker):
+    self._put('on_event_wait', (tracker,))
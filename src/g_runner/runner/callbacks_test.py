@@ -0,0 +1,204 @@
+import threading
+import time
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run
+from g_runner.runner import _run_test
+from g_runner.runner import callbacks as _callbacks
+from g_runner.runner import executor as _executor
+from g_runner.runner import tracker as _tracker
+
+
+class RecordingCallbacks(_callbacks.RunnerCallbacks):
+  """Records calls, with `on_event` waiting on a gate."""
+
+  def __init__(self):
+    self.calls = []
+    self.gate = threading.Event()
+    self.gate.set()
+    self.waiting = threading.Event()
+
+  def on_event(self, tracker, event):
+    self.waiting.set()
+    self.gate.wait()
+    self.calls.append(('event', event))
+
+  def on_event_wait(self, tracker):
+    self.calls.append(('wait',))
+
+  def on_path_added(self, tracker, path):
+    self.calls.append(('added', path))
+
+  def on_path_outdated(self, tracker, path):
+    self.calls.append(('outdated', path))
+
+  def on_path_up_to_date(self, tracker, path):
+    self.calls.append(('up_to_date', path))
+
+
+def _chain_tracker(length):
+  paths = [(i,) for i in range(length + 1)]
+  tasks = [_run_test.TestTask('0', [], [paths[0]])] + [
+      _run_test.TestTask(str(i), [paths[i - 1]], [paths[i]])
+      for i in range(1, length + 1)]
+  return (_tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks), tasks)
+
+
+class DispatchedCallbacksTest(unittest.TestCase):
+
+  def blocked(self, recording, **kwargs):
+    """Dispatched callbacks whose thread is stuck in `on_event`."""
+    recording.gate.clear()
+    dispatched = _callbacks.DispatchedCallbacks(recording, **kwargs)
+    dispatched.on_event(None, 'gate')
+    self.assertTrue(recording.waiting.wait(10))
+    return dispatched
+
+  def test_calls_are_made_in_order(self):
+    recording = RecordingCallbacks()
+    dispatched = _callbacks.DispatchedCallbacks(recording, max_queued=2)
+    for i in range(100):
+      dispatched.on_path_outdated(None, (i,))
+    dispatched.flush()
+    self.assertEqual([('outdated', (i,)) for i in range(100)], recording.calls)
+    dispatched.close()
+    dispatched.on_event_wait(None)
+    self.assertEqual(1, dispatched.dropped)
+
+  def test_drop(self):
+    recording = RecordingCallbacks()
+    dispatched = self.blocked(
+        recording, max_queued=2, overflow=_callbacks.Overflow.drop)
+    for i in range(5):
+      dispatched.on_path_added(None, (i,))
+    recording.gate.set()
+    dispatched.close()
+    self.assertEqual(
+        [('event', 'gate'), ('added', (0,)), ('added', (1,))], recording.calls)
+    self.assertEqual(3, dispatched.dropped)
+
+  def test_coalesce(self):
+    recording = RecordingCallbacks()
+    dispatched = self.blocked(
+        recording, max_queued=2, overflow=_callbacks.Overflow.coalesce)
+    dispatched.on_path_outdated(None, (1,))
+    dispatched.on_path_added(None, (2,))
+    dispatched.on_path_up_to_date(None, (1,))
+    dispatched.on_path_added(None, (3,))
+    dispatched.on_event_wait(None)
+    recording.gate.set()
+    dispatched.close()
+    self.assertEqual(
+        [('event', 'gate'), ('up_to_date', (1,)), ('added', (2,))],
+        recording.calls)
+    self.assertEqual(2, dispatched.dropped)
+
+  def test_slow_callbacks_dont_hold_up_the_run(self):
+    (tracker, tasks) = _chain_tracker(20)
+    recording = RecordingCallbacks()
+    dispatched = self.blocked(
+        recording, max_queued=4, overflow=_callbacks.Overflow.drop)
+    runner.run_tracker(tracker, [], outdated=True, callbacks=dispatched)
+    for task in tasks:
+      self.assertEqual(1, task.ran_count)
+    recording.gate.set()
+    dispatched.close()
+    self.assertLess(0, dispatched.dropped)
+
+  def test_run_tracker_dispatch(self):
+    (tracker, tasks) = _chain_tracker(5)
+    recording = RecordingCallbacks()
+    runner.run_tracker(tracker, [], outdated=True, callbacks=recording,
+                       dispatch_callbacks=_callbacks.Overflow.block)
+    self.assertEqual(6, sum(1 for call in recording.calls
+                            if call[0] == 'up_to_date'))
+    class FailingCallbacks(_callbacks.RunnerCallbacks):
+      def on_path_up_to_date(self, tracker, path):
+        raise KeyError(path)
+    (tracker, tasks) = _chain_tracker(1)
+    with self.assertRaises(runner.RunnerError) as raised:
+      runner.run_tracker(tracker, [], outdated=True,
+                         callbacks=FailingCallbacks(),
+                         dispatch_callbacks=_callbacks.Overflow.drop)
+    self.assertEqual(2, len(raised.exception.exceptions))
+    for task in tasks:
+      self.assertEqual(1, task.ran_count)
+
+  def test_calls_after_a_failed_run_are_dropped(self):
+    class SlowTask(_run_test.TestTask):
+      def run(self):
+        time.sleep(0.2)
+        super(SlowTask, self).run()
+    slow = SlowTask('slow', [], [(1,)])
+    failing = _run_test.FailingTestTask('failing', [], [(2,)], KeyError())
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(1,), (2,)], new_tasks=[slow, failing])
+    pool = _executor.ThreadPoolExecutor(2)
+    with self.assertRaises(runner.RunnerError):
+      runner.run_tracker(tracker, [], outdated=True, executor=pool,
+                         dispatch_callbacks=_callbacks.Overflow.drop)
+    deadline = time.time() + 10
+    while slow.ran_count == 0 and time.time() < deadline:
+      time.sleep(0.01)
+    time.sleep(0.05)
+    # the slow task's callbacks didn't kill its worker
+    self.assertEqual(2, sum(1 for worker in pool._workers
+                            if worker.is_alive()))
+    pool.shutdown()
+
+  def test_coalesce_bulk_reports(self):
+    class BulkRecordingCallbacks(RecordingCallbacks):
+      def on_paths_state_changed(self, tracker, state, paths):
+        self.calls.append((state, paths))
+    recording = BulkRecordingCallbacks()
+    dispatched = self.blocked(
+        recording, max_queued=1, overflow=_callbacks.Overflow.coalesce)
+    dispatched.on_paths_state_changed(None, 'outdated', ((1,),))
+    dispatched.on_paths_state_changed(None, 'outdated', ((2,), (3,)))
+    dispatched.on_paths_state_changed(None, 'up_to_date', ((1,), (2,)))
+    dispatched.on_paths_state_changed(None, 'outdated', ((2,),))
+    recording.gate.set()
+    dispatched.close()
+    # each path's last state is reported, once
+    self.assertEqual(
+        [('event', 'gate'), ('outdated', ((3,), (2,))),
+         ('up_to_date', ((1,),))], recording.calls)
+    self.assertEqual(0, dispatched.dropped)
+
+
+class BulkCallbacksTest(unittest.TestCase):
+
+  def outdate_all(self, callbacks):
+    paths = [(i,) for i in range(1000)]
+    tracker_runner = _run._TrackerRunner(
+        _tracker.Tracker().replaced(new_paths=paths), outdated=False,
+        callbacks=callbacks)
+    tracker_runner._handle_events([
+        runner.Event(path_selector=lambda tracker: tracker.paths(),
+                     flags=runner.EventFlags(
+                         paths_state=runner.PathState.outdated))])
+    return paths
+
+  def test_one_call_per_event(self):
+    class BulkCallbacks(_callbacks.RunnerCallbacks):
+      def __init__(self):
+        self.calls = []
+      def on_paths_state_changed(self, tracker, state, paths):
+        self.calls.append((state, paths))
+    callbacks = BulkCallbacks()
+    paths = self.outdate_all(callbacks)
+    self.assertEqual(1, len(callbacks.calls))
+    (state, changed_paths) = callbacks.calls[0]
+    self.assertEqual(runner.PathState.outdated, state)
+    self.assertEqual(set(paths), set(changed_paths))
+
+  def test_per_item_callbacks_still_called(self):
+    recording = RecordingCallbacks()
+    paths = self.outdate_all(recording)
+    self.assertEqual([('outdated', path) for path in paths],
+                     sorted(recording.calls[1:]))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,529 @@
+"""Running tasks on worker daemons spread over many hosts.
+
+A `RemoteExecutor` is the coordinator: the runner submits tasks to it as to any
+executor, and it hands them to the worker daemons connected to it, never giving
+a worker more at once than the worker said it can run. A `WorkerDaemon`
+connects to the coordinator, runs what it's handed on a pool of threads and
+reports each task's outcome, which the runner then handles as it would a local
+task's: the task's outputs are updated, or poisoned.
+
+Workers send heartbeats. A worker that goes quiet for too long, or whose
+connection drops, is given up on, and the tasks it was running are handed to
+other workers (a few times at most, in case the tasks are what's killing the
+workers).
+
+Messages are pickled and sent over TCP, each prefixed by its length, so tasks
+(and the errors they raise) must be picklable, and workers must be able to
+import the code of the tasks they run. As unpickling runs code, the coordinator
+and its workers share a secret key: each side of a connection proves it knows
+the key before anything is unpickled, and every message is signed with a key
+of the connection's own, so one that was tampered with, replayed or sent by
+anyone else drops the connection. Messages aren't encrypted, though, so tasks
+and their errors can be read by anyone on the network; only run workers on
+networks you trust (or through a tunnel). Start a worker with
+
+  G_RUNNER_AUTHKEY=KEY python -m g_runner.runner.distributed HOST PORT \
+      [MAX_TASKS]
+
+where KEY is the coordinator's `authkey`.
+"""
+
+import binascii
+import collections
+import hashlib
+import hmac
+import itertools
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from g_runner._compat import pickle
+from g_runner.runner import executor as _executor
+
+_LENGTH = struct.Struct('!I')
+_SEQUENCE = struct.Struct('!Q')
+_DIGEST = hashlib.sha256
+_DIGEST_SIZE = _DIGEST().digest_size
+_NONCE_SIZE = 32
+
+# The environment variable `main` takes the key from.
+AUTHKEY_ENVIRONMENT_VARIABLE = 'G_RUNNER_AUTHKEY'
+
+# message kinds
+_HELLO = 'hello'
+_HEARTBEAT = 'heartbeat'
+_RUN = 'run'
+_DONE = 'done'
+
+
+class WorkerLostError(Exception):
+  """A task's workers kept being lost while running it."""
+
+
+class AuthenticationError(Exception):
+  """A peer didn't prove it knows the shared key, or sent a message that
+  wasn't signed with it."""
+
+
+def _sign(key, data):
+  return hmac.new(key, data, _DIGEST).digest()
+
+
+def _receive_exactly(connection, size):
+  chunks = []
+  while size:
+    chunk = connection.recv(min(size, 1 << 20))
+    if not chunk:
+      return None
+    chunks.append(chunk)
+    size -= len(chunk)
+  return b''.join(chunks)
+
+
+class _Channel(object):
+  """A connection whose messages are signed, each with its place in the
+  sequence of messages sent that way, so they can't be forged, replayed or
+  reordered.
+
+  Sending and receiving may happen at the same time, but each must be done
+  by one thread at a time."""
+
+  def __init__(self, connection, send_key, receive_key):
+    self.connection = connection
+    self._send_key = send_key
+    self._receive_key = receive_key
+    self._sent = 0
+    self._received = 0
+
+  @classmethod
+  def _keys(cls, authkey, coordinator_nonce, worker_nonce):
+    """Get the keys of a connection's messages to its worker and to its
+    coordinator."""
+    nonces = coordinator_nonce + worker_nonce
+    return (_sign(authkey, b'to worker' + nonces),
+            _sign(authkey, b'to coordinator' + nonces))
+
+  @classmethod
+  def accept(cls, connection, authkey):
+    """Authenticate the worker on the other end of a connection.
+
+    Returns:
+      the channel, or None if the connection closed.
+    Raises:
+      AuthenticationError: if the worker doesn't know the key.
+    """
+    coordinator_nonce = os.urandom(_NONCE_SIZE)
+    connection.sendall(coordinator_nonce)
+    answer = _receive_exactly(connection, _NONCE_SIZE + _DIGEST_SIZE)
+    if answer is None:
+      return None
+    worker_nonce = answer[:_NONCE_SIZE]
+    if not hmac.compare_digest(
+        answer[_NONCE_SIZE:],
+        _sign(authkey, b'worker' + coordinator_nonce + worker_nonce)):
+      raise AuthenticationError('the worker failed to authenticate')
+    connection.sendall(
+        _sign(authkey, b'coordinator' + coordinator_nonce + worker_nonce))
+    (to_worker, to_coordinator) = cls._keys(
+        authkey, coordinator_nonce, worker_nonce)
+    return cls(connection, to_worker, to_coordinator)
+
+  @classmethod
+  def connect(cls, connection, authkey):
+    """Authenticate the coordinator on the other end of a connection, as
+    `accept` does the worker."""
+    coordinator_nonce = _receive_exactly(connection, _NONCE_SIZE)
+    if coordinator_nonce is None:
+      return None
+    worker_nonce = os.urandom(_NONCE_SIZE)
+    connection.sendall(worker_nonce + _sign(
+        authkey, b'worker' + coordinator_nonce + worker_nonce))
+    answer = _receive_exactly(connection, _DIGEST_SIZE)
+    if answer is None:
+      # what the coordinator does with workers that don't know the key
+      raise AuthenticationError(
+          'the coordinator hung up on authenticating; is the key right?')
+    if not hmac.compare_digest(
+        answer,
+        _sign(authkey, b'coordinator' + coordinator_nonce + worker_nonce)):
+      raise AuthenticationError('the coordinator failed to authenticate')
+    (to_worker, to_coordinator) = cls._keys(
+        authkey, coordinator_nonce, worker_nonce)
+    return cls(connection, to_coordinator, to_worker)
+
+  def send(self, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    signature = _sign(self._send_key, _SEQUENCE.pack(self._sent) + data)
+    self._sent += 1
+    self.connection.sendall(_LENGTH.pack(len(data)) + signature + data)
+
+  def receive(self):
+    """Receive a message, or None once the connection's closed.
+
+    Raises:
+      AuthenticationError: if the message wasn't the next one signed with
+        the connection's key.
+    """
+    header = _receive_exactly(self.connection, _LENGTH.size + _DIGEST_SIZE)
+    if header is None:
+      return None
+    data = _receive_exactly(
+        self.connection, _LENGTH.unpack(header[:_LENGTH.size])[0])
+    if data is None:
+      return None
+    if not hmac.compare_digest(
+        header[_LENGTH.size:],
+        _sign(self._receive_key, _SEQUENCE.pack(self._received) + data)):
+      raise AuthenticationError('received a message with a bad signature')
+    self._received += 1
+    return pickle.loads(data)
+
+
+def _close(connection):
+  """Close a connection, waking whatever thread is receiving from it."""
+  try:
+    connection.shutdown(socket.SHUT_RDWR)
+  except (IOError, OSError):
+    pass
+  connection.close()
+
+
+class _Worker(object):
+  """The coordinator's view of a connected worker."""
+
+  def __init__(self, channel, name, max_tasks):
+    self.channel = channel
+    self.connection = channel.connection
+    self.name = name
+    self.max_tasks = max_tasks
+    self.last_heard = time.time()
+    # task ids to the tasks they're running
+    self.running = {}
+    self.send_lock = threading.Lock()
+
+  def send(self, message):
+    with self.send_lock:
+      self.channel.send(message)
+
+
+class _Submission(object):
+
+  def __init__(self, pickled_task, done):
+    self.pickled_task = pickled_task
+    self.done = done
+    self.attempts = 0
+
+
+class RemoteExecutor(_executor.Executor):
+  """Runs tasks on the worker daemons connected to it.
+
+  The executor reports no capacity: workers come and go during a run, so it
+  takes every ready task and queues those the workers have no room for,
+  handing them out in the order they were submitted.
+
+  Only workers given its `authkey` can connect, but what's sent to and from
+  them isn't encrypted: listen on networks you trust only.
+
+  Attributes:
+    authkey (bytes): the key workers must be given.
+  """
+
+  def __init__(self, host='localhost', port=0, heartbeat_timeout=10.0,
+               max_attempts=3, authkey=None):
+    """
+    Arguments:
+      host (str): the address to listen for workers on.
+      port (int): the port to listen on; 0 picks a free one (see `address`).
+      heartbeat_timeout (float): seconds of silence after which a worker is
+        given up on.
+      max_attempts (int): how many workers may be lost running a task before
+        it fails with a `WorkerLostError`.
+      authkey (bytes): the key shared with the workers; defaults to a random
+        one of hex digits.
+    """
+    self.authkey = (binascii.hexlify(os.urandom(16)) if authkey is None
+                    else authkey)
+    self._heartbeat_timeout = heartbeat_timeout
+    self._max_attempts = max_attempts
+    self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind((host, port))
+    self._listener.listen(16)
+    # Accepting times out now and then to check on the workers' heartbeats.
+    self._listener.settimeout(min(0.1, heartbeat_timeout / 4.0))
+    self._lock = threading.Lock()
+    self._ids = itertools.count()
+    self._queued = collections.deque()
+    self._workers = []
+    self._closed = False
+    self._threads = []
+    self._start_thread(self._serve)
+
+  @property
+  def address(self):
+    """The (host, port) workers should connect to."""
+    return self._listener.getsockname()[:2]
+
+  def worker_count(self):
+    with self._lock:
+      return len(self._workers)
+
+  def _start_thread(self, target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    with self._lock:
+      self._threads.append(thread)
+
+  def _serve(self):
+    while not self._closed:
+      try:
+        (connection, unused_address) = self._listener.accept()
+      except socket.timeout:
+        self._check_heartbeats()
+        continue
+      except (IOError, OSError):
+        return
+      # Peers get as long as a worker may go quiet for to authenticate.
+      connection.settimeout(self._heartbeat_timeout)
+      connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      self._start_thread(self._receive_from, connection)
+      self._check_heartbeats()
+
+  def _check_heartbeats(self):
+    deadline = time.time() - self._heartbeat_timeout
+    with self._lock:
+      quiet_workers = [worker for worker in self._workers
+                       if worker.last_heard < deadline]
+    for worker in quiet_workers:
+      # Its receiving thread gives it up.
+      _close(worker.connection)
+
+  def _receive_from(self, connection):
+    worker = None
+    try:
+      channel = _Channel.accept(connection, self.authkey)
+      if channel is None:
+        return
+      hello = channel.receive()
+      if hello is None or hello[0] != _HELLO:
+        return
+      connection.settimeout(None)
+      (unused_kind, name, max_tasks) = hello
+      worker = _Worker(channel, name, max_tasks)
+      with self._lock:
+        if self._closed:
+          return
+        self._workers.append(worker)
+      self._assign()
+      while True:
+        message = channel.receive()
+        if message is None:
+          return
+        worker.last_heard = time.time()
+        if message[0] == _DONE:
+          (unused_kind, task_id, error) = message
+          with self._lock:
+            submission = worker.running.pop(task_id, None)
+          if submission is not None:
+            self._assign()
+            submission.done(error)
+    except Exception:
+      # e.g. a dropped connection, a peer that doesn't know the key, or an
+      # error that can't be unpickled here
+      pass
+    finally:
+      _close(connection)
+      if worker is not None:
+        self._lose(worker)
+
+  def _lose(self, worker):
+    """Give up on a worker, handing what it was running to others."""
+    failed = []
+    with self._lock:
+      if worker in self._workers:
+        self._workers.remove(worker)
+      # Retried ahead of what's queued, as they were submitted earlier.
+      for (unused_task_id, submission) in sorted(worker.running.items(),
+                                                 reverse=True):
+        submission.attempts += 1
+        if submission.attempts >= self._max_attempts or self._closed:
+          failed.append(submission)
+        else:
+          self._queued.appendleft(submission)
+      worker.running.clear()
+    for submission in failed:
+      submission.done(WorkerLostError(
+          'lost %d worker(s) running the task, the last %r' % (
+              submission.attempts, worker.name)))
+    self._assign()
+
+  def _assign(self):
+    """Hand queued tasks to the workers with room for them."""
+    while True:
+      with self._lock:
+        if not self._queued:
+          return
+        if not self._workers:
+          return
+        roomiest = max(self._workers, key=lambda worker: (
+            worker.max_tasks - len(worker.running)))
+        if len(roomiest.running) >= roomiest.max_tasks:
+          return
+        submission = self._queued.popleft()
+        task_id = next(self._ids)
+        roomiest.running[task_id] = submission
+      try:
+        roomiest.send((_RUN, task_id, submission.pickled_task))
+      except (IOError, OSError):
+        # Its receiving thread gives it up, requeueing the task.
+        _close(roomiest.connection)
+
+  def submit(self, task, done):
+    try:
+      pickled_task = pickle.dumps(task, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+      done(e)
+      return
+    with self._lock:
+      self._queued.append(_Submission(pickled_task, done))
+    self._assign()
+
+  def shutdown(self):
+    """Stop listening and disconnect the workers."""
+    with self._lock:
+      self._closed = True
+      workers = list(self._workers)
+      threads = list(self._threads)
+    for worker in workers:
+      _close(worker.connection)
+    for thread in threads:
+      thread.join()
+    self._listener.close()
+
+
+class WorkerDaemon(object):
+  """Runs the tasks a `RemoteExecutor` hands it."""
+
+  def __init__(self, host, port, authkey, max_tasks=None,
+               heartbeat_interval=1.0, name=None):
+    """
+    Arguments:
+      host (str): the coordinator's address.
+      port (int): the coordinator's port.
+      authkey (bytes): the coordinator's `authkey`.
+      max_tasks (int): how many tasks to run at once; defaults to the number
+        of CPUs.
+      heartbeat_interval (float): seconds between heartbeats; keep it well
+        below the coordinator's heartbeat timeout.
+      name (str): what the coordinator calls the worker; defaults to the
+        host's name.
+    """
+    self._address = (host, port)
+    self._authkey = authkey
+    self._max_tasks = (
+        multiprocessing.cpu_count() if max_tasks is None else max_tasks)
+    self._heartbeat_interval = heartbeat_interval
+    self._name = socket.gethostname() if name is None else name
+    self._connection = None
+    self._channel = None
+    self._send_lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def _send(self, message):
+    with self._send_lock:
+      try:
+        self._channel.send(message)
+      except (IOError, OSError):
+        # The coordinator's gone; receiving notices.
+        pass
+
+  def _heartbeat(self):
+    while not self._stopped.wait(self._heartbeat_interval):
+      self._send((_HEARTBEAT,))
+
+  def _run_task(self, task_id, pickled_task, executor):
+    def done(error):
+      self._send((_DONE, task_id,
+                  None if error is None else _executor._picklable_error(error)))
+    try:
+      task = pickle.loads(pickled_task)
+    except Exception as e:
+      done(e)
+      return
+    executor.submit(task, done)
+
+  def run(self):
+    """Run tasks until the coordinator disconnects or `stop` is called.
+
+    Raises:
+      AuthenticationError: if the coordinator doesn't know the key, or sends
+        a message that wasn't signed with it.
+    """
+    self._connection = socket.create_connection(self._address)
+    self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    executor = _executor.ThreadPoolExecutor(self._max_tasks)
+    heartbeat = threading.Thread(target=self._heartbeat)
+    heartbeat.daemon = True
+    try:
+      try:
+        self._channel = _Channel.connect(self._connection, self._authkey)
+      except (IOError, OSError):
+        self._channel = None
+      if self._channel is None:
+        return
+      self._send((_HELLO, self._name, self._max_tasks))
+      heartbeat.start()
+      while not self._stopped.is_set():
+        try:
+          message = self._channel.receive()
+        except (IOError, OSError, EOFError):
+          message = None
+        if message is None:
+          break
+        if message[0] == _RUN:
+          (unused_kind, task_id, pickled_task) = message
+          self._run_task(task_id, pickled_task, executor)
+    finally:
+      self._stopped.set()
+      _close(self._connection)
+      if heartbeat.is_alive():
+        heartbeat.join()
+      executor.shutdown()
+
+  def start(self):
+    """Run on a thread of its own."""
+    self._thread = threading.Thread(target=self.run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Disconnect, abandoning the tasks being run, and wait for them to end."""
+    self._stopped.set()
+    if self._connection is not None:
+      _close(self._connection)
+    if self._thread is not None:
+      self._thread.join()
+
+
+def main(argv):
+  if len(argv) not in (3, 4):
+    sys.stderr.write('usage: %s HOST PORT [MAX_TASKS]\n' % argv[0])
+    return 2
+  authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE)
+  if not authkey:
+    sys.stderr.write('%s: set %s to the coordinator\'s key\n' % (
+        argv[0], AUTHKEY_ENVIRONMENT_VARIABLE))
+    return 2
+  WorkerDaemon(argv[1], int(argv[2]), authkey.encode('utf-8'),
+               max_tasks=int(argv[3]) if len(argv) == 4 else None).run()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
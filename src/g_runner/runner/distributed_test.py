@@ -0,0 +1,204 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from g_runner import runner
+from g_runner._compat import pickle
+from g_runner.runner import _run_test
+from g_runner.runner import distributed
+from g_runner.runner import tracker as _tracker
+
+_lock = threading.Lock()
+_ran = []
+_running = [0]
+_most_running = [0]
+# Released to let the first attempt of a `BlockingTask` go on.
+_unblock = threading.Event()
+_blocked = threading.Event()
+_unpickled = []
+
+
+def _note_unpickled():
+  _unpickled.append(True)
+
+
+class Unpickled(object):
+  """Notes when it's unpickled."""
+
+  def __reduce__(self):
+    return (_note_unpickled, ())
+
+
+class RecordingTask(_run_test.TestTask):
+  """Notes its name when run; run on workers, so only in this process."""
+
+  def __init__(self, task_name, inputs, outputs, fail=False, seconds=0):
+    super(RecordingTask, self).__init__(task_name, inputs, outputs)
+    self.fail = fail
+    self.seconds = seconds
+
+  def run(self):
+    with _lock:
+      _running[0] += 1
+      _most_running[0] = max(_most_running[0], _running[0])
+    time.sleep(self.seconds)
+    with _lock:
+      _running[0] -= 1
+      _ran.append(self.name)
+    if self.fail:
+      raise ValueError(self.name)
+
+
+class BlockingTask(RecordingTask):
+  """Blocks the first time it runs."""
+
+  def run(self):
+    if not _blocked.is_set():
+      _blocked.set()
+      _unblock.wait()
+    super(BlockingTask, self).run()
+
+
+def _wait_for(condition):
+  deadline = time.time() + 10
+  while not condition():
+    if time.time() > deadline:
+      raise AssertionError('timed out')
+    time.sleep(0.01)
+
+
+class RemoteExecutorTest(unittest.TestCase):
+
+  def setUp(self):
+    del _ran[:]
+    _most_running[0] = 0
+    _unblock.clear()
+    _blocked.clear()
+    self.workers = []
+
+  def tearDown(self):
+    _unblock.set()
+    for worker in self.workers:
+      worker.stop()
+    self.executor.shutdown()
+
+  def start_worker(self, **kwargs):
+    (host, port) = self.executor.address
+    worker = distributed.WorkerDaemon(
+        host, port, self.executor.authkey, **kwargs)
+    worker.start()
+    self.workers.append(worker)
+    return worker
+
+  def run_tasks(self, tasks):
+    paths = [('root',)] + [path for task in tasks for path in task.outputs]
+    tracker = _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+    root_event = runner.Event(
+        path_selector=lambda unused_tracker: [('root',)],
+        flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+    runner.run_tracker(tracker, [root_event], outdated=True,
+                       executor=self.executor)
+
+  def test_runs_graph_on_workers(self):
+    self.executor = distributed.RemoteExecutor()
+    for unused_worker in range(2):
+      self.start_worker(max_tasks=2)
+    self.run_tasks([
+        RecordingTask('a', [('root',)], [('a',)]),
+        RecordingTask('b', [('a',)], [('b',)]),
+        RecordingTask('c', [('a',)], [('c',)]),
+        RecordingTask('d', [('b',), ('c',)], [('d',)]),
+    ])
+    self.assertEqual('a', _ran[0])
+    self.assertEqual(set('bc'), set(_ran[1:3]))
+    self.assertEqual('d', _ran[3])
+
+  def test_failures_poison_outputs(self):
+    self.executor = distributed.RemoteExecutor()
+    self.start_worker(max_tasks=1)
+    with self.assertRaises(runner.RunnerError):
+      self.run_tasks([
+          RecordingTask('a', [('root',)], [('a',)], fail=True),
+          RecordingTask('b', [('a',)], [('b',)]),
+      ])
+    self.assertEqual(['a'], _ran)
+
+  def test_per_worker_limit(self):
+    self.executor = distributed.RemoteExecutor()
+    self.start_worker(max_tasks=2)
+    self.run_tasks([RecordingTask(str(i), [('root',)], [(i,)], seconds=0.02)
+                    for i in range(6)])
+    self.assertEqual(6, len(_ran))
+    self.assertEqual(2, _most_running[0])
+
+  def test_tasks_of_quiet_workers_are_requeued(self):
+    self.executor = distributed.RemoteExecutor(heartbeat_timeout=0.3)
+    self.start_worker(max_tasks=1, heartbeat_interval=60)
+    done = []
+    self.executor.submit(BlockingTask('a', [], []), done.append)
+    _wait_for(_blocked.is_set)
+    self.start_worker(max_tasks=1, heartbeat_interval=0.05)
+    _wait_for(lambda: done)
+    self.assertEqual([None], done)
+    self.assertEqual(1, self.executor.worker_count())
+
+  def test_tasks_fail_after_losing_too_many_workers(self):
+    self.executor = distributed.RemoteExecutor(max_attempts=1)
+    worker = self.start_worker(max_tasks=1)
+    done = []
+    self.executor.submit(BlockingTask('a', [], []), done.append)
+    _wait_for(_blocked.is_set)
+    # The worker disconnects before the task gets to finish.
+    threading.Timer(0.1, _unblock.set).start()
+    worker.stop()
+    _wait_for(lambda: done)
+    self.assertIsInstance(done[0], distributed.WorkerLostError)
+
+  def test_workers_without_the_key_are_rejected(self):
+    self.executor = distributed.RemoteExecutor()
+    (host, port) = self.executor.address
+    worker = distributed.WorkerDaemon(host, port, b'not the key')
+    self.assertRaises(distributed.AuthenticationError, worker.run)
+    self.assertEqual(0, self.executor.worker_count())
+    self.start_worker(max_tasks=1)
+    self.run_tasks([RecordingTask('a', [('root',)], [('a',)])])
+    self.assertEqual(['a'], _ran)
+
+  def test_unauthenticated_messages_arent_unpickled(self):
+    del _unpickled[:]
+    self.executor = distributed.RemoteExecutor()
+    connection = socket.create_connection(self.executor.address)
+    try:
+      data = pickle.dumps(
+          ('hello', Unpickled(), 'x' * 100), pickle.HIGHEST_PROTOCOL)
+      connection.sendall(struct.pack('!I', len(data)) + data)
+      # The coordinator hangs up once it's read what should've been a proof.
+      while connection.recv(1 << 10):
+        pass
+    finally:
+      connection.close()
+    self.assertEqual([], _unpickled)
+    self.assertEqual(0, self.executor.worker_count())
+
+
+class ChannelTest(unittest.TestCase):
+
+  def test_replayed_messages_are_rejected(self):
+    (sending, sent) = socket.socketpair()
+    (replaying, receiving) = socket.socketpair()
+    try:
+      distributed._Channel(sending, b'a', b'b').send(('heartbeat',))
+      frame = sent.recv(1 << 10)
+      replaying.sendall(frame + frame)
+      channel = distributed._Channel(receiving, b'b', b'a')
+      self.assertEqual(('heartbeat',), channel.receive())
+      self.assertRaises(distributed.AuthenticationError, channel.receive)
+    finally:
+      for connection in (sending, sent, replaying, receiving):
+        connection.close()
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
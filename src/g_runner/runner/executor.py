@@ -0,0 +1,309 @@
+"""Executors that run tasks on behalf of the runner."""
+
+import abc
+import multiprocessing
+import threading
+
+from g_runner import _compat
+from g_runner._compat import pickle
+from g_runner._compat import queue
+
+
+class Executor(_compat.ABC):
+  """Runs tasks, reporting back when they're done.
+
+  Implementations must be safe to `submit` to from any thread, including from
+  within `done` callbacks."""
+
+  @abc.abstractmethod
+  def submit(self, task, done):
+    """Run a task eventually.
+
+    Arguments:
+      task (interfaces.Task): the task to run.
+      done (callable): called once the task has finished with the exception it
+        raised, or None if it ran successfully. May be called from any thread.
+    """
+    raise NotImplementedError()
+
+  def capacity(self):
+    """Get how many tasks the executor can run at once, or None if unbounded.
+
+    The runner holds back ready tasks beyond this so that it, rather than the
+    executor's queue, picks which of them start first."""
+    return None
+
+  def shutdown(self):
+    """Release the executor's resources once all submitted tasks are done."""
+    pass
+
+
+def _run_task(task, done):
+  error = None
+  try:
+    task.run()
+  except Exception as e:
+    error = e
+  done(error)
+
+
+class ThreadExecutor(Executor):
+  """Runs every task on a thread of its own."""
+
+  def submit(self, task, done):
+    threading.Thread(target=_run_task, args=(task, done)).start()
+
+
+class ThreadPoolExecutor(Executor):
+  """Runs tasks on at most `max_workers` reusable threads.
+
+  Tasks submitted while all workers are busy wait in a queue. Workers are
+  started as needed, so an executor that only ever sees one task at a time
+  only ever has one thread."""
+
+  def __init__(self, max_workers):
+    if max_workers < 1:
+      raise ValueError('expected at least one worker')
+    self._max_workers = max_workers
+    self._queue = queue.Queue()
+    self._lock = threading.Lock()
+    self._workers = []
+    self._idle_workers = 0
+
+  def _work(self):
+    while True:
+      with self._lock:
+        self._idle_workers += 1
+      item = self._queue.get()
+      with self._lock:
+        self._idle_workers -= 1
+      if item is None:
+        return
+      _run_task(*item)
+
+  def submit(self, task, done):
+    with self._lock:
+      self._queue.put((task, done))
+      if (self._queue.qsize() > self._idle_workers and
+          len(self._workers) < self._max_workers):
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+        self._workers.append(worker)
+
+  def capacity(self):
+    return self._max_workers
+
+  def shutdown(self):
+    with self._lock:
+      workers = list(self._workers)
+      del self._workers[:]
+    for unused_worker in workers:
+      self._queue.put(None)
+    for worker in workers:
+      worker.join()
+
+
+def _picklable_error(error):
+  """Get an error, or a stand-in for it if it can't be pickled."""
+  try:
+    pickle.dumps(error, pickle.HIGHEST_PROTOCOL)
+  except Exception:
+    return RuntimeError('%s: %s' % (type(error).__name__, error))
+  return error
+
+
+def _run_pickled_task(pickled_task):
+  """Run a task in a worker process, returning the error it raised if any."""
+  try:
+    pickle.loads(pickled_task).run()
+  except Exception as e:
+    return _picklable_error(e)
+  return None
+
+
+def _serve_pickled_tasks(connection):
+  """Run the pickled tasks a pipe brings, until it brings an empty message or
+  is closed, answering each with the pickled error it raised (or None)."""
+  while True:
+    try:
+      pickled_task = connection.recv_bytes()
+    except (EOFError, IOError, OSError):
+      return
+    if not pickled_task:
+      return
+    connection.send_bytes(pickle.dumps(
+        _run_pickled_task(pickled_task), pickle.HIGHEST_PROTOCOL))
+
+
+class WorkerDiedError(Exception):
+  """The worker process running a task died, e.g. crashed or was killed."""
+
+
+class _WorkerProcess(object):
+  """A process running one task at a time, sent down a pipe."""
+
+  def __init__(self):
+    (self._connection, child_connection) = multiprocessing.Pipe()
+    self._process = multiprocessing.Process(
+        target=_serve_pickled_tasks, args=(child_connection,))
+    self._process.daemon = True
+    self._process.start()
+    # Only the child holds its end, so the pipe breaks once the child dies.
+    child_connection.close()
+
+  def run(self, pickled_task):
+    """Run a pickled task, returning the error it raised if any.
+
+    Raises:
+      WorkerDiedError: if the process died running it.
+    """
+    try:
+      self._connection.send_bytes(pickled_task)
+      return pickle.loads(self._connection.recv_bytes())
+    except (EOFError, IOError, OSError):
+      self.close()
+      raise WorkerDiedError(
+          'the worker process running the task died (exit code %r)' % (
+              self._process.exitcode,))
+
+  def close(self):
+    # Forked processes may hold copies of our end of the pipe, so the child
+    # is told to stop rather than left to notice the pipe closing.
+    try:
+      self._connection.send_bytes(b'')
+    except (IOError, OSError):
+      pass
+    self._connection.close()
+    self._process.join()
+
+
+class ProcessPoolExecutor(Executor):
+  """Runs tasks in a pool of worker processes.
+
+  Suits CPU-bound tasks written in Python, which threads would serialize on the
+  interpreter lock. Tasks are pickled to be sent to the workers, so they (and
+  whatever they refer to) must be picklable; tasks that aren't fail without
+  running. Any changes a task makes to its own state stay in the worker.
+
+  A task whose worker dies running it (e.g. crashes, or is killed for running
+  out of memory) fails with a `WorkerDiedError`, and the worker is replaced.
+  """
+
+  def __init__(self, processes=None):
+    """
+    Arguments:
+      processes (int): the number of worker processes; defaults to the number
+        of CPUs.
+    """
+    self._processes = (
+        multiprocessing.cpu_count() if processes is None else processes)
+    if self._processes < 1:
+      raise ValueError('expected at least one process')
+    self._queue = queue.Queue()
+    # Held while starting a worker, so that no other worker is forked holding
+    # its end of the pipe, which would keep the pipe from breaking.
+    self._start_lock = threading.Lock()
+    # Each worker process is kept busy by a thread of its own.
+    self._threads = []
+    for unused_process in range(self._processes):
+      thread = threading.Thread(target=self._work)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def _work(self):
+    worker = None
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      (pickled_task, done) = item
+      try:
+        if worker is None:
+          with self._start_lock:
+            worker = _WorkerProcess()
+        error = worker.run(pickled_task)
+      except WorkerDiedError as e:
+        worker = None
+        error = e
+      except Exception as e:
+        # e.g. a worker that couldn't be started
+        error = e
+      done(error)
+    if worker is not None:
+      worker.close()
+
+  def submit(self, task, done):
+    try:
+      pickled_task = pickle.dumps(task, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+      done(e)
+      return
+    self._queue.put((pickled_task, done))
+
+  def capacity(self):
+    return self._processes
+
+  def shutdown(self):
+    for unused_thread in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+
+
+class _AwaitableCapturingTask(object):
+  """Runs a task, keeping hold of the awaitable its `run` returns if any."""
+
+  def __init__(self, task, isawaitable):
+    self.task = task
+    self.isawaitable = isawaitable
+    self.awaitable = None
+
+  def run(self):
+    result = self.task.run()
+    if self.isawaitable(result):
+      self.awaitable = result
+
+
+class AsyncioExecutor(Executor):
+  """Runs coroutine tasks on an asyncio event loop (requires Python 3).
+
+  Tasks whose `run` is a coroutine function are run on the loop directly. Other
+  tasks run on `executor`, and if their `run` returns an awaitable (e.g. a
+  `scripting.ScriptedTask` of a coroutine function) that is awaited on the loop
+  without holding on to the executor's thread."""
+
+  def __init__(self, loop, executor=None):
+    import asyncio
+    import inspect
+    self._asyncio = asyncio
+    self._isawaitable = inspect.isawaitable
+    self._loop = loop
+    self._executor = ThreadExecutor() if executor is None else executor
+
+  def _await(self, make_awaitable, done):
+    try:
+      future = self._asyncio.ensure_future(make_awaitable(), loop=self._loop)
+    except Exception as e:
+      done(e)
+      return
+    def awaited(future):
+      if future.cancelled():
+        done(self._asyncio.CancelledError())
+      else:
+        done(future.exception())
+    future.add_done_callback(awaited)
+
+  def submit(self, task, done):
+    if self._asyncio.iscoroutinefunction(task.run):
+      self._loop.call_soon_threadsafe(self._await, task.run, done)
+      return
+    capturing_task = _AwaitableCapturingTask(task, self._isawaitable)
+    def ran(error):
+      if error is None and capturing_task.awaitable is not None:
+        self._loop.call_soon_threadsafe(
+            self._await, lambda: capturing_task.awaitable, done)
+      else:
+        done(error)
+    self._executor.submit(capturing_task, ran)
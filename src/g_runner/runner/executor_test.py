@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from g_runner.runner import executor
+from g_runner.runner import tracker_test
+
+
+class ConcurrencyTask(tracker_test.TestTask):
+
+  def __init__(self, task_name, counter):
+    super(ConcurrencyTask, self).__init__(task_name, [], [])
+    self.counter = counter
+
+  def run(self):
+    self.counter.enter()
+    time.sleep(0.01)
+    self.counter.exit()
+
+
+class ConcurrencyCounter(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.current = 0
+    self.peak = 0
+    self.threads = set()
+
+  def enter(self):
+    with self.lock:
+      self.current += 1
+      self.peak = max(self.peak, self.current)
+      self.threads.add(threading.current_thread())
+
+  def exit(self):
+    with self.lock:
+      self.current -= 1
+
+
+class FailingTask(tracker_test.TestTask):
+
+  def run(self):
+    raise RuntimeError(self.name)
+
+
+class PidWritingTask(tracker_test.TestTask):
+
+  def __init__(self, task_name, filename):
+    super(PidWritingTask, self).__init__(task_name, [], [])
+    self.filename = filename
+
+  def run(self):
+    with open(self.filename, 'w') as pid_file:
+      pid_file.write(str(os.getpid()))
+
+
+class DyingTask(tracker_test.TestTask):
+
+  def run(self):
+    os._exit(1)
+
+
+class UnpicklableTask(tracker_test.TestTask):
+
+  def __init__(self, task_name):
+    super(UnpicklableTask, self).__init__(task_name, [], [])
+    self.lock = threading.Lock()
+
+
+class Completions(object):
+
+  def __init__(self, count):
+    self.errors = []
+    self.remaining = count
+    self.condition = threading.Condition()
+
+  def done(self, error):
+    with self.condition:
+      self.errors.append(error)
+      self.remaining -= 1
+      self.condition.notify_all()
+
+  def wait(self):
+    with self.condition:
+      while self.remaining > 0:
+        self.condition.wait()
+
+
+class ThreadPoolExecutorTest(unittest.TestCase):
+
+  def test_bounded_concurrency(self):
+    counter = ConcurrencyCounter()
+    completions = Completions(20)
+    pool = executor.ThreadPoolExecutor(3)
+    for i in range(20):
+      pool.submit(ConcurrencyTask(str(i), counter), completions.done)
+    completions.wait()
+    pool.shutdown()
+    self.assertEqual([None] * 20, completions.errors)
+    self.assertLessEqual(counter.peak, 3)
+    self.assertLessEqual(len(counter.threads), 3)
+
+  def test_failure_reported(self):
+    completions = Completions(1)
+    pool = executor.ThreadPoolExecutor(1)
+    pool.submit(FailingTask('foo', [], []), completions.done)
+    completions.wait()
+    pool.shutdown()
+    self.assertIsInstance(completions.errors[0], RuntimeError)
+
+  def test_no_workers(self):
+    with self.assertRaises(ValueError):
+      executor.ThreadPoolExecutor(0)
+
+
+class ProcessPoolExecutorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.pool = executor.ProcessPoolExecutor(2)
+
+  def tearDown(self):
+    self.pool.shutdown()
+    shutil.rmtree(self.directory)
+
+  def test_runs_in_other_process(self):
+    filename = os.path.join(self.directory, 'pid')
+    completions = Completions(1)
+    self.pool.submit(PidWritingTask('pid', filename), completions.done)
+    completions.wait()
+    self.assertEqual([None], completions.errors)
+    with open(filename) as pid_file:
+      self.assertNotEqual(os.getpid(), int(pid_file.read()))
+
+  def test_failure_reported(self):
+    completions = Completions(1)
+    self.pool.submit(FailingTask('foo', [], []), completions.done)
+    completions.wait()
+    self.assertIsInstance(completions.errors[0], RuntimeError)
+    self.assertEqual('foo', str(completions.errors[0]))
+
+  def test_unpicklable_task_fails(self):
+    completions = Completions(1)
+    self.pool.submit(UnpicklableTask('foo'), completions.done)
+    completions.wait()
+    self.assertIsNotNone(completions.errors[0])
+
+  def test_dead_workers_fail_their_tasks_and_are_replaced(self):
+    completions = Completions(1)
+    self.pool.submit(DyingTask('dies', [], []), completions.done)
+    completions.wait()
+    self.assertIsInstance(completions.errors[0], executor.WorkerDiedError)
+    completions = Completions(2)
+    for i in range(2):
+      self.pool.submit(
+          PidWritingTask('pid', os.path.join(self.directory, str(i))),
+          completions.done)
+    completions.wait()
+    self.assertEqual([None, None], completions.errors)
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,154 @@
+"""Identities of paths and tasks that hold across processes and runs.
+
+Tasks and paths are compared by value within a run, but many values (functions,
+`object()` sentinels, tasks holding either) hash and print differently in every
+process. `stable_key` spells a value out from its parts instead, so that what's
+learned about a task in one run (e.g. how long it took) can be looked up in the
+next."""
+
+import functools
+import hashlib
+import sys
+import types
+
+from g_runner import interfaces
+
+
+def _named_sentinel(module_name, name):
+  __import__(module_name)
+  return getattr(sys.modules[module_name], name)
+
+
+class Sentinel(object):
+  """A unique marker value named by the module attribute holding it.
+
+  Unlike a bare `object()`, it pickles by reference (so that it's still itself
+  in another process) and has a stable key."""
+
+  def __init__(self, module_name, name):
+    self._module_name = module_name
+    self._name = name
+
+  def __reduce__(self):
+    return (_named_sentinel, (self._module_name, self._name))
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def stable_key(self):
+    return '%s.%s' % (self._module_name, self._name)
+
+  def __repr__(self):
+    return self.stable_key()
+
+
+def _qualified_name(value):
+  return '%s.%s' % (
+      getattr(value, '__module__', None),
+      getattr(value, '__qualname__', getattr(value, '__name__', None)))
+
+
+def _key(value):
+  if value is None or isinstance(value, (bool, int, float)):
+    return repr(value)
+  if sys.version_info[0] < 3 and isinstance(value, long):
+    return repr(int(value))
+  if isinstance(value, (str, bytes)) or (
+      sys.version_info[0] < 3 and isinstance(value, unicode)):
+    return repr(value)
+  if isinstance(value, (tuple, list)):
+    return '%s(%s)' % (type(value).__name__,
+                       ', '.join(_key(element) for element in value))
+  if isinstance(value, (set, frozenset)):
+    return 'set(%s)' % ', '.join(sorted(_key(element) for element in value))
+  if isinstance(value, dict):
+    return 'dict(%s)' % ', '.join(sorted(
+        '%s: %s' % (_key(key), _key(element))
+        for (key, element) in value.items()))
+  if isinstance(value, (types.FunctionType, types.BuiltinFunctionType, type)):
+    return _qualified_name(value)
+  if hasattr(value, 'stable_key'):
+    return value.stable_key()
+  if isinstance(value, interfaces.Task):
+    return '%s(%s, %s)' % (
+        _qualified_name(type(value)), _key(tuple(value.input_paths())),
+        _key(tuple(value.output_paths())))
+  return '%s(%r)' % (_qualified_name(type(value)), value)
+
+
+def stable_key(value):
+  """Get a string identifying a value the same way in every process.
+
+  Built-in containers and scalars are spelled out, objects with a `stable_key()`
+  method are asked for their key, functions and classes are named by module and
+  name, and other tasks by class and paths. Anything else falls back on its
+  `repr`, which may not be stable.
+
+  Returns:
+    A short hexadecimal digest.
+  """
+  key = _key(value)
+  if not isinstance(key, bytes):
+    key = key.encode('utf-8')
+  return hashlib.sha1(key).hexdigest()
+
+
+def _code_object_key(code):
+  return 'code(%s, %s, %s)' % (
+      _key(code.co_code), _key(code.co_names), ', '.join(
+          _code_object_key(const) if isinstance(const, types.CodeType)
+          else _key(const) for const in code.co_consts))
+
+
+def _callable_code_key(callee):
+  if isinstance(callee, types.FunctionType):
+    cells = []
+    for cell in callee.__closure__ or ():
+      try:
+        cells.append(_key(cell.cell_contents))
+      except ValueError:
+        # an empty cell
+        cells.append('')
+    return '%s(%s, %s, %s)' % (
+        _qualified_name(callee), _code_object_key(callee.__code__),
+        _key(callee.__defaults__), ', '.join(cells))
+  if isinstance(callee, types.MethodType):
+    function_key = _callable_code_key(callee.__func__)
+    if function_key is None:
+      return None
+    return '%s(%s)' % (function_key, _key(callee.__self__))
+  if isinstance(callee, functools.partial):
+    function_key = _callable_code_key(callee.func)
+    if function_key is None:
+      return None
+    return 'partial(%s, %s, %s)' % (
+        function_key, _key(callee.args), _key(callee.keywords or {}))
+  if isinstance(callee, types.BuiltinFunctionType):
+    bound = getattr(callee, '__self__', None)
+    if bound is None or isinstance(bound, types.ModuleType):
+      return _qualified_name(callee)
+    return '%s(%s)' % (_qualified_name(callee), _key(bound))
+  return None
+
+
+def code_key(callee):
+  """Get a key that changes along with what a callable's code does, or None if
+  there's no telling.
+
+  Python functions are keyed by their bytecode and constants (those of the
+  functions they define included), defaults and closure, and bound methods and
+  `functools.partial`s by their function's key and what's bound. Built-in
+  functions are keyed by name and what they're bound to. Other callables get
+  None. Functions that a function calls by name aren't looked into, so
+  changing them goes unnoticed.
+
+  Returns:
+    A short hexadecimal digest, or None.
+  """
+  key = _callable_code_key(callee)
+  if key is None:
+    return None
+  return stable_key(key)
@@ -0,0 +1,86 @@
+import copy
+import functools
+import unittest
+
+from g_runner import scripting
+from g_runner._compat import pickle
+from g_runner.runner import identity
+from g_runner.runner import tracker_test
+
+
+class StableKeyTest(unittest.TestCase):
+
+  def test_equal_values_equal_keys(self):
+    self.assertEqual(identity.stable_key((1, 'a', {'b': [2.5]})),
+                     identity.stable_key((1, 'a', {'b': [2.5]})))
+    self.assertNotEqual(identity.stable_key((1,)), identity.stable_key([1]))
+    self.assertEqual(identity.stable_key(frozenset([3, 1, 2])),
+                     identity.stable_key(set([2, 3, 1])))
+
+  def test_tasks(self):
+    task = tracker_test.TestTask('task', [(0,)], [(1,)])
+    self.assertEqual(identity.stable_key(task),
+                     identity.stable_key(copy.copy(task)))
+    self.assertNotEqual(
+        identity.stable_key(task),
+        identity.stable_key(tracker_test.TestTask('task', [(0,)], [(2,)])))
+
+  def test_scripted_task_key_survives_pickling(self):
+    task = scripting.ScriptedTask(
+        len, [(scripting.FILE_PATH_TAG, 'in')],
+        [(scripting.TASK_PATH_TAG, 'out')], args=('abc',))
+    self.assertEqual(identity.stable_key(task),
+                     identity.stable_key(pickle.loads(pickle.dumps(task, 2))))
+
+
+def _make_adder(amount):
+  def add(value):
+    return value + amount
+  return add
+
+
+def _add_one(value):
+  return value + 1
+
+
+def _add_two(value):
+  return value + 2
+
+
+class CodeKeyTest(unittest.TestCase):
+
+  def test_follows_code(self):
+    self.assertEqual(identity.code_key(_add_one), identity.code_key(_add_one))
+    self.assertNotEqual(identity.code_key(_add_one),
+                        identity.code_key(_add_two))
+    # closures, partials and bound methods bring along what they're bound to
+    self.assertEqual(identity.code_key(_make_adder(1)),
+                     identity.code_key(_make_adder(1)))
+    self.assertNotEqual(identity.code_key(_make_adder(1)),
+                        identity.code_key(_make_adder(2)))
+    self.assertNotEqual(identity.code_key(functools.partial(_add_one, 1)),
+                        identity.code_key(functools.partial(_add_one, 2)))
+    self.assertNotEqual(identity.code_key('a'.upper),
+                        identity.code_key('b'.upper))
+    self.assertIsNotNone(identity.code_key(len))
+
+  def test_unknown_callables(self):
+    class Callable(object):
+      def __call__(self):
+        pass
+    self.assertIsNone(identity.code_key(Callable()))
+    self.assertIsNone(identity.code_key(functools.partial(Callable())))
+
+
+class SentinelTest(unittest.TestCase):
+
+  def test_pickles_and_copies_by_reference(self):
+    for sentinel in (scripting.TASK_PATH_TAG, scripting.FILE_PATH_TAG):
+      self.assertIs(sentinel, pickle.loads(pickle.dumps(sentinel, 2)))
+      self.assertIs(sentinel, copy.deepcopy(sentinel))
+    self.assertEqual('g_runner.scripting.TASK_PATH_TAG',
+                     repr(scripting.TASK_PATH_TAG))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,63 @@
+"""Budgets of resources shared by the tasks of a run.
+
+A budget names resources (e.g. 'cpus', 'memory', or 'db_connections' for a
+shared external service) and how much of each all running tasks may hold
+together; see `interfaces.Task.resources` for the tasks' side."""
+
+import multiprocessing
+import os
+
+
+def host_budget():
+  """Get a budget of this host's CPUs and (where known) memory in bytes."""
+  limits = {'cpus': multiprocessing.cpu_count()}
+  try:
+    limits['memory'] = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+  except (AttributeError, ValueError, OSError):
+    pass
+  return limits
+
+
+class ResourceBudget(object):
+  """How much of each resource running tasks hold against their limits.
+
+  Not thread safe; the runner uses it under its lock."""
+
+  def __init__(self, limits=None):
+    """
+    Arguments:
+      limits (dict): resource names to the amounts available; None or an empty
+        dict puts no limit on anything.
+    """
+    limits = dict(limits or {})
+    for (name, limit) in limits.items():
+      if limit < 0:
+        raise ValueError('expected a non-negative limit for %r' % (name,))
+    self._limits = limits
+    self._in_use = dict((name, 0) for name in limits)
+
+  def clamp(self, needs):
+    """Get the amounts of the limited resources a task would hold.
+
+    Needs beyond a limit are cut down to it, so that a task asking for more
+    than there is still runs (alone) rather than never."""
+    return dict((name, min(amount, self._limits[name]))
+                for (name, amount) in needs.items()
+                if name in self._limits and amount > 0)
+
+  def fits(self, amounts):
+    """Whether clamped amounts are available right now."""
+    return all(self._in_use[name] + amount <= self._limits[name]
+               for (name, amount) in amounts.items())
+
+  def acquire(self, amounts):
+    for (name, amount) in amounts.items():
+      self._in_use[name] += amount
+
+  def release(self, amounts):
+    for (name, amount) in amounts.items():
+      self._in_use[name] -= amount
+
+  def in_use(self):
+    """Get the amounts of the limited resources currently held."""
+    return dict(self._in_use)
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import resources
+from g_runner.runner import tracker as _tracker
+
+
+class ResourceTask(_run_test.TestTask):
+
+  def __init__(self, task_name, inputs, outputs, needs, holders):
+    super(ResourceTask, self).__init__(task_name, inputs, outputs)
+    self.needs = needs
+    self.holders = holders
+
+  def resources(self):
+    return self.needs
+
+  def run(self):
+    self.holders.enter(self.needs)
+    super(ResourceTask, self).run()
+    time.sleep(0.01)
+    self.holders.exit(self.needs)
+
+
+class Holders(object):
+  """Tracks the peak amounts held by concurrently running tasks."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.held = {}
+    self.peak = {}
+
+  def enter(self, needs):
+    with self.lock:
+      for (name, amount) in needs.items():
+        self.held[name] = self.held.get(name, 0) + amount
+        self.peak[name] = max(self.peak.get(name, 0), self.held[name])
+
+  def exit(self, needs):
+    with self.lock:
+      for (name, amount) in needs.items():
+        self.held[name] -= amount
+
+
+class ResourceBudgetTest(unittest.TestCase):
+
+  def test_clamp_and_fit(self):
+    budget = resources.ResourceBudget({'cpus': 4, 'db_connections': 1})
+    self.assertEqual({'cpus': 4}, budget.clamp({'cpus': 8, 'other': 3}))
+    self.assertTrue(budget.fits({'cpus': 3, 'db_connections': 1}))
+    budget.acquire({'cpus': 3})
+    self.assertFalse(budget.fits({'cpus': 2}))
+    self.assertTrue(budget.fits({'cpus': 1, 'db_connections': 1}))
+    budget.release({'cpus': 3})
+    self.assertEqual({'cpus': 0, 'db_connections': 0}, budget.in_use())
+
+  def test_negative_limit(self):
+    with self.assertRaises(ValueError):
+      resources.ResourceBudget({'cpus': -1})
+
+  def test_host_budget(self):
+    self.assertGreaterEqual(resources.host_budget()['cpus'], 1)
+
+
+class RunnerBudgetTest(unittest.TestCase):
+
+  def test_run_respects_budget(self):
+    holders = Holders()
+    tasks = [ResourceTask('root', [], [(0,)], {}, holders)]
+    tasks.extend(
+        ResourceTask(str(i), [(0,)], [(i,)],
+                     {'db_connections': 1, 'memory': 2 if i % 2 else 1},
+                     holders)
+        for i in range(1, 20))
+    # Needs more than there is, so runs with all of it.
+    tasks.append(ResourceTask('big', [(0,)], [('big',)], {'memory': 100},
+                              holders))
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[path for task in tasks for path in task.outputs],
+        new_tasks=tasks)
+    runner.run_tracker(
+        tracker, [], outdated=True,
+        resource_budget={'db_connections': 4, 'memory': 4})
+    for task in tasks:
+      self.assertEqual(1, task.ran_count)
+    self.assertLessEqual(holders.peak['db_connections'], 4)
+    # The big task ran alone, holding all of the memory.
+    self.assertEqual(100, holders.peak['memory'])
+    self.assertGreaterEqual(holders.peak['db_connections'], 2)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
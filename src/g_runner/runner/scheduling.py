@@ -0,0 +1,155 @@
+"""Policies for the order in which the runner starts ready tasks.
+
+Order only matters when more tasks are ready than their executor has room for
+(see `executor.Executor.capacity`); the runner then starts the ready tasks of
+highest priority first, and those of equal priority in the order they became
+ready."""
+
+import json
+import os
+import tempfile
+import threading
+
+from g_runner.runner import identity
+
+
+class SchedulingPolicy(object):
+  """Ranks ready tasks; the base policy ranks them all the same."""
+
+  def priority(self, tracker, task):
+    """Get the priority of a ready task; higher runs sooner.
+
+    Called under the runner's lock whenever the task becomes ready."""
+    return 0
+
+  def on_task_finished(self, task, seconds, error):
+    """Called from the executor with how long a task ran for."""
+    pass
+
+  def on_run_finished(self):
+    """Called once the run is over, whether or not it succeeded."""
+    pass
+
+
+class FifoPolicy(SchedulingPolicy):
+  """Starts ready tasks in the order they became ready."""
+
+
+class DurationStore(object):
+  """How long tasks took in previous runs, kept in a small JSON file.
+
+  Tasks are looked up by `identity.stable_key`. Each recorded duration is
+  blended into the previous estimate, so that estimates follow gradual changes
+  without being thrown by a single slow run."""
+
+  def __init__(self, filename=None, weight=0.5):
+    """
+    Arguments:
+      filename (str): where the durations are kept; None keeps them in memory.
+      weight (float): how much a newly recorded duration counts against the
+        previous estimate, between 0 (not at all) and 1 (it replaces it).
+    """
+    self._filename = filename
+    self._weight = weight
+    self._lock = threading.Lock()
+    self._durations = {}
+    if filename is not None and os.path.exists(filename):
+      with open(filename) as store_file:
+        try:
+          self._durations = dict(json.load(store_file))
+        except ValueError:
+          # A corrupt store only costs us the estimates.
+          self._durations = {}
+
+  def estimate(self, task):
+    """Get the expected duration in seconds of a task, or None if unknown."""
+    with self._lock:
+      return self._durations.get(identity.stable_key(task))
+
+  def record(self, task, seconds):
+    key = identity.stable_key(task)
+    with self._lock:
+      previous = self._durations.get(key)
+      self._durations[key] = seconds if previous is None else (
+          previous + self._weight * (seconds - previous))
+
+  def save(self):
+    """Write the durations out atomically (a no-op for in-memory stores)."""
+    if self._filename is None:
+      return
+    with self._lock:
+      durations = dict(self._durations)
+    directory = os.path.dirname(os.path.abspath(self._filename))
+    (fd, temporary_filename) = tempfile.mkstemp(dir=directory)
+    try:
+      with os.fdopen(fd, 'w') as store_file:
+        json.dump(durations, store_file, sort_keys=True)
+      os.rename(temporary_filename, self._filename)
+    except Exception:
+      os.remove(temporary_filename)
+      raise
+
+
+class CriticalPathPolicy(SchedulingPolicy):
+  """Runs the tasks heading the longest chains of remaining work first.
+
+  A task's priority is its estimated duration plus the largest priority among
+  the tasks consuming its outputs, i.e. the length of the longest path of
+  estimated durations from it to the end of the run. Starting long chains
+  early keeps them from stretching the run once everything else is done."""
+
+  def __init__(self, durations=None, default_duration=1.0):
+    """
+    Arguments:
+      durations (DurationStore): where to estimate task durations from and
+        record them to; saved at the end of every run. Defaults to an
+        in-memory store.
+      default_duration (float): the estimate for tasks never run before; with
+        no history at all priorities come down to the longest chain's length.
+    """
+    self.durations = DurationStore() if durations is None else durations
+    self.default_duration = default_duration
+    self._tracker = None
+    self._priorities = {}
+
+  def _duration(self, task):
+    duration = self.durations.estimate(task)
+    return self.default_duration if duration is None else duration
+
+  def priority(self, tracker, task):
+    # Priorities are memoized for as long as the task graph doesn't change.
+    if tracker is not self._tracker:
+      self._tracker = tracker
+      self._priorities = {}
+    priorities = self._priorities
+    expanding = set()
+    stack = [task]
+    while stack:
+      current = stack[-1]
+      if current in priorities:
+        stack.pop()
+        continue
+      consumers = tracker.tasks_by_inputs(current.output_paths())
+      if current not in expanding:
+        expanding.add(current)
+        pending = [consumer for consumer in consumers
+                   if consumer not in priorities and consumer not in expanding]
+        if pending:
+          stack.extend(pending)
+          continue
+      # Consumers still being expanded close a cycle; they count for nothing.
+      priorities[current] = self._duration(current) + max(
+          [priorities.get(consumer, 0) for consumer in consumers] or [0])
+      expanding.discard(current)
+      stack.pop()
+    return priorities[task]
+
+  def on_task_finished(self, task, seconds, error):
+    if error is None:
+      self.durations.record(task, seconds)
+
+  def on_run_finished(self):
+    self.durations.save()
+    # Estimates have changed, so priorities have too.
+    self._tracker = None
+    self._priorities = {}
@@ -0,0 +1,89 @@
+"""Makespans of scheduling policies on synthetic task graphs.
+
+Runs each graph on a small thread pool with tasks that sleep for their
+duration, under FIFO order, under critical path order knowing nothing about
+durations (so by chain length alone), and under critical path order with the
+durations recorded by the previous run.
+
+Run with `python -m g_runner.runner.scheduling_benchmark`."""
+
+import random
+import time
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import scheduling
+from g_runner.runner import tracker as _tracker
+
+
+class _SleepTask(_run_test.TestTask):
+
+  def __init__(self, task_name, inputs, outputs, seconds):
+    super(_SleepTask, self).__init__(task_name, inputs, outputs)
+    self.seconds = seconds
+
+  def run(self):
+    time.sleep(self.seconds)
+
+
+def _chains_and_fan(rng):
+  """A few long chains of short tasks among many independent longer ones."""
+  tasks = []
+  for chain in range(3):
+    for link in range(25):
+      tasks.append(_SleepTask(
+          'chain%d.%d' % (chain, link),
+          [('root',)] if link == 0 else [('chain', chain, link - 1)],
+          [('chain', chain, link)], rng.uniform(0.01, 0.02)))
+  for i in range(40):
+    tasks.append(_SleepTask('fan%d' % i, [('root',)], [('fan', i)],
+                            rng.uniform(0.02, 0.06)))
+  return tasks
+
+
+def _random_layers(rng):
+  """Layers of tasks each depending on a couple of the previous layer's."""
+  tasks = []
+  previous_outputs = [('root',)]
+  for layer in range(8):
+    outputs = []
+    for i in range(rng.randint(4, 16)):
+      output = ('layer', layer, i)
+      inputs = rng.sample(previous_outputs, min(2, len(previous_outputs)))
+      tasks.append(_SleepTask('%d.%d' % (layer, i), inputs, [output],
+                              rng.expovariate(1 / 0.015)))
+      outputs.append(output)
+    previous_outputs = outputs
+  return tasks
+
+
+def _makespan(tasks, max_workers, scheduling_policy):
+  paths = [('root',)] + [path for task in tasks for path in task.outputs]
+  tracker = _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+  root_event = runner.Event(
+      path_selector=lambda unused_tracker: [('root',)],
+      flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+  start = time.time()
+  runner.run_tracker(tracker, [root_event], outdated=True,
+                     max_workers=max_workers,
+                     scheduling_policy=scheduling_policy)
+  return time.time() - start
+
+
+def main():
+  max_workers = 4
+  print('%-16s %10s %12s %12s %12s' % (
+      'graph', 'work (s)', 'fifo (s)', 'cp cold (s)', 'cp warm (s)'))
+  for (name, graph) in (('chains+fan', _chains_and_fan),
+                        ('random layers', _random_layers)):
+    tasks = graph(random.Random(0))
+    work = sum(task.seconds for task in tasks)
+    fifo = _makespan(tasks, max_workers, scheduling.FifoPolicy())
+    policy = scheduling.CriticalPathPolicy()
+    cold = _makespan(tasks, max_workers, policy)
+    warm = _makespan(tasks, max_workers, policy)
+    print('%-16s %10.3f %12.3f %12.3f %12.3f' % (name, work, fifo, cold, warm))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import scheduling
+from g_runner.runner import tracker as _tracker
+
+
+class OrderRecordingTask(_run_test.TestTask):
+
+  def __init__(self, task_name, inputs, outputs, order):
+    super(OrderRecordingTask, self).__init__(task_name, inputs, outputs)
+    self.order = order
+
+  def run(self):
+    self.order.append(self.name)
+
+
+def up_to_date_event(path):
+  return runner.Event(
+      path_selector=lambda unused_tracker: [path],
+      flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+
+
+def chain_and_singles(order):
+  """A chain of three tasks next to five independent ones, all from (0,)."""
+  tasks = [OrderRecordingTask('chain0', [(0,)], [('chain', 0)], order),
+           OrderRecordingTask('chain1', [('chain', 0)], [('chain', 1)], order),
+           OrderRecordingTask('chain2', [('chain', 1)], [('chain', 2)], order)]
+  tasks.extend(OrderRecordingTask('single%d' % i, [(0,)], [('single', i)],
+                                  order)
+               for i in range(5))
+  paths = [(0,)] + [path for task in tasks for path in task.output_paths()]
+  return _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks), tasks
+
+
+class CriticalPathPolicyTest(unittest.TestCase):
+
+  def test_priorities_follow_longest_chain(self):
+    (tracker, tasks) = chain_and_singles([])
+    policy = scheduling.CriticalPathPolicy()
+    self.assertEqual([3, 2, 1, 1, 1, 1, 1, 1],
+                     [policy.priority(tracker, task) for task in tasks])
+
+  def test_priorities_weighted_by_durations(self):
+    (tracker, tasks) = chain_and_singles([])
+    policy = scheduling.CriticalPathPolicy()
+    policy.on_task_finished(tasks[3], 10.0, None)
+    policy.on_task_finished(tasks[4], 20.0, Exception())
+    policy.on_run_finished()
+    self.assertEqual(10.0, policy.priority(tracker, tasks[3]))
+    self.assertEqual(3, policy.priority(tracker, tasks[0]))
+    self.assertEqual(1, policy.priority(tracker, tasks[4]))
+
+  def test_run_starts_chain_first(self):
+    order = []
+    (tracker, unused_tasks) = chain_and_singles(order)
+    runner.run_tracker(
+        tracker, [up_to_date_event((0,))], outdated=True, max_workers=1,
+        scheduling_policy=scheduling.CriticalPathPolicy())
+    self.assertEqual('chain0', order[0])
+    self.assertEqual(8, len(order))
+
+
+class DurationStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'durations.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_durations_persist_and_blend(self):
+    task = _run_test.TestTask('task', [(0,)], [(1,)])
+    store = scheduling.DurationStore(self.filename)
+    self.assertIsNone(store.estimate(task))
+    store.record(task, 2.0)
+    store.save()
+    store = scheduling.DurationStore(self.filename)
+    self.assertEqual(2.0, store.estimate(task))
+    store.record(task, 4.0)
+    self.assertEqual(3.0, store.estimate(task))
+
+  def test_corrupt_store_is_empty(self):
+    with open(self.filename, 'w') as store_file:
+      store_file.write('{')
+    store = scheduling.DurationStore(self.filename)
+    self.assertIsNone(store.estimate(_run_test.TestTask('task', [], [])))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
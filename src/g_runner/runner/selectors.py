@@ -0,0 +1,182 @@
+"""Selector objects for `Event.path_selector` and `Event.task_selector`.
+
+A selector is a callable taking a tracker and returning the paths (or tasks)
+of it that an event applies to. Any callable will do, but one that scans
+`tracker.paths()` costs time proportional to the whole tracker on every event.
+The selectors here say what they select instead, e.g. "the paths under this
+prefix" or "the tasks tagged X", and are resolved through the tracker's
+indices, in time proportional to what they select. They combine with `|` and
+`&`, and may wrap plain callables where there's no selector for the job:
+
+  selectors.Outputs(selectors.Tagged('lint')) | selectors.Prefix(('docs',))
+"""
+
+
+def select(selector, tracker):
+  """Get the set of paths or tasks a selector (or plain callable) selects."""
+  if isinstance(selector, Selector):
+    return selector.select(tracker)
+  return set(selector(tracker))
+
+
+class Selector(object):
+  """Base class of the selectors the runner knows about."""
+
+  def select(self, tracker):
+    """Get the set of selected paths or tasks of a tracker."""
+    raise NotImplementedError()
+
+  def __call__(self, tracker):
+    return self.select(tracker)
+
+  def __or__(self, other):
+    return Union(self, other)
+
+  def __and__(self, other):
+    return Intersection(self, other)
+
+
+class Literal(Selector):
+  """Selects given paths or tasks, whatever the tracker."""
+
+  def __init__(self, items):
+    self.items = tuple(items)
+
+  def select(self, unused_tracker):
+    return set(self.items)
+
+  def __call__(self, unused_tracker):
+    # in order, for whoever cares
+    return self.items
+
+  def __repr__(self):
+    return 'Literal(%r)' % (self.items,)
+
+
+class Prefix(Selector):
+  """Selects the paths starting with given components."""
+
+  def __init__(self, prefix):
+    self.prefix = tuple(prefix)
+
+  def select(self, tracker):
+    paths_with_prefix = getattr(tracker, 'paths_with_prefix', None)
+    if paths_with_prefix is not None:
+      return set(paths_with_prefix(self.prefix))
+    length = len(self.prefix)
+    return set(path for path in tracker.paths()
+               if tuple(path[:length]) == self.prefix)
+
+  def __repr__(self):
+    return 'Prefix(%r)' % (self.prefix,)
+
+
+class Tagged(Selector):
+  """Selects the tasks having all of some tags."""
+
+  def __init__(self, *tags):
+    self.tags = tags
+
+  def select(self, tracker):
+    return set(tracker.tasks_by_tags(self.tags))
+
+  def __repr__(self):
+    return 'Tagged%r' % (self.tags,)
+
+
+class Producers(Selector):
+  """Selects the tasks outputting any of the selected paths."""
+
+  def __init__(self, path_selector):
+    self.path_selector = path_selector
+
+  def select(self, tracker):
+    tasks = set()
+    for path in select(self.path_selector, tracker):
+      tasks.update(tracker.tasks_by_outputs([path]))
+    return tasks
+
+  def __repr__(self):
+    return 'Producers(%r)' % (self.path_selector,)
+
+
+class Consumers(Selector):
+  """Selects the tasks taking any of the selected paths as input."""
+
+  def __init__(self, path_selector):
+    self.path_selector = path_selector
+
+  def select(self, tracker):
+    tasks = set()
+    for path in select(self.path_selector, tracker):
+      tasks.update(tracker.tasks_by_inputs([path]))
+    return tasks
+
+  def __repr__(self):
+    return 'Consumers(%r)' % (self.path_selector,)
+
+
+class Outputs(Selector):
+  """Selects the tracked paths that any of the selected tasks output."""
+
+  def __init__(self, task_selector):
+    self.task_selector = task_selector
+
+  def select(self, tracker):
+    paths = tracker.paths()
+    return set(path for task in select(self.task_selector, tracker)
+               for path in task.output_paths() if path in paths)
+
+  def __repr__(self):
+    return 'Outputs(%r)' % (self.task_selector,)
+
+
+class Inputs(Selector):
+  """Selects the tracked paths that any of the selected tasks take as input."""
+
+  def __init__(self, task_selector):
+    self.task_selector = task_selector
+
+  def select(self, tracker):
+    paths = tracker.paths()
+    return set(path for task in select(self.task_selector, tracker)
+               for path in task.input_paths() if path in paths)
+
+  def __repr__(self):
+    return 'Inputs(%r)' % (self.task_selector,)
+
+
+class Union(Selector):
+  """Selects what any of some selectors select."""
+
+  def __init__(self, *selectors):
+    self.selectors = selectors
+
+  def select(self, tracker):
+    selected = set()
+    for selector in self.selectors:
+      selected.update(select(selector, tracker))
+    return selected
+
+  def __repr__(self):
+    return 'Union%r' % (self.selectors,)
+
+
+class Intersection(Selector):
+  """Selects what all of some selectors select."""
+
+  def __init__(self, *selectors):
+    self.selectors = selectors
+
+  def select(self, tracker):
+    if not self.selectors:
+      return set()
+    selected = select(self.selectors[0], tracker)
+    for selector in self.selectors[1:]:
+      if not selected:
+        break
+      selected.intersection_update(select(selector, tracker))
+    return selected
+
+  def __repr__(self):
+    return 'Intersection%r' % (self.selectors,)
@@ -0,0 +1,67 @@
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import selectors
+from g_runner.runner import tracker as _tracker
+
+
+class SelectorsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.compile = _run_test.TestTask(
+        'compile', [('src', 'a.c'), ('src', 'b.c')], [('obj', 'a.o')])
+    self.link = _run_test.TestTask('link', [('obj', 'a.o')], [('bin', 'a')])
+    self.tracker = _tracker.Tracker().replaced(
+        new_paths=[('src', 'a.c'), ('src', 'b.c'), ('obj', 'a.o'),
+                   ('bin', 'a')],
+        new_tagged_tasks={self.compile: ['build', 'c'],
+                          self.link: ['build']})
+
+  def test_prefix(self):
+    self.assertEqual(set([('src', 'a.c'), ('src', 'b.c')]),
+                     selectors.Prefix(('src',))(self.tracker))
+    self.assertEqual(set(), selectors.Prefix(('src', 'a'))(self.tracker))
+
+  def test_tagged(self):
+    self.assertEqual(set([self.compile, self.link]),
+                     selectors.Tagged('build')(self.tracker))
+    self.assertEqual(set([self.compile]),
+                     selectors.Tagged('build', 'c')(self.tracker))
+
+  def test_tasks_and_their_paths(self):
+    self.assertEqual(
+        set([self.compile]),
+        selectors.Producers(selectors.Literal([('obj', 'a.o')]))(self.tracker))
+    self.assertEqual(
+        set([self.compile]),
+        selectors.Consumers(selectors.Prefix(('src',)))(self.tracker))
+    self.assertEqual(
+        set([('obj', 'a.o'), ('bin', 'a')]),
+        selectors.Outputs(selectors.Tagged('build'))(self.tracker))
+    self.assertEqual(
+        set([('src', 'a.c'), ('src', 'b.c')]),
+        selectors.Inputs(selectors.Tagged('c'))(self.tracker))
+
+  def test_combinations(self):
+    self.assertEqual(
+        set([('bin', 'a'), ('src', 'b.c')]),
+        (selectors.Prefix(('bin',)) |
+         (lambda unused_tracker: [('src', 'b.c')]))(self.tracker))
+    self.assertEqual(
+        set([('obj', 'a.o')]),
+        (selectors.Outputs(selectors.Tagged('build')) &
+         selectors.Inputs(selectors.Tagged('build')))(self.tracker))
+
+  def test_runner_resolves_selectors(self):
+    runner.run_tracker(self.tracker, [
+        runner.Event(path_selector=selectors.Prefix(('src',)),
+                     flags=runner.EventFlags(
+                         paths_state=runner.PathState.up_to_date)),
+    ], outdated=True)
+    self.assertEqual(1, self.compile.ran_count)
+    self.assertEqual(1, self.link.ran_count)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,176 @@
+"""Path states kept on disk so that runs resume where the last one left off.
+
+Without a store every run starts with all paths outdated or all up to date. A
+`StateStore` records, when a run ends, which paths were up to date, which tasks
+produced them, and (optionally) a fingerprint of each path's contents. The next
+run of the tracker starts a path up to date only if it was recorded so, its
+producers are unchanged, its fingerprint still matches, and nothing it's made
+from is outdated; everything else is outdated, so a restart only redoes what's
+stale."""
+
+import collections
+import sqlite3
+
+from g_runner.runner import _event
+from g_runner.runner import identity
+
+_SCHEMA_VERSION = 1
+
+
+class Fingerprinter(object):
+  """Summarizes the contents of paths, e.g. by hashing the files they stand for.
+
+  Subclasses override `fingerprint`, and `fingerprint_paths` if they can do
+  many paths at once faster than one after the other."""
+
+  def fingerprint(self, path):
+    """Get a string summarizing a path's contents, or None if it can't tell."""
+    return None
+
+  def fingerprint_paths(self, paths):
+    """Get a dict from paths to their fingerprints (omitting Nones)."""
+    fingerprints = {}
+    for path in paths:
+      fingerprint = self.fingerprint(path)
+      if fingerprint is not None:
+        fingerprints[path] = fingerprint
+    return fingerprints
+
+  def save(self):
+    """Persist whatever the fingerprinter caches; called after recording."""
+    pass
+
+
+class _CallableFingerprinter(Fingerprinter):
+
+  def __init__(self, fingerprint):
+    self.fingerprint = fingerprint
+
+
+class StateStore(object):
+  """Path states of a tracker kept in an sqlite database.
+
+  Paths and tasks are keyed by `identity.stable_key`, so they should have
+  stable keys (e.g. `scripting` tasks and their paths do). A store holds the
+  states of one tracker's paths; recording replaces whatever was there."""
+
+  def __init__(self, filename, fingerprint=None):
+    """
+    Arguments:
+      filename (str): the database file; created if need be.
+      fingerprint (Fingerprinter): summarizes paths' contents (e.g. hashes the
+        files they stand for); paths whose fingerprint changed since they were
+        recorded are outdated. May also be a callable taking a path and
+        returning a string or None.
+    """
+    self._filename = filename
+    if fingerprint is None:
+      fingerprint = Fingerprinter()
+    elif not isinstance(fingerprint, Fingerprinter):
+      fingerprint = _CallableFingerprinter(fingerprint)
+    self._fingerprinter = fingerprint
+    with self._connect() as connection:
+      version = connection.execute('PRAGMA user_version').fetchone()[0]
+      if version != _SCHEMA_VERSION:
+        connection.execute('DROP TABLE IF EXISTS paths')
+        connection.execute(
+            'CREATE TABLE paths (key TEXT PRIMARY KEY, up_to_date INTEGER, '
+            'producers TEXT, fingerprint TEXT)')
+        connection.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+
+  def _connect(self):
+    # A connection per use keeps the store usable from any thread.
+    return _ClosingConnection(sqlite3.connect(self._filename))
+
+  def initial_path_states(self, tracker, default_state):
+    """Get the states a run of a tracker should start its paths in.
+
+    Arguments:
+      tracker (interfaces.Tracker): the tracker about to be run.
+      default_state (str): the state of paths the store has no record of.
+
+    Returns:
+      A dict from every path of the tracker to `PathState.up_to_date` or
+      `PathState.outdated`.
+    """
+    with self._connect() as connection:
+      records = dict(
+          (key, (up_to_date, producers, fingerprint))
+          for (key, up_to_date, producers, fingerprint) in connection.execute(
+              'SELECT key, up_to_date, producers, fingerprint FROM paths'))
+    states = {}
+    to_fingerprint = {}
+    for path in tracker.paths():
+      record = records.get(identity.stable_key(path))
+      if record is None:
+        states[path] = default_state
+        continue
+      (up_to_date, producers, fingerprint) = record
+      if up_to_date and producers == _producers_key(tracker, path):
+        states[path] = _event.PathState.up_to_date
+        if fingerprint is not None:
+          to_fingerprint[path] = fingerprint
+      else:
+        states[path] = _event.PathState.outdated
+    fingerprints = self._fingerprinter.fingerprint_paths(to_fingerprint)
+    for (path, fingerprint) in to_fingerprint.items():
+      if fingerprints.get(path) != fingerprint:
+        states[path] = _event.PathState.outdated
+    # Whatever is made from an outdated path is outdated too.
+    outdated_paths = collections.deque(
+        path for (path, state) in states.items()
+        if state == _event.PathState.outdated)
+    while outdated_paths:
+      path = outdated_paths.popleft()
+      for task in tracker.tasks_by_inputs([path]):
+        for output_path in task.output_paths():
+          if states.get(output_path) == _event.PathState.up_to_date:
+            states[output_path] = _event.PathState.outdated
+            outdated_paths.append(output_path)
+    return states
+
+  def record(self, tracker, path_states):
+    """Replace the store's contents with the final path states of a run.
+
+    Arguments:
+      tracker (interfaces.Tracker): the tracker as it was at the end of the run.
+      path_states (dict): paths to their states at the end of the run; paths
+        that aren't up to date are recorded as outdated.
+    """
+    fingerprints = self._fingerprinter.fingerprint_paths(
+        path for path in tracker.paths()
+        if path_states.get(path) == _event.PathState.up_to_date)
+    rows = []
+    for path in tracker.paths():
+      up_to_date = path_states.get(path) == _event.PathState.up_to_date
+      rows.append((identity.stable_key(path), int(up_to_date),
+                   _producers_key(tracker, path), fingerprints.get(path)))
+    with self._connect() as connection:
+      connection.execute('DELETE FROM paths')
+      connection.executemany(
+          'INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)', rows)
+    self._fingerprinter.save()
+
+
+def _producers_key(tracker, path):
+  return identity.stable_key(frozenset(
+      identity.stable_key(task) for task in tracker.tasks_by_outputs([path])))
+
+
+class _ClosingConnection(object):
+  """Commits (or rolls back) and closes an sqlite connection on exit."""
+
+  def __init__(self, connection):
+    self._connection = connection
+
+  def __enter__(self):
+    return self._connection
+
+  def __exit__(self, error_type, error, traceback):
+    try:
+      if error_type is None:
+        self._connection.commit()
+      else:
+        self._connection.rollback()
+    finally:
+      self._connection.close()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import identity
+from g_runner.runner import state_store
+from g_runner.runner import tracker as _tracker
+
+
+class NamedTask(_run_test.TestTask):
+
+  def stable_key(self):
+    return identity.stable_key((self.name, self.inputs, self.outputs))
+
+
+def line_tracker():
+  """A source path (0,) made into (1,) then (2,)."""
+  task01 = NamedTask('01', [(0,)], [(1,)])
+  task12 = NamedTask('12', [(1,)], [(2,)])
+  tracker = _tracker.Tracker().replaced(
+      new_paths=[(0,), (1,), (2,)], new_tasks=[task01, task12])
+  return tracker, task01, task12
+
+
+class StateStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'states.sqlite')
+    self.fingerprints = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def store(self):
+    return state_store.StateStore(self.filename, self.fingerprints.get)
+
+  def test_unrecorded_paths_get_default(self):
+    (tracker, unused_task01, unused_task12) = line_tracker()
+    states = self.store().initial_path_states(
+        tracker, runner.PathState.outdated)
+    self.assertEqual(set([runner.PathState.outdated]), set(states.values()))
+
+  def test_recorded_states_resume(self):
+    (tracker, unused_task01, unused_task12) = line_tracker()
+    self.fingerprints[(0,)] = 'a'
+    self.store().record(tracker, {
+        (0,): runner.PathState.up_to_date,
+        (1,): runner.PathState.up_to_date,
+        (2,): runner.PathState.outdated,
+    })
+    states = self.store().initial_path_states(
+        tracker, runner.PathState.outdated)
+    self.assertEqual({
+        (0,): runner.PathState.up_to_date,
+        (1,): runner.PathState.up_to_date,
+        (2,): runner.PathState.outdated,
+    }, states)
+
+  def test_changed_fingerprint_outdates_downstream(self):
+    (tracker, unused_task01, unused_task12) = line_tracker()
+    self.fingerprints[(0,)] = 'a'
+    up_to_date = dict((path, runner.PathState.up_to_date)
+                      for path in tracker.paths())
+    self.store().record(tracker, up_to_date)
+    self.fingerprints[(0,)] = 'b'
+    states = self.store().initial_path_states(
+        tracker, runner.PathState.up_to_date)
+    self.assertEqual(set([runner.PathState.outdated]), set(states.values()))
+
+  def test_changed_producer_outdates_downstream(self):
+    (tracker, task01, unused_task12) = line_tracker()
+    up_to_date = dict((path, runner.PathState.up_to_date)
+                      for path in tracker.paths())
+    self.store().record(tracker, up_to_date)
+    tracker = tracker.replaced(
+        old_tasks=[task01],
+        new_tasks=[NamedTask('01 changed', [(0,)], [(1,)])])
+    states = self.store().initial_path_states(
+        tracker, runner.PathState.up_to_date)
+    self.assertEqual(runner.PathState.up_to_date, states[(0,)])
+    self.assertEqual(runner.PathState.outdated, states[(1,)])
+    self.assertEqual(runner.PathState.outdated, states[(2,)])
+
+  def test_runs_resume(self):
+    (tracker, task01, task12) = line_tracker()
+    runner.run_tracker(
+        tracker, [up_to_date_event((0,))], outdated=True,
+        state_store=self.store())
+    self.assertEqual(1, task01.ran_count)
+    self.assertEqual(1, task12.ran_count)
+    runner.run_tracker(tracker, [], outdated=True, state_store=self.store())
+    self.assertEqual(1, task01.ran_count)
+    self.assertEqual(1, task12.ran_count)
+
+
+def up_to_date_event(path):
+  return runner.Event(
+      path_selector=lambda unused_tracker: [path],
+      flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,231 @@
+"""Running command line tasks without a waiting thread per process.
+
+A `ProcessReaper` starts processes and waits on all of them from one thread,
+polling a file descriptor per child that becomes readable when the child exits:
+a pidfd where the platform has them, else the read end of a pipe whose write
+end only the child holds. `SubprocessExecutor` runs `CommandTask`s on a reaper,
+so that hundreds of concurrent compiler or test processes cost one thread
+rather than hundreds blocked in `wait()`. Requires POSIX."""
+
+import abc
+import errno
+import os
+import select
+import subprocess
+import sys
+import threading
+
+from g_runner import interfaces
+from g_runner.runner import executor as _executor
+
+# How often to check on children whose exit can't be waited on through a file
+# descriptor (e.g. those that closed the inherited end of their pipe).
+_UNWATCHED_POLL_INTERVAL_MS = 50
+
+
+class CommandTask(interfaces.Task):
+  """A task whose work is running a single command line.
+
+  Executors that know about these may run the command themselves (see
+  `SubprocessExecutor`); others just call `run`."""
+
+  @abc.abstractmethod
+  def command(self):
+    """Get the command to run.
+
+    Returns:
+      A 2-tuple of the `subprocess.Popen` arguments (e.g. a list of strings)
+      and a dict of further keyword arguments for `subprocess.Popen`.
+    """
+    raise NotImplementedError()
+
+  def run(self):
+    (args, popen_kwargs) = self.command()
+    subprocess.check_call(args, **popen_kwargs)
+
+
+def _set_cloexec(fd):
+  import fcntl
+  fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) |
+              fcntl.FD_CLOEXEC)
+
+
+def _set_nonblocking(fd):
+  import fcntl
+  fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+def _pipe():
+  (read_fd, write_fd) = os.pipe()
+  # Python 3 pipes already are close-on-exec.
+  _set_cloexec(read_fd)
+  _set_cloexec(write_fd)
+  return read_fd, write_fd
+
+
+class ProcessReaper(object):
+  """Starts processes and waits for them to exit on a single thread.
+
+  The thread is started with the first process and ends at `shutdown`."""
+
+  # Whether or not to try pidfds before falling back to pipes; cleared the
+  # first time the kernel turns out not to support them.
+  _use_pidfds = hasattr(os, 'pidfd_open')
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._starts = []
+    self._thread = None
+    self._shut_down = False
+    (self._wakeup_read, self._wakeup_write) = _pipe()
+    _set_nonblocking(self._wakeup_read)
+    _set_nonblocking(self._wakeup_write)
+
+  def start(self, args, popen_kwargs, done):
+    """Start a process eventually.
+
+    Arguments:
+      args: the `subprocess.Popen` arguments.
+      popen_kwargs (dict): further keyword arguments for `subprocess.Popen`.
+      done (callable): called on the reaper's thread once the process has
+        exited, with None if its exit status was 0, else a
+        `subprocess.CalledProcessError`, or with the error raised starting it.
+    """
+    with self._lock:
+      if self._shut_down:
+        raise RuntimeError('the reaper is shut down')
+      self._starts.append((args, popen_kwargs, done))
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._reap)
+        self._thread.daemon = True
+        self._thread.start()
+    self._wake()
+
+  def shutdown(self):
+    """Wait for all started processes to exit and stop the reaper's thread."""
+    with self._lock:
+      self._shut_down = True
+      thread = self._thread
+    if thread is not None:
+      self._wake()
+      thread.join()
+    os.close(self._wakeup_read)
+    os.close(self._wakeup_write)
+
+  def _wake(self):
+    try:
+      os.write(self._wakeup_write, b'\0')
+    except OSError as e:
+      # A full pipe will wake the reaper all the same.
+      if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise
+
+  def _popen(self, args, popen_kwargs):
+    """Start a process.
+
+    Returns:
+      A 2-tuple of the `subprocess.Popen` and a file descriptor that becomes
+      readable once it exits, or None if there's none to wait on."""
+    if ProcessReaper._use_pidfds:
+      popen = subprocess.Popen(args, **popen_kwargs)
+      try:
+        return popen, os.pidfd_open(popen.pid)
+      except OSError:
+        ProcessReaper._use_pidfds = False
+        return popen, None
+    (read_fd, write_fd) = _pipe()
+    popen_kwargs = dict(popen_kwargs)
+    if sys.version_info[0] >= 3:
+      popen_kwargs['pass_fds'] = (
+          tuple(popen_kwargs.get('pass_fds', ())) + (write_fd,))
+    else:
+      # Python 2 children inherit every descriptor without close-on-exec (and
+      # Popen's close_fds would close this one too).
+      import fcntl
+      fcntl.fcntl(write_fd, fcntl.F_SETFD, 0)
+    try:
+      popen = subprocess.Popen(args, **popen_kwargs)
+    except Exception:
+      os.close(read_fd)
+      raise
+    finally:
+      os.close(write_fd)
+    return popen, read_fd
+
+  def _reap(self):
+    poller = select.poll()
+    poller.register(self._wakeup_read, select.POLLIN)
+    watched = {}
+    unwatched = []
+    while True:
+      with self._lock:
+        starts = self._starts
+        self._starts = []
+        if (self._shut_down and not starts and not watched and
+            not unwatched):
+          self._thread = None
+          return
+      for (args, popen_kwargs, done) in starts:
+        try:
+          (popen, exit_fd) = self._popen(args, popen_kwargs)
+        except Exception as e:
+          done(e)
+          continue
+        if exit_fd is None:
+          unwatched.append((popen, args, done))
+        else:
+          poller.register(exit_fd, select.POLLIN)
+          watched[exit_fd] = (popen, args, done)
+      try:
+        ready = poller.poll(
+            _UNWATCHED_POLL_INTERVAL_MS if unwatched else None)
+      except (select.error, OSError) as e:
+        if e.args[0] != errno.EINTR:
+          raise
+        continue
+      for (fd, unused_event) in ready:
+        if fd == self._wakeup_read:
+          try:
+            while os.read(fd, 4096):
+              pass
+          except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+              raise
+          continue
+        poller.unregister(fd)
+        os.close(fd)
+        unwatched.append(watched.pop(fd))
+      still_running = []
+      for (popen, args, done) in unwatched:
+        if popen.poll() is None:
+          still_running.append((popen, args, done))
+        elif popen.returncode == 0:
+          done(None)
+        else:
+          done(subprocess.CalledProcessError(popen.returncode, args))
+      unwatched = still_running
+
+
+class SubprocessExecutor(_executor.Executor):
+  """Runs `CommandTask`s' processes on a `ProcessReaper`.
+
+  Other tasks run on `executor` (a thread apiece by default), which the caller
+  keeps ownership of."""
+
+  def __init__(self, executor=None):
+    self._executor = (
+        _executor.ThreadExecutor() if executor is None else executor)
+    self._reaper = ProcessReaper()
+
+  def submit(self, task, done):
+    if not isinstance(task, CommandTask):
+      self._executor.submit(task, done)
+      return
+    try:
+      (args, popen_kwargs) = task.command()
+      self._reaper.start(args, popen_kwargs, done)
+    except Exception as e:
+      done(e)
+
+  def shutdown(self):
+    self._reaper.shutdown()
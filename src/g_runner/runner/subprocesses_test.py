@@ -0,0 +1,100 @@
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from g_runner.runner import executor_test
+from g_runner.runner import subprocesses
+from g_runner.runner import tracker_test
+
+
+class SleepTask(tracker_test.TestTask, subprocesses.CommandTask):
+
+  def __init__(self, task_name, seconds, exit_status=0):
+    super(SleepTask, self).__init__(task_name, [], [])
+    self.seconds = seconds
+    self.exit_status = exit_status
+
+  def command(self):
+    return ([sys.executable, '-c',
+             'import sys, time; time.sleep(%r); sys.exit(%d)' %
+             (self.seconds, self.exit_status)], {})
+
+
+class ProcessReaperTest(unittest.TestCase):
+
+  def setUp(self):
+    self.reaper = subprocesses.ProcessReaper()
+
+  def tearDown(self):
+    self.reaper.shutdown()
+
+  def assertWaitsWithOneThread(self):
+    count = 40
+    completions = executor_test.Completions(count)
+    threads_before = threading.active_count()
+    start = time.time()
+    for i in range(count):
+      self.reaper.start(['sleep', '0.5'], {}, completions.done)
+    time.sleep(0.2)
+    self.assertLessEqual(threading.active_count(), threads_before + 1)
+    completions.wait()
+    self.assertEqual([None] * count, completions.errors)
+    # Sequential waits would take count * 0.5s.
+    self.assertLess(time.time() - start, 5)
+
+  def test_concurrent_processes_share_a_thread(self):
+    self.assertWaitsWithOneThread()
+
+  def test_concurrent_processes_share_a_thread_without_pidfds(self):
+    use_pidfds = subprocesses.ProcessReaper._use_pidfds
+    subprocesses.ProcessReaper._use_pidfds = False
+    try:
+      self.assertWaitsWithOneThread()
+    finally:
+      subprocesses.ProcessReaper._use_pidfds = use_pidfds
+
+  def test_exit_status_reported(self):
+    completions = executor_test.Completions(1)
+    self.reaper.start(['sh', '-c', 'exit 3'], {}, completions.done)
+    completions.wait()
+    self.assertIsInstance(
+        completions.errors[0], subprocess.CalledProcessError)
+    self.assertEqual(3, completions.errors[0].returncode)
+
+  def test_start_failure_reported(self):
+    completions = executor_test.Completions(1)
+    self.reaper.start(['/nonexistent/command'], {}, completions.done)
+    completions.wait()
+    self.assertIsInstance(completions.errors[0], OSError)
+
+  def test_start_after_shutdown_fails(self):
+    reaper = subprocesses.ProcessReaper()
+    reaper.shutdown()
+    with self.assertRaises(RuntimeError):
+      reaper.start(['true'], {}, lambda error: None)
+
+
+class SubprocessExecutorTest(unittest.TestCase):
+
+  def test_runs_command_tasks_and_others(self):
+    counter = executor_test.ConcurrencyCounter()
+    completions = executor_test.Completions(3)
+    subprocess_executor = subprocesses.SubprocessExecutor()
+    subprocess_executor.submit(SleepTask('ok', 0.01), completions.done)
+    subprocess_executor.submit(
+        SleepTask('fails', 0.01, exit_status=1), completions.done)
+    subprocess_executor.submit(
+        executor_test.ConcurrencyTask('thread', counter), completions.done)
+    completions.wait()
+    subprocess_executor.shutdown()
+    self.assertEqual(1, len(counter.threads))
+    self.assertEqual(2, completions.errors.count(None))
+    self.assertEqual(
+        1, len([error for error in completions.errors
+                if isinstance(error, subprocess.CalledProcessError)]))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,118 @@
+"""Timelines of runs, in Chrome's trace event format.
+
+Pass a `TraceRecorder` as the `trace` of `run_tracker` (or
+`run_tracker_async`) and `write` it once the run is over; open the file in
+chrome://tracing or https://ui.perfetto.dev. It shows:
+
+  * a "runner" lane with the runner's handling of events and its rounds of
+    starting tasks, i.e. what holds up its loop;
+  * a lane per worker, i.e. per task that may run at the same time, with a
+    span per task from its dispatch until it's done, noting how long it had
+    been ready for before it was dispatched;
+  * counters of the events handled at a time, and of the ready and running
+    tasks.
+
+Runs without a recorder only check for one, so tracing costs nothing unless
+it's asked for."""
+
+import heapq
+import json
+import threading
+import time
+
+# A clock for intervals, where there's one.
+_clock = getattr(time, 'perf_counter', time.time)
+
+_PROCESS_ID = 1
+_RUNNER_LANE = 0
+
+
+def _default_task_name(task):
+  names = [repr(path) for path in task.output_paths()]
+  if not names:
+    return repr(task)
+  if len(names) > 3:
+    names[3:] = ['...']
+  return ', '.join(names)
+
+
+class TraceRecorder(object):
+  """Records the timeline of a run, to be written as trace events."""
+
+  def __init__(self, task_name=_default_task_name):
+    """
+    Arguments:
+      task_name (callable): gets the name to show for a task; defaults to its
+        output paths.
+    """
+    self._task_name = task_name
+    self._lock = threading.Lock()
+    self._start = _clock()
+    self._events = [
+        self._metadata('process_name', None, 'g_runner'),
+        self._metadata('thread_name', _RUNNER_LANE, 'runner'),
+    ]
+    self._lane_count = 0
+    self._free_lanes = []
+
+  def _metadata(self, name, lane, value):
+    event = {'name': name, 'ph': 'M', 'pid': _PROCESS_ID,
+             'args': {'name': value}}
+    if lane is not None:
+      event['tid'] = lane
+    return event
+
+  def now(self):
+    """Get the current time, as the recorder's other methods take times."""
+    return _clock()
+
+  def _microseconds(self, seconds):
+    return int((seconds - self._start) * 1e6)
+
+  def _span(self, name, category, lane, start, end, args):
+    event = {'name': name, 'cat': category, 'ph': 'X', 'pid': _PROCESS_ID,
+             'tid': lane, 'ts': self._microseconds(start),
+             'dur': max(0, int((end - start) * 1e6))}
+    if args:
+      event['args'] = args
+    with self._lock:
+      self._events.append(event)
+
+  def runner_span(self, name, start, args=None):
+    """Record something the runner did from some time until now."""
+    self._span(name, 'runner', _RUNNER_LANE, start, _clock(), args)
+
+  def acquire_lane(self):
+    """Get a worker lane for a task starting; the lowest that's free."""
+    with self._lock:
+      if self._free_lanes:
+        return heapq.heappop(self._free_lanes)
+      self._lane_count += 1
+      lane = self._lane_count
+      self._events.append(
+          self._metadata('thread_name', lane, 'worker %d' % lane))
+      return lane
+
+  def task_span(self, task, lane, start, args=None):
+    """Record a task from its start until now, and free its lane."""
+    self._span(self._task_name(task), 'task', lane, start, _clock(), args)
+    with self._lock:
+      heapq.heappush(self._free_lanes, lane)
+
+  def counter(self, name, values):
+    """Record the current values of a counter, a dict of series to numbers."""
+    event = {'name': name, 'ph': 'C', 'pid': _PROCESS_ID,
+             'ts': self._microseconds(_clock()), 'args': values}
+    with self._lock:
+      self._events.append(event)
+
+  def trace_events(self):
+    """Get a list of the recorded trace events."""
+    with self._lock:
+      return list(self._events)
+
+  def write(self, filename):
+    """Write the recorded events to a file in the JSON object format."""
+    with open(filename, 'w') as trace_file:
+      json.dump({'traceEvents': self.trace_events(),
+                 'displayTimeUnit': 'ms'}, trace_file)
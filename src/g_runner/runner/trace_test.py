@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from g_runner import runner
+from g_runner.runner import _run_test
+from g_runner.runner import trace
+from g_runner.runner import tracker as _tracker
+
+
+class TraceRecorderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_run_timeline(self):
+    root = _run_test.TestTask('root', [], [(0,)])
+    leaves = [_run_test.TestTask(str(i), [(0,)], [(i,)]) for i in range(1, 7)]
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[(i,) for i in range(7)], new_tasks=[root] + leaves)
+    recorder = trace.TraceRecorder(task_name=lambda task: task.name)
+    runner.run_tracker(tracker, [], outdated=True, max_workers=2,
+                       trace=recorder)
+    filename = os.path.join(self.directory, 'trace.json')
+    recorder.write(filename)
+    with open(filename) as trace_file:
+      events = json.load(trace_file)['traceEvents']
+
+    task_spans = [event for event in events
+                  if event['ph'] == 'X' and event['cat'] == 'task']
+    self.assertEqual(set(['root'] + [str(i) for i in range(1, 7)]),
+                     set(span['name'] for span in task_spans))
+    # two workers, whose lanes never hold two tasks at once
+    lanes = set(span['tid'] for span in task_spans)
+    self.assertLessEqual(len(lanes), 2)
+    for lane in lanes:
+      spans = sorted((span['ts'], span['ts'] + span['dur'])
+                     for span in task_spans if span['tid'] == lane)
+      for (earlier, later) in zip(spans, spans[1:]):
+        self.assertLessEqual(earlier[1], later[0])
+    lane_names = set(event['args']['name'] for event in events
+                     if event['name'] == 'thread_name')
+    self.assertIn('runner', lane_names)
+    self.assertIn('worker 1', lane_names)
+
+    runner_spans = set(event['name'] for event in events
+                       if event['ph'] == 'X' and event['cat'] == 'runner')
+    self.assertEqual(set(['handle events', 'run update']), runner_spans)
+    counters = set(event['name'] for event in events if event['ph'] == 'C')
+    self.assertEqual(set(['queue depth', 'running tasks']), counters)
+    self.assertTrue(any(event['args']['running tasks'] == 2 for event in events
+                        if event['name'] == 'running tasks'))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
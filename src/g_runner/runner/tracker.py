@@ -1,14 +1,17 @@
 import copy
 import itertools
 
+from g_runner import _compat
 from g_runner import interfaces
+from g_runner.runner import _persistent
+from g_runner.runner import _trie
 
 interfaces.Path.register(list)
 interfaces.Path.register(tuple)
 interfaces.Path.register(str)
 
 def is_tracker_valid(tracker):
-  return len(set(tracker.paths())) == len(tracker.paths()) and reduce(
+  return len(set(tracker.paths())) == len(tracker.paths()) and _compat.reduce(
           lambda a, b: a and b,
           [path in tracker.paths()
            for task in tracker.tasks()
@@ -17,8 +20,66 @@ def is_tracker_valid(tracker):
           True)
 
 
+_EMPTY_SET = _persistent.PersistentSet()
+
+
+def _collect(deltas, key, value):
+  deltas.setdefault(key, set()).add(value)
+
+
+def _collect_task_paths(inputs_deltas, outputs_deltas, task):
+  for path in task.input_paths():
+    _collect(inputs_deltas, path, task)
+  for path in task.output_paths():
+    _collect(outputs_deltas, path, task)
+
+
+def _inverted(deltas):
+  inverse = {}
+  for (key, values) in deltas.items():
+    for value in values:
+      _collect(inverse, value, key)
+  return inverse
+
+
+def _index(deltas):
+  return _persistent.PersistentMap(
+      (key, _persistent.PersistentSet(values))
+      for (key, values) in deltas.items())
+
+
+def _apply_deltas(index, removals, additions):
+  """Get `index` with removals then additions applied to its sets.
+
+  Only the sets at keys named by the deltas are replaced; keys left without
+  values are dropped."""
+  if not removals and not additions:
+    return index
+  transient = index.transient()
+  for key in set(removals).union(additions):
+    values = index.get(key, _EMPTY_SET).difference(
+        removals.get(key, ())).union(additions.get(key, ()))
+    if values:
+      transient[key] = values
+    else:
+      transient.discard(key)
+  return transient.persistent()
+
+
+def _lookup_all(index, keys):
+  """Get the intersection of the sets at `keys` in `index`."""
+  tasksets = sorted((index.get(key, _EMPTY_SET) for key in keys), key=len)
+  if len(tasksets) < 1:
+    return _EMPTY_SET
+  return tasksets[0].intersection(*tasksets[1:])
+
+
 class Tracker(interfaces.Tracker):
-  """A tracker implementation tailored for the internals of the runner."""
+  """A tracker implementation tailored for the internals of the runner.
+
+  Trackers are persistent: `replaced` shares all but the changed parts of its
+  paths, tasks and indices with the tracker it was called on, so snapshots are
+  cheap to make and safe to hand out."""
 
   def __init__(self, original_tracker=None, deepcopy_memo=None):
     if original_tracker is not None:
@@ -27,108 +88,142 @@ class Tracker(interfaces.Tracker):
       if not is_tracker_valid(original_tracker):
         raise ValueError('expected a valid tracker')
       if deepcopy_memo:
-        self._paths = set(copy.deepcopy(path, deepcopy_memo)
-                          for path in original_tracker.paths())
-        self._tasks = set(copy.deepcopy(task, deepcopy_memo)
-                          for task in original_tracker.tasks())
-        self._tasks_by_tags = dict(
+        paths = (copy.deepcopy(path, deepcopy_memo)
+                 for path in original_tracker.paths())
+        tasks = (copy.deepcopy(task, deepcopy_memo)
+                 for task in original_tracker.tasks())
+        tasks_by_tags = dict(
             (copy.deepcopy(tag, deepcopy_memo),
-             copy.deepcopy(tasks, deepcopy_memo))
+             copy.deepcopy(set(tasks), deepcopy_memo))
             for (tag, tasks) in original_tracker.tagged_tasks())
       else:
-        self._paths = set(copy.copy(path) for path in original_tracker.paths())
-        self._tasks = set(copy.copy(task) for task in original_tracker.tasks())
-        self._tasks_by_tags = dict(
-            (copy.copy(tag, deepcopy_memo),
-             copy.copy(tasks, deepcopy_memo))
+        paths = (copy.copy(path) for path in original_tracker.paths())
+        tasks = (copy.copy(task) for task in original_tracker.tasks())
+        tasks_by_tags = dict(
+            (copy.copy(tag), set(tasks))
             for (tag, tasks) in original_tracker.tagged_tasks())
-      self._tasks_by_inputs = dict(
-          (path, set(task for task in self._tasks
-                     if path in list(task.input_paths())))
-          for path in self._paths)
-      self._tasks_by_outputs = dict(
-          (path, set(task for task in self._tasks
-                     if path in list(task.output_paths())))
-          for path in self._paths)
+      self._paths = _persistent.PersistentSet(paths)
+      self._tasks = _persistent.PersistentSet(tasks)
+      tasks_by_inputs = {}
+      tasks_by_outputs = {}
+      for task in self._tasks:
+        _collect_task_paths(tasks_by_inputs, tasks_by_outputs, task)
+      self._tasks_by_inputs = _index(tasks_by_inputs)
+      self._tasks_by_outputs = _index(tasks_by_outputs)
+      self._tasks_by_tags = _index(tasks_by_tags)
+      self._tags_by_task = _index(_inverted(tasks_by_tags))
+      self._path_trie = None
     else:
-      self._paths = set()
-      self._tasks = set()
-      self._tasks_by_inputs = {}
-      self._tasks_by_outputs = {}
-      self._tasks_by_tags = {}
+      self._paths = _EMPTY_SET
+      self._tasks = _EMPTY_SET
+      self._tasks_by_inputs = _persistent.PersistentMap()
+      self._tasks_by_outputs = _persistent.PersistentMap()
+      self._tasks_by_tags = _persistent.PersistentMap()
+      self._tags_by_task = _persistent.PersistentMap()
+      self._path_trie = None
 
   def tasks(self):
     return self._tasks
 
   def tasks_by_tags(self, tags):
-    tasksets = list(set(self._tasks_by_tags[tag]) for tag in tags)
-    if len(tasksets) < 1:
-      return set()
-    elif len(tasksets) < 2:
-      return tasksets[0]
-    else:
-      taskset = tasksets[0].intersection(tasksets[1])
-      for i in range(2, len(tasksets)):
-        taskset = taskset.intersection(tasksets[i])
-      return taskset
+    return _lookup_all(self._tasks_by_tags, tags)
 
   def tagged_tasks(self):
     return self._tasks_by_tags.items()
 
   def tasks_by_outputs(self, output_paths):
-    tasksets = list(set(self._tasks_by_outputs[path]) for path in output_paths)
-    if len(tasksets) < 1:
-      return set()
-    elif len(tasksets) < 2:
-      return tasksets[0]
-    else:
-      taskset = tasksets[0].intersection(tasksets[1])
-      for i in range(2, len(tasksets)):
-        taskset = taskset.intersection(tasksets[i])
-      return taskset
+    return _lookup_all(self._tasks_by_outputs, output_paths)
 
   def tasks_by_inputs(self, input_paths):
-    tasksets = list(set(self._tasks_by_inputs[path]) for path in input_paths)
-    if len(tasksets) < 1:
-      return set()
-    elif len(tasksets) < 2:
-      return tasksets[0]
-    else:
-      taskset = tasksets[0].intersection(tasksets[1])
-      for i in range(2, len(tasksets)):
-        taskset = taskset.intersection(tasksets[i])
-      return taskset
+    return _lookup_all(self._tasks_by_inputs, input_paths)
 
   def paths(self):
     return self._paths
 
+  def task_tags(self, task):
+    """Get the tags of a task."""
+    return self._tags_by_task.get(task, _EMPTY_SET)
+
+  def _paths_by_prefix(self):
+    # Built on first use, as most trackers are never asked about prefixes;
+    # once built, it's updated along with the paths.
+    if self._path_trie is None:
+      self._path_trie = _trie.PathTrie(self._paths)
+    return self._path_trie
+
+  def paths_with_prefix(self, prefix):
+    """Iterate over the paths starting with some components.
+
+    Costs the prefix's length plus the number of paths found."""
+    return self._paths_by_prefix().paths(tuple(prefix))
+
+  def count_paths_with_prefix(self, prefix):
+    """Get the number of paths starting with some components."""
+    return self._paths_by_prefix().count(tuple(prefix))
+
+  def prefix_children(self, prefix):
+    """Get a dict from the components that follow a prefix in paths to the
+    number of paths starting with the prefix and then that component."""
+    return self._paths_by_prefix().children(tuple(prefix))
+
+  def summarize_paths_with_prefix(self, prefix, path_states):
+    """Count the paths starting with some components by state.
+
+    Arguments:
+      prefix (sequence): the components the paths start with.
+      path_states (dict): paths to their states, e.g. the runner's.
+
+    Returns:
+      A dict from the states of the paths (None for paths without one) to the
+      number of paths in them.
+    """
+    summary = {}
+    for path in self.paths_with_prefix(prefix):
+      state = path_states.get(path)
+      summary[state] = summary.get(state, 0) + 1
+    return summary
+
   def replaced(self, old_paths=set(), new_paths=set(),
                old_tasks=set(), new_tasks=set(), new_tagged_tasks=dict()):
-    # TODO(atash) enable some manner of copy-on-write behavior?
+    old_tasks = set(task for task in old_tasks if task in self._tasks)
+    new_tasks = set(new_tasks).union(new_tagged_tasks.keys())
     new_tracker = Tracker()
-    new_tracker._paths = (
-        self._paths.difference(set(old_paths)).union(set(new_paths)))
-    new_tracker._tasks = (
-        self._tasks.difference(set(old_tasks)).union(set(new_tasks).union(
-            set(new_tagged_tasks.keys()))))
-    new_tracker._tasks_by_tags = {}
-    for (tag, tasks) in self._tasks_by_tags:
-      taskset = set(task for task in tasks if task not in old_tasks)
-      if len(taskset) > 0:
-        new_tracker._tasks_by_tags[tag] = taskset
+    new_tracker._paths = self._paths.difference(old_paths).union(new_paths)
+    if self._path_trie is not None:
+      new_paths = set(new_paths)
+      removed_paths = [path for path in old_paths if path not in new_paths]
+      if len(removed_paths) + len(new_paths) < len(self._paths):
+        new_tracker._path_trie = self._path_trie.changed(
+            removed_paths, new_paths)
+    new_tracker._tasks = self._tasks.difference(old_tasks).union(new_tasks)
+    # Only the index entries of the replaced tasks are revisited; everything
+    # else is shared with this tracker.
+    removed_inputs, removed_outputs, removed_tags = {}, {}, {}
+    added_inputs, added_outputs, added_tags = {}, {}, {}
+    for task in old_tasks:
+      _collect_task_paths(removed_inputs, removed_outputs, task)
+      for tag in self._tags_by_task.get(task, ()):
+        _collect(removed_tags, tag, task)
+    for task in new_tasks:
+      if task in old_tasks or task not in self._tasks:
+        _collect_task_paths(added_inputs, added_outputs, task)
     for (task, tags) in new_tagged_tasks.items():
       for tag in tags:
-        new_tracker._tasks_by_tags.setdefault(tag, set()).add(task)
-    new_tracker._tasks_by_inputs = dict(
-        (path, set(task for task in new_tracker._tasks
-                   if path in list(task.input_paths())))
-        for path in new_tracker._paths)
-    new_tracker._tasks_by_outputs = dict(
-        (path, set(task for task in new_tracker._tasks
-                   if path in list(task.output_paths())))
-        for path in new_tracker._paths)
+        _collect(added_tags, tag, task)
+    new_tracker._tasks_by_inputs = _apply_deltas(
+        self._tasks_by_inputs, removed_inputs, added_inputs)
+    new_tracker._tasks_by_outputs = _apply_deltas(
+        self._tasks_by_outputs, removed_outputs, added_outputs)
+    new_tracker._tasks_by_tags = _apply_deltas(
+        self._tasks_by_tags, removed_tags, added_tags)
+    new_tracker._tags_by_task = _apply_deltas(
+        self._tags_by_task, _inverted(removed_tags), _inverted(added_tags))
     return new_tracker
 
+  def transaction(self):
+    """Get a `TrackerTransaction` to batch changes to this tracker."""
+    return TrackerTransaction(self)
+
   def __eq__(self, other):
     return self._paths == other._paths and self._tasks == other._tasks
 
@@ -142,3 +237,54 @@ class Tracker(interfaces.Tracker):
     return Tracker(self, deepcopy_memo=memo)
 
 
+class TrackerTransaction(object):
+  """A batch of changes to be applied to a tracker all at once.
+
+  Changes take effect in the order they were made (e.g. adding and then
+  removing a path leaves it out), but only `commit` makes a new tracker, and it
+  makes exactly one regardless of the number of changes."""
+
+  def __init__(self, tracker):
+    self._tracker = tracker
+    self._old_paths = set()
+    self._new_paths = set()
+    self._old_tasks = set()
+    self._new_tasks = set()
+    self._new_tagged_tasks = {}
+
+  def add_paths(self, paths):
+    self._new_paths.update(paths)
+
+  def remove_paths(self, paths):
+    for path in paths:
+      self._new_paths.discard(path)
+      self._old_paths.add(path)
+
+  def add_tasks(self, tasks):
+    self._new_tasks.update(tasks)
+
+  def remove_tasks(self, tasks):
+    for task in tasks:
+      self._new_tasks.discard(task)
+      self._new_tagged_tasks.pop(task, None)
+      self._old_tasks.add(task)
+
+  def retag_tasks(self, tasks, tags):
+    """Replace the tags of the given tasks, adding the tasks if need be."""
+    tags = tuple(tags)
+    for task in tasks:
+      self._old_tasks.add(task)
+      self._new_tagged_tasks[task] = tags
+
+  def commit(self):
+    """Get the tracker with all changes applied.
+
+    If no changes were made, this is the tracker the transaction started
+    from."""
+    if not (self._old_paths or self._new_paths or self._old_tasks or
+            self._new_tasks or self._new_tagged_tasks):
+      return self._tracker
+    return self._tracker.replaced(
+        old_paths=self._old_paths, new_paths=self._new_paths,
+        old_tasks=self._old_tasks, new_tasks=self._new_tasks,
+        new_tagged_tasks=self._new_tagged_tasks)
@@ -0,0 +1,35 @@
+"""Timing of single-item `Tracker.replaced` calls against tracker size.
+
+Run with `python -m g_runner.runner.tracker_benchmark`."""
+
+import timeit
+
+from g_runner.runner import tracker as _tracker
+from g_runner.runner import tracker_test
+
+
+def _line_tracker(path_count):
+  paths = [(i,) for i in range(path_count)]
+  tasks = [tracker_test.TestTask(str(i), [paths[i]], [paths[i + 1]])
+           for i in range(path_count - 1)]
+  return _tracker.Tracker().replaced(new_paths=paths, new_tasks=tasks)
+
+
+def _time_per_call(statement, repeat=5, number=20):
+  return min(timeit.repeat(statement, repeat=repeat, number=number)) / number
+
+
+def main():
+  print('%10s %16s %16s' % ('paths', 'add path (s)', 'add task (s)'))
+  for path_count in (1000, 5000, 10000, 50000):
+    tracker = _line_tracker(path_count)
+    new_path = ('new',)
+    new_task = tracker_test.TestTask('new', [(0,)], [new_path])
+    add_path = _time_per_call(lambda: tracker.replaced(new_paths=[new_path]))
+    add_task = _time_per_call(
+        lambda: tracker.replaced(new_paths=[new_path], new_tasks=[new_task]))
+    print('%10d %16.6f %16.6f' % (path_count, add_path, add_task))
+
+
+if __name__ == '__main__':
+  main()
@@ -77,5 +77,100 @@ class TrackerTest(unittest.TestCase):
     self.assertEqual(1, len(tracker.tasks_by_tags(['tag1', 'tag2'])))
     self.assertTrue(_tracker.is_tracker_valid(tracker))
 
+  def test_tracker_removals_update_indices(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    task23 = TestTask('23', [(2,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,), (3,)],
+      new_tagged_tasks={task12: ['tag1'], task23: ['tag1']}
+    )
+    replaced_tracker = tracker.replaced(old_tasks=[task12])
+    self.assertEqual(set([task23]), replaced_tracker.tasks())
+    self.assertEqual(0, len(replaced_tracker.tasks_by_inputs([(1,)])))
+    self.assertEqual(0, len(replaced_tracker.tasks_by_outputs([(2,)])))
+    self.assertEqual(set([task23]), replaced_tracker.tasks_by_inputs([(2,)]))
+    self.assertEqual(set([task23]), replaced_tracker.tasks_by_tags(['tag1']))
+    # the original tracker is left untouched
+    self.assertEqual(set([task12]), tracker.tasks_by_inputs([(1,)]))
+    self.assertEqual(2, len(tracker.tasks_by_tags(['tag1'])))
+
+  def test_tracker_retag(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,)],
+      new_tagged_tasks={task12: ['tag1', 'tag2']}
+    ).replaced(old_tasks=[task12], new_tagged_tasks={task12: ['tag3']})
+    self.assertEqual(set([task12]), tracker.tasks())
+    self.assertEqual(0, len(tracker.tasks_by_tags(['tag1'])))
+    self.assertEqual(set([task12]), tracker.tasks_by_tags(['tag3']))
+    self.assertEqual(set([task12]), tracker.tasks_by_inputs([(1,)]))
+
+  def test_tracker_path_changes_keep_task_indices(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,)],
+      new_tasks=[task12]
+    ).replaced(new_paths=[(3,)]).replaced(old_paths=[(3,)])
+    self.assertEqual(set([(1,), (2,)]), tracker.paths())
+    self.assertEqual(set([task12]), tracker.tasks_by_outputs([(2,)]))
+    self.assertTrue(_tracker.is_tracker_valid(tracker))
+
+  def test_tracker_copies(self):
+    tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,)],
+      new_tagged_tasks={TestTask('12', [(1,)], [(2,)]): ['tag1']}
+    )
+    for copied_tracker in (copy.copy(tracker), copy.deepcopy(tracker)):
+      self.assertEqual(tracker, copied_tracker)
+      self.assertEqual(hash(tracker), hash(copied_tracker))
+      self.assertEqual(1, len(copied_tracker.tasks_by_tags(['tag1'])))
+      self.assertEqual(1, len(copied_tracker.tasks_by_inputs([(1,)])))
+
+  def test_transaction(self):
+    task12 = TestTask('12', [(1,)], [(2,)])
+    task23 = TestTask('23', [(2,)], [(3,)])
+    tracker = _tracker.Tracker().replaced(
+      new_paths=[(1,), (2,)],
+      new_tagged_tasks={task12: ['tag1']}
+    )
+    transaction = tracker.transaction()
+    self.assertIs(tracker, transaction.commit())
+    transaction.add_paths([(3,), (4,)])
+    transaction.remove_paths([(4,), (1,)])
+    transaction.add_tasks([task23])
+    transaction.retag_tasks([task12], ['tag2'])
+    committed_tracker = transaction.commit()
+    self.assertEqual(set([(2,), (3,)]), committed_tracker.paths())
+    self.assertEqual(set([task12, task23]), committed_tracker.tasks())
+    self.assertEqual(0, len(committed_tracker.tasks_by_tags(['tag1'])))
+    self.assertEqual(set([task12]), committed_tracker.tasks_by_tags(['tag2']))
+    self.assertEqual(set([task23]), committed_tracker.tasks_by_inputs([(2,)]))
+    self.assertEqual(set([(1,), (2,)]), tracker.paths())
+
+  def test_paths_with_prefix(self):
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[('src', 'net', 'socket.c'), ('src', 'net', 'dns.c'),
+                   ('src', 'main.c'), ('docs', 'index')])
+    self.assertEqual(set([('src', 'net', 'socket.c'), ('src', 'net', 'dns.c')]),
+                     set(tracker.paths_with_prefix(['src', 'net'])))
+    self.assertEqual(3, tracker.count_paths_with_prefix(('src',)))
+    self.assertEqual({'net': 2, 'main.c': 1}, tracker.prefix_children(('src',)))
+    self.assertEqual(
+        {'up_to_date': 1, None: 2},
+        tracker.summarize_paths_with_prefix(
+            ('src',), {('src', 'main.c'): 'up_to_date'}))
+    # the trie now built follows the tracker's changes
+    changed_tracker = tracker.replaced(
+        old_paths=[('src', 'net', 'dns.c')],
+        new_paths=[('src', 'net', 'tcp.c')])
+    self.assertEqual(set([('src', 'net', 'socket.c'), ('src', 'net', 'tcp.c')]),
+                     set(changed_tracker.paths_with_prefix(('src', 'net'))))
+    self.assertEqual(0, changed_tracker.count_paths_with_prefix(('bin',)))
+    self.assertEqual(2, tracker.count_paths_with_prefix(('src', 'net')))
+    emptied_tracker = changed_tracker.replaced(
+        old_paths=changed_tracker.paths())
+    self.assertEqual([], list(emptied_tracker.paths_with_prefix(())))
+
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
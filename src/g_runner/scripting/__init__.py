@@ -2,9 +2,12 @@
 
 import copy
 import subprocess
+import sys
 
 from g_runner import interfaces
 from g_runner import runner
+from g_runner.runner import identity
+from g_runner.runner import subprocesses
 from g_runner.runner import tracker as _tracker
 
 
@@ -13,21 +16,26 @@ from g_runner.runner import tracker as _tracker
 Note that because Task objects are valid dictionary keys we can place tasks
 directly within lists/tuples following this component to make their associated
 paths."""
-TASK_PATH_TAG = object()
+TASK_PATH_TAG = identity.Sentinel(__name__, 'TASK_PATH_TAG')
 
 """First component of every path associated with a file."""
-FILE_PATH_TAG = object()
+FILE_PATH_TAG = identity.Sentinel(__name__, 'FILE_PATH_TAG')
 
 
 class ScriptedTask(interfaces.Task):
 
-  def __init__(self, callee, input_paths, output_paths, args=(), kwargs={}):
-    """By contract the 'callee' object must be without visible side effects."""
+  def __init__(self, callee, input_paths, output_paths, args=(), kwargs={},
+               resources=None):
+    """By contract the 'callee' object must be without visible side effects.
+
+    `resources` is what the task holds while running; see
+    `interfaces.Task.resources`."""
     self._callee = callee
     self._input_paths = tuple(input_paths)
     self._output_paths = tuple(output_paths)
     self._args = args
     self._kwargs = kwargs
+    self._resources = dict(resources or {})
 
   def __call__(self, *args, **kwargs):
     """Allow transparent access to the internal callable."""
@@ -42,6 +50,9 @@ class ScriptedTask(interfaces.Task):
   def output_paths(self):
     return self._output_paths
 
+  def resources(self):
+    return dict(self._resources)
+
   def __eq__(self, other):
     if not isinstance(other, ScriptedTask):
       return False
@@ -49,6 +60,7 @@ class ScriptedTask(interfaces.Task):
         self._callee is other._callee and
         self._args == other._args and
         self._kwargs == other._kwargs and
+        self._resources == other._resources and
         self._input_paths == other._input_paths and
         self._output_paths == other._output_paths)
 
@@ -56,27 +68,86 @@ class ScriptedTask(interfaces.Task):
     return hash((self._callee, self._input_paths, self._output_paths))
 
   def __copy__(self):
-    return ScriptedTask(self._callee, self._input_paths, self._output_paths,
-                        self._args, self._kwargs)
+    return _unpickle_scripted_task(
+        type(self), self._callee, self._input_paths, self._output_paths,
+        self._args, self._kwargs, self._resources)
 
   def __deepcopy__(self, memo):
-    return ScriptedTask(copy.deepcopy(self._callee, memo),
-                        copy.deepcopy(self._input_paths, memo),
-                        copy.deepcopy(self._output_paths, memo),
-                        copy.deepcopy(self._args, memo),
-                        copy.deepcopy(self._kwargs, memo))
+    return _unpickle_scripted_task(type(self),
+                                   copy.deepcopy(self._callee, memo),
+                                   copy.deepcopy(self._input_paths, memo),
+                                   copy.deepcopy(self._output_paths, memo),
+                                   copy.deepcopy(self._args, memo),
+                                   copy.deepcopy(self._kwargs, memo),
+                                   copy.deepcopy(self._resources, memo))
+
+  def stable_key(self):
+    """Identify the task by what it calls with what, and by its paths."""
+    return identity.stable_key((
+        type(self), self._callee, self._args, self._kwargs,
+        self._input_paths, self._output_paths))
+
+  def code_key(self):
+    """Identify what the task's callee does; None if there's no telling (e.g.
+    for callable objects), in which case the task isn't cached. Override this
+    to return a version, say, for such tasks."""
+    return identity.code_key(self._callee)
+
+  def __reduce__(self):
+    callee = self._callee
+    if _is_shadowed_by_task(callee):
+      callee = _ShadowedCallee(callee)
+    return (_unpickle_scripted_task,
+            (type(self), callee, self._input_paths, self._output_paths,
+             self._args, self._kwargs, self._resources))
+
+
+def _is_shadowed_by_task(callee):
+  """Whether a function's module-level name refers to a task running it.
+
+  That's the case for functions decorated through `TrackerBuilder.task`, which
+  pickle can't find by name."""
+  module = sys.modules.get(getattr(callee, '__module__', None))
+  shadow = getattr(module, getattr(callee, '__name__', ''), None)
+  return isinstance(shadow, ScriptedTask) and shadow._callee is callee
+
+
+def _shadowed_callee(module_name, name):
+  __import__(module_name)
+  return getattr(sys.modules[module_name], name)._callee
+
+
+class _ShadowedCallee(object):
+  """Pickles a function shadowed by a task as a reference through the task."""
+
+  def __init__(self, callee):
+    self._callee = callee
+
+  def __reduce__(self):
+    return (_shadowed_callee, (self._callee.__module__, self._callee.__name__))
+
+
+def _unpickle_scripted_task(cls, callee, input_paths, output_paths, args,
+                            kwargs, resources=None):
+  task = cls.__new__(cls)
+  ScriptedTask.__init__(task, callee, input_paths, output_paths, args, kwargs,
+                        resources)
+  return task
 
 def _run_command_line(command, **subprocess_kwargs):
   return subprocess.check_call(command, **subprocess_kwargs)
 
 
-class CommandLineTask(ScriptedTask):
+class CommandLineTask(ScriptedTask, subprocesses.CommandTask):
 
-  def __init__(self, command, input_paths=(), output_paths=(),
+  def __init__(self, command, input_paths=(), output_paths=(), resources=None,
                **subprocess_kwargs):
     super(CommandLineTask, self).__init__(
         _run_command_line, input_paths, output_paths, args=(command,),
-        kwargs=subprocess_kwargs)
+        kwargs=subprocess_kwargs, resources=resources)
+
+  def command(self):
+    return self._args[0], dict(self._kwargs)
 
 
 class TrackerBuilder(object):
@@ -90,7 +161,8 @@ class TrackerBuilder(object):
     self._task_paths_to_tasks = {}
 
   def _add_callable_task(self, callee, input_paths=(), output_paths=(),
-                        args=(), kwargs={}, custom_path=None):
+                        args=(), kwargs={}, custom_path=None, tags=(),
+                        resources=None):
     """Add a task to the tracker builder."""
     if custom_path is not None:
       assert isinstance(custom_path, interfaces.Path)
@@ -102,16 +174,17 @@ class TrackerBuilder(object):
       path = (TASK_PATH_TAG, base_task)
     task = ScriptedTask(callee, input_paths=input_paths,
                         output_paths=tuple(output_paths) + (path,), args=args,
-                        kwargs=kwargs)
+                        kwargs=kwargs, resources=resources)
     self._tasks_to_task_paths[task] = path
     self._task_paths_to_tasks[path] = task
     self._tracker = self._tracker.replaced(
-        new_paths=(path,), new_tasks=(task,)
+        new_paths=(path,), new_tagged_tasks={task: tags}
     )
     return task
 
   def _add_command_line_task(self, command, input_paths=(), output_paths=(),
-                             custom_path=None, **subprocess_kwargs):
+                             custom_path=None, tags=(), resources=None,
+                             **subprocess_kwargs):
     """Add a command line task to the tracker builder."""
     if custom_path is not None:
       assert isinstance(custom_path, interfaces.Path)
@@ -123,11 +196,11 @@ class TrackerBuilder(object):
       path = (TASK_PATH_TAG, base_task)
     task = CommandLineTask(command, input_paths=input_paths,
                            output_paths=tuple(output_paths) + (path,),
-                           **subprocess_kwargs)
+                           resources=resources, **subprocess_kwargs)
     self._tasks_to_task_paths[task] = path
     self._task_paths_to_tasks[path] = task
     self._tracker = self._tracker.replaced(
-        new_paths=(path,), new_tasks=(task,)
+        new_paths=(path,), new_tagged_tasks={task: tags}
     )
     return task
 
@@ -149,21 +222,24 @@ class TrackerBuilder(object):
     return task_decorator
 
   def task(self, input_paths=(), output_paths=(), args=(), kwargs={},
-           custom_path=None):
+           custom_path=None, tags=(), resources=None):
     def task_decorator(callee, input_paths, output_paths, custom_path):
       return self._add_callable_task(
           callee, input_paths=input_paths, output_paths=output_paths,
-          custom_path=custom_path, args=args, kwargs=kwargs)
+          custom_path=custom_path, args=args, kwargs=kwargs, tags=tags,
+          resources=resources)
     return self._task(task_decorator, input_paths, output_paths, custom_path)
 
   def command(self, input_paths=(), output_paths=(), custom_path=None,
-              **subprocess_kwargs):
+              tags=(), resources=None, **subprocess_kwargs):
     def task_decorator(command, input_paths, output_paths, custom_path):
       return self._add_command_line_task(
-          callee, input_paths=input_paths, output_paths=output_paths,
-          custom_path=custom_path, **subprocess_kwargs)
+          command, input_paths=input_paths, output_paths=output_paths,
+          custom_path=custom_path, tags=tags, resources=resources,
+          **subprocess_kwargs)
     return self._task(task_decorator, input_paths, output_paths, custom_path)
 
   def run(self, runner_event_iterator=[], **kwargs):
+    """Run the built tracker; see `runner.run_tracker` for the arguments."""
     return runner.run_tracker(self._tracker, runner_event_iterator, **kwargs)
 
@@ -0,0 +1,361 @@
+"""An action cache keeping tasks' output files in a local directory.
+
+A task's outputs are looked up by its action key: a hash of the task's stable
+key (see `identity.stable_key`), the key of its code (see `task_code_key`) and
+the fingerprints of its input files. Files
+are stored once per distinct content, as blobs named by their hash, and an
+action entry maps each output filename of the action to its blob. Everything is
+written to a temporary file and renamed into place, so that a crash never
+leaves a partial blob, entry or restored output behind.
+
+The blobs are kept within a size bound by evicting the least recently used
+ones; restoring a blob counts as using it. Actions whose blobs were evicted
+miss.
+
+Only tasks with file outputs (see `files.file_path`) are cached, and only their
+file outputs are restored; see `action_cache` for when caching is sound."""
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+
+from g_runner.runner import action_cache
+from g_runner.runner import identity
+from g_runner.scripting import files
+
+_CHUNK_SIZE = 1 << 16
+
+
+def task_code_key(task):
+  """Get a key that changes along with what a task does, or None.
+
+  Tasks with a `code_key()` method (e.g. `ScriptedTask`s) are asked for it;
+  others are keyed by the code of their class's `run`. Tasks without one
+  aren't cached, as their outputs could be restored after their code changed.
+  """
+  if hasattr(task, 'code_key'):
+    return task.code_key()
+  return identity.code_key(getattr(type(task), 'run', None))
+
+
+def output_filenames(task):
+  """Get the set of files a task produces, i.e. all a restore may write."""
+  return set(path[1] for path in task.output_paths()
+             if files.is_file_path(path))
+
+
+def action_key(task, fingerprinter):
+  """Get the key of a task's action, or None if it isn't cacheable.
+
+  Arguments:
+    task (interfaces.Task): the task.
+    fingerprinter (files.FileFingerprinter): fingerprints its input files.
+  """
+  if not any(files.is_file_path(path) for path in task.output_paths()):
+    return None
+  code = task_code_key(task)
+  if code is None:
+    return None
+  input_paths = list(task.input_paths())
+  fingerprints = fingerprinter.fingerprint_paths(input_paths)
+  return identity.stable_key((
+      identity.stable_key(task), code,
+      sorted((identity.stable_key(path), fingerprints.get(path))
+             for path in input_paths)))
+
+
+class ContentStore(object):
+  """Blobs named by their hash and action entries, kept under a directory.
+
+  Both `LocalActionCache` and the `remote_cache` server keep their contents
+  in one. Thread safe."""
+
+  def __init__(self, directory, max_bytes=1 << 30, hash_name='sha1'):
+    """
+    Arguments:
+      directory (str): where to keep the contents; created if need be.
+      max_bytes (int): how large the blobs may grow together before the least
+        recently used ones are evicted.
+      hash_name (str): the `hashlib` algorithm to name blobs by.
+    """
+    self.hash_name = hash_name
+    self._blobs_directory = os.path.join(directory, 'blobs')
+    self._actions_directory = os.path.join(directory, 'actions')
+    self._max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self.evictions = 0
+    for created in (self._blobs_directory, self._actions_directory):
+      if not os.path.isdir(created):
+        os.makedirs(created)
+    self._total_bytes = sum(size for (unused_mtime, size, unused_filename)
+                            in self._list_blobs())
+
+  def blob_filename(self, digest):
+    return os.path.join(self._blobs_directory, digest[:2], digest)
+
+  def has_blob(self, digest):
+    return os.path.exists(self.blob_filename(digest))
+
+  def touch_blob(self, digest):
+    """Mark a blob recently used."""
+    os.utime(self.blob_filename(digest), None)
+
+  def store(self, source_file, expected_digest=None):
+    """Copy the contents of a file object into a blob.
+
+    The copy is hashed as it's made, so that a file changing meanwhile can't
+    end up stored under another content's name.
+
+    Arguments:
+      source_file: a file object to read the contents from.
+      expected_digest (str): what the contents should hash to; contents that
+        don't aren't stored.
+
+    Returns:
+      The blob's digest, its size, and whether it was newly stored.
+
+    Raises:
+      ValueError: if the contents don't hash to the expected digest.
+    """
+    blob_hash = hashlib.new(self.hash_name)
+    size = 0
+    (fd, temporary_filename) = tempfile.mkstemp(dir=self._blobs_directory)
+    try:
+      with os.fdopen(fd, 'wb') as blob_file:
+        while True:
+          chunk = source_file.read(_CHUNK_SIZE)
+          if not chunk:
+            break
+          blob_hash.update(chunk)
+          blob_file.write(chunk)
+          size += len(chunk)
+      digest = blob_hash.hexdigest()
+      if expected_digest is not None and digest != expected_digest:
+        raise ValueError('expected contents hashing to %s, got %s' % (
+            expected_digest, digest))
+      blob_filename = self.blob_filename(digest)
+      if os.path.exists(blob_filename):
+        os.remove(temporary_filename)
+        os.utime(blob_filename, None)
+        return (digest, size, False)
+      if not os.path.isdir(os.path.dirname(blob_filename)):
+        try:
+          os.makedirs(os.path.dirname(blob_filename))
+        except OSError:
+          # made concurrently
+          pass
+      os.rename(temporary_filename, blob_filename)
+    except Exception:
+      _remove_if_exists(temporary_filename)
+      raise
+    with self._lock:
+      self._total_bytes += size
+      over = self._total_bytes > self._max_bytes
+    if over:
+      self._evict()
+    return (digest, size, True)
+
+  def store_file(self, filename):
+    """Copy a file into a blob; see `store`."""
+    with open(filename, 'rb') as source_file:
+      return self.store(source_file)
+
+  def read_action(self, key):
+    """Get an action's entry, a dict from output filenames to (digest, mode),
+    or None if there's none."""
+    try:
+      with open(os.path.join(self._actions_directory, key)) as action_file:
+        return dict((filename, tuple(output)) for (filename, output)
+                    in json.load(action_file).items())
+    except (IOError, OSError, ValueError):
+      return None
+
+  def write_action(self, key, outputs):
+    _write_atomically(os.path.join(self._actions_directory, key),
+                      json.dumps(outputs, sort_keys=True).encode('utf-8'))
+
+  def remove_action(self, key):
+    _remove_if_exists(os.path.join(self._actions_directory, key))
+
+  def _list_blobs(self):
+    """Get (mtime, size, filename) of every blob."""
+    blobs = []
+    for (directory, unused_subdirectories, filenames) in os.walk(
+        self._blobs_directory):
+      if directory == self._blobs_directory:
+        # temporary files being written
+        continue
+      for filename in filenames:
+        filename = os.path.join(directory, filename)
+        try:
+          stat_result = os.stat(filename)
+        except OSError:
+          continue
+        blobs.append((stat_result.st_mtime, stat_result.st_size, filename))
+    return blobs
+
+  def _evict(self):
+    """Remove the least recently used blobs until the blobs fit the bound."""
+    blobs = sorted(self._list_blobs())
+    total_bytes = sum(size for (unused_mtime, size, unused_filename) in blobs)
+    evictions = 0
+    for (unused_mtime, size, filename) in blobs:
+      if total_bytes <= self._max_bytes:
+        break
+      if _remove_if_exists(filename):
+        total_bytes -= size
+        evictions += 1
+    with self._lock:
+      self._total_bytes = total_bytes
+      self.evictions += evictions
+
+
+class LocalActionCache(action_cache.ActionCache):
+  """Restores tasks' output files from blobs kept under a directory."""
+
+  def __init__(self, directory, fingerprinter=None, max_bytes=1 << 30,
+               hash_name='sha1'):
+    """
+    Arguments:
+      directory (str): where to keep the cache; created if need be.
+      fingerprinter (files.FileFingerprinter): fingerprints the input files;
+        defaults to one of its own.
+      Other arguments are as for `ContentStore`.
+    """
+    self._store = ContentStore(directory, max_bytes, hash_name)
+    self._fingerprinter = (
+        files.FileFingerprinter() if fingerprinter is None else fingerprinter)
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'misses': 0, 'bytes_restored': 0,
+                   'bytes_stored': 0}
+
+  def stats(self):
+    """Get a dict of the counts of hits, misses, bytes restored and stored, and
+    evicted blobs since the cache was made."""
+    with self._lock:
+      stats = dict(self._stats)
+    stats['evictions'] = self._store.evictions
+    return stats
+
+  def _count(self, name, amount=1):
+    with self._lock:
+      self._stats[name] += amount
+
+  def restore(self, task):
+    key = action_key(task, self._fingerprinter)
+    if key is None:
+      return False
+    outputs = self._store.read_action(key)
+    if outputs is None or set(outputs) != output_filenames(task):
+      self._count('misses')
+      return False
+    if not all(self._store.has_blob(digest)
+               for (digest, unused_mode) in outputs.values()):
+      # Some blob was evicted; the entry is no use anymore.
+      self._store.remove_action(key)
+      self._count('misses')
+      return False
+    restored_bytes = 0
+    try:
+      for (filename, (digest, mode)) in outputs.items():
+        with open(self._store.blob_filename(digest), 'rb') as blob_file:
+          restored_bytes += copy_atomically(blob_file, filename, mode)
+        self._store.touch_blob(digest)
+    except (IOError, OSError):
+      # Evicted while restoring; the task will overwrite what was restored.
+      self._count('misses')
+      return False
+    with self._lock:
+      self._stats['hits'] += 1
+      self._stats['bytes_restored'] += restored_bytes
+    return True
+
+  def record(self, task):
+    key = action_key(task, self._fingerprinter)
+    if key is None:
+      return
+    outputs = {}
+    try:
+      for path in task.output_paths():
+        if not files.is_file_path(path):
+          continue
+        filename = path[1]
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+        (digest, size, stored) = self._store.store_file(filename)
+        outputs[filename] = (digest, mode)
+        if stored:
+          self._count('bytes_stored', size)
+      self._store.write_action(key, outputs)
+    except (IOError, OSError):
+      # An output that's missing (or a full disk) only costs us the entry.
+      pass
+
+
+def _remove_if_exists(filename):
+  try:
+    os.remove(filename)
+    return True
+  except OSError:
+    return False
+
+
+def _write_atomically(filename, contents):
+  (fd, temporary_filename) = tempfile.mkstemp(
+      dir=os.path.dirname(os.path.abspath(filename)))
+  try:
+    with os.fdopen(fd, 'wb') as written_file:
+      written_file.write(contents)
+    os.rename(temporary_filename, filename)
+  except Exception:
+    _remove_if_exists(temporary_filename)
+    raise
+
+
+def copy_atomically(source_file, destination, mode, expected_digest=None,
+                    hash_name='sha1'):
+  """Replace a file with the contents of a file object, atomically.
+
+  Arguments:
+    source_file: a file object to read the contents from.
+    destination (str): the filename to replace; its directory is made if need
+      be.
+    mode (int): the permission bits to give the file.
+    expected_digest (str): what the contents should hash to (with the
+      `hashlib` algorithm `hash_name`); contents that don't don't replace the
+      file.
+
+  Returns:
+    The number of bytes copied.
+
+  Raises:
+    ValueError: if the contents don't hash to the expected digest.
+  """
+  directory = os.path.dirname(os.path.abspath(destination))
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  (fd, temporary_filename) = tempfile.mkstemp(dir=directory)
+  try:
+    size = 0
+    contents_hash = hashlib.new(hash_name)
+    with os.fdopen(fd, 'wb') as destination_file:
+      while True:
+        chunk = source_file.read(_CHUNK_SIZE)
+        if not chunk:
+          break
+        if expected_digest is not None:
+          contents_hash.update(chunk)
+        destination_file.write(chunk)
+        size += len(chunk)
+    if (expected_digest is not None and
+        contents_hash.hexdigest() != expected_digest):
+      raise ValueError('expected contents hashing to %s, got %s' % (
+          expected_digest, contents_hash.hexdigest()))
+    os.chmod(temporary_filename, mode)
+    os.rename(temporary_filename, destination)
+    return size
+  except Exception:
+    _remove_if_exists(temporary_filename)
+    raise
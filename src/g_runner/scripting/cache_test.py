@@ -0,0 +1,134 @@
+import os
+import stat
+import threading
+import types
+import unittest
+
+from g_runner import runner
+from g_runner.runner import tracker as _tracker
+from g_runner.scripting import cache
+from g_runner.scripting import files_test
+
+class LocalActionCacheTest(files_test.FilesTestCase):
+
+  def age_blobs(self):
+    """Make the blobs stored so far look used a while ago."""
+    for (directory, unused_subdirectories, filenames) in os.walk(
+        self.filename(os.path.join('cache', 'blobs'))):
+      for filename in filenames:
+        modified = os.stat(os.path.join(directory, filename)).st_mtime - 60
+        os.utime(os.path.join(directory, filename), (modified, modified))
+
+  def test_hit_restores_outputs_without_running(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    self.run_task(action_cache, task)
+    self.assertEqual([self.filename('out')], files_test.runs)
+    os.remove(self.filename('out'))
+    self.run_task(action_cache, task)
+    self.assertEqual([self.filename('out')], files_test.runs)
+    self.assertEqual('ABC', self.read('out'))
+    self.assertEqual(
+        0o750, stat.S_IMODE(os.stat(self.filename('out')).st_mode))
+    stats = action_cache.stats()
+    self.assertEqual((1, 1, 3, 3), (
+        stats['hits'], stats['misses'], stats['bytes_restored'],
+        stats['bytes_stored']))
+
+  def test_changed_input_misses(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    self.run_task(action_cache, task)
+    self.write('in', 'abcd')
+    self.assertFalse(action_cache.restore(task))
+    self.run_task(action_cache, task)
+    self.assertEqual('ABCD', self.read('out'))
+    self.assertEqual(2, len(files_test.runs))
+
+  def test_identical_outputs_share_blobs(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('a', 'same')
+    self.write('b', 'same')
+    for (input_name, output_name) in (('a', 'a.out'), ('b', 'b.out')):
+      task = self.task(input_name, output_name)
+      task.run()
+      action_cache.record(task)
+    self.assertEqual(4, action_cache.stats()['bytes_stored'])
+
+  def test_least_recently_used_blobs_are_evicted(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'),
+                                          max_bytes=150)
+    tasks = []
+    for (i, contents) in enumerate(('a' * 100, 'b' * 100)):
+      self.write('in%d' % i, contents)
+      tasks.append(self.task('in%d' % i, 'out%d' % i))
+      tasks[-1].run()
+      action_cache.record(tasks[-1])
+      self.age_blobs()
+    self.assertEqual(1, action_cache.stats()['evictions'])
+    self.assertTrue(action_cache.restore(tasks[1]))
+    self.assertFalse(action_cache.restore(tasks[0]))
+
+  def test_missing_outputs_are_not_recorded(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    action_cache.record(task)
+    self.assertFalse(action_cache.restore(task))
+    self.assertEqual(0, action_cache.stats()['bytes_stored'])
+
+  def test_edited_code_misses(self):
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('in', 'aBc')
+    self.run_task(action_cache, self.task('in', 'out'))
+    # copy_upper as it'd be after someone edited its body
+    edited = types.FunctionType(
+        files_test.copy_lower.__code__, vars(files_test), 'copy_upper')
+    edited.__qualname__ = 'copy_upper'
+    task = self.task('in', 'out')
+    task._callee = edited
+    self.run_task(action_cache, task)
+    self.assertEqual(2, len(files_test.runs))
+    self.assertEqual('abc', self.read('out'))
+
+  def test_callable_objects_arent_cached(self):
+    class CopyUpper(object):
+      def __call__(self, input_filename, output_filename):
+        files_test.copy_upper(input_filename, output_filename)
+    action_cache = cache.LocalActionCache(self.filename('cache'))
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    task._callee = CopyUpper()
+    self.run_task(action_cache, task)
+    self.run_task(action_cache, task)
+    self.assertEqual(2, len(files_test.runs))
+
+  def test_lookups_share_a_few_threads(self):
+    lookup_threads = set()
+    class ThreadRecordingCache(cache.LocalActionCache):
+      def restore(self, task):
+        lookup_threads.add(threading.current_thread())
+        return super(ThreadRecordingCache, self).restore(task)
+    action_cache = ThreadRecordingCache(self.filename('cache'))
+    self.write('in', 'abc')
+    tasks = [self.task('in', 'out%d' % i) for i in range(32)]
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[tasks[0].input_paths()[0]] + [
+            task.output_paths()[0] for task in tasks],
+        new_tasks=tasks)
+    source_event = runner.Event(
+        path_selector=lambda tracker: [tasks[0].input_paths()[0]],
+        flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+    for unused_run in range(2):
+      lookup_threads.clear()
+      runner.run_tracker(tracker, [source_event], outdated=True,
+                         action_cache=action_cache)
+      self.assertLessEqual(len(lookup_threads), 8)
+      self.assertFalse(
+          [thread for thread in lookup_threads if thread.is_alive()])
+    self.assertEqual(32, len(files_test.runs))
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
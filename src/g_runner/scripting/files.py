@@ -0,0 +1,272 @@
+"""Fingerprints of the files that `FILE_PATH_TAG` paths stand for.
+
+A file's fingerprint is a hash of its contents, but hashing is only done when
+the file's (inode, size, mtime) changed since it was last hashed; otherwise a
+single `stat` answers from the cache, which is kept in memory and (optionally)
+on disk across processes. Many files are stat'ed and hashed on a pool of
+threads, which the system calls and hashing don't hold the interpreter lock
+for, and directory trees are listed with `os.scandir` where there is one.
+
+Use a `FileFingerprinter` as the fingerprint of a `state_store.StateStore` to
+start only the changed files (and what's made from them) outdated."""
+
+import hashlib
+import multiprocessing
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from g_runner import scripting
+from g_runner._compat import pickle
+from g_runner._compat import queue
+from g_runner.runner import state_store
+
+_MISSING = 'missing'
+_NOT_A_FILE = 'not a file'
+_CHUNK_SIZE = 1 << 16
+
+# Files modified this recently may be modified again without their mtime
+# changing (on filesystems with coarse timestamps), so their stat data isn't
+# trusted to vouch for their hash.
+_RACY_SECONDS = 2
+
+
+def file_path(filename):
+  """Get the path standing for a file."""
+  return (scripting.FILE_PATH_TAG, filename)
+
+
+def is_file_path(path):
+  return (isinstance(path, tuple) and len(path) == 2 and
+          path[0] is scripting.FILE_PATH_TAG)
+
+
+if hasattr(os.stat_result, 'st_mtime_ns'):
+  def _stat_key(stat_result):
+    return (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+else:
+  def _stat_key(stat_result):
+    return (stat_result.st_ino, stat_result.st_size,
+            int(stat_result.st_mtime * 1e9))
+
+
+if hasattr(os, 'scandir'):
+  def _list_directory(directory):
+    """Get lists of the files (with their stats) and subdirectories in one."""
+    files = []
+    directories = []
+    is_regular = stat.S_ISREG
+    for entry in os.scandir(directory):
+      try:
+        if entry.is_dir(follow_symlinks=False):
+          directories.append(entry.path)
+          continue
+        stat_result = entry.stat()
+      except OSError:
+        # gone since listing it
+        continue
+      if is_regular(stat_result.st_mode):
+        files.append((entry.path, stat_result))
+    return files, directories
+else:
+  def _list_directory(directory):
+    files = []
+    directories = []
+    for name in os.listdir(directory):
+      filename = os.path.join(directory, name)
+      try:
+        stat_result = os.lstat(filename)
+        if stat.S_ISDIR(stat_result.st_mode):
+          directories.append(filename)
+          continue
+        if stat.S_ISLNK(stat_result.st_mode):
+          stat_result = os.stat(filename)
+        if stat.S_ISREG(stat_result.st_mode):
+          files.append((filename, stat_result))
+      except OSError:
+        pass
+    return files, directories
+
+
+class FileFingerprinter(state_store.Fingerprinter):
+  """Hashes files, skipping those whose stat data shows them unchanged.
+
+  Paths other than file paths (see `file_path`) have no fingerprint. Missing
+  files and non-files have fingerprints of their own, so that a file appearing
+  or disappearing changes its fingerprint too."""
+
+  def __init__(self, cache_filename=None, max_workers=None, hash_name='sha1'):
+    """
+    Arguments:
+      cache_filename (str): where to keep the hashes between processes (see
+        `save`); None keeps them in memory only.
+      max_workers (int): the number of threads to stat and hash files on;
+        defaults to the number of CPUs.
+      hash_name (str): the `hashlib` algorithm to hash contents with.
+    """
+    self._cache_filename = cache_filename
+    self._max_workers = (
+        multiprocessing.cpu_count() if max_workers is None else max_workers)
+    self._hash_name = hash_name
+    self._lock = threading.Lock()
+    # filename -> ((inode, size, mtime_ns), hash)
+    self._cache = {}
+    self._dirty = False
+    if cache_filename is not None and os.path.exists(cache_filename):
+      try:
+        with open(cache_filename, 'rb') as cache_file:
+          (cached_hash_name, cache) = pickle.load(cache_file)
+        if cached_hash_name == hash_name:
+          self._cache = cache
+      except Exception:
+        # A corrupt cache only costs us rehashing.
+        pass
+
+  def _hash_file(self, filename):
+    file_hash = hashlib.new(self._hash_name)
+    with open(filename, 'rb') as hashed_file:
+      while True:
+        chunk = hashed_file.read(_CHUNK_SIZE)
+        if not chunk:
+          return file_hash.hexdigest()
+        file_hash.update(chunk)
+
+  def _fingerprint_stat(self, filename, stat_result):
+    """Get the fingerprint of a regular file given its stat data."""
+    stat_key = _stat_key(stat_result)
+    cached = self._cache.get(filename)
+    if cached is not None and cached[0] == stat_key:
+      return cached[1]
+    return self._rehash(filename, stat_key)
+
+  def _rehash(self, filename, stat_key):
+    try:
+      fingerprint = self._hash_file(filename)
+    except (IOError, OSError):
+      return _MISSING
+    with self._lock:
+      if stat_key[2] < (time.time() - _RACY_SECONDS) * 1e9:
+        self._cache[filename] = (stat_key, fingerprint)
+      else:
+        self._cache.pop(filename, None)
+      self._dirty = True
+    return fingerprint
+
+  def fingerprint_file(self, filename):
+    """Get the fingerprint of a file by name."""
+    try:
+      stat_result = os.stat(filename)
+    except OSError:
+      return _MISSING
+    if not stat.S_ISREG(stat_result.st_mode):
+      return _NOT_A_FILE
+    return self._fingerprint_stat(filename, stat_result)
+
+  def fingerprint(self, path):
+    if not is_file_path(path):
+      return None
+    return self.fingerprint_file(path[1])
+
+  def _in_parallel(self, function, items):
+    """Call a function on every item on the worker threads."""
+    items = list(items)
+    if len(items) < 2 * self._max_workers:
+      for item in items:
+        function(item)
+      return
+    errors = []
+    def work(start):
+      try:
+        for item in items[start::self._max_workers]:
+          function(item)
+      except Exception as e:
+        errors.append(e)
+    workers = [threading.Thread(target=work, args=(start,))
+               for start in range(self._max_workers)]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    if errors:
+      raise errors[0]
+
+  def fingerprint_paths(self, paths):
+    fingerprints = {}
+    def fingerprint(path):
+      fingerprints[path] = self.fingerprint_file(path[1])
+    self._in_parallel(fingerprint, (path for path in paths
+                                    if is_file_path(path)))
+    return fingerprints
+
+  def fingerprint_tree(self, directory):
+    """Fingerprint every file under a directory.
+
+    Directories are listed, and files stat'ed and hashed, on the worker
+    threads.
+
+    Returns:
+      A dict from the file paths (see `file_path`) of the regular files under
+      the directory (not following symbolic links to directories) to their
+      fingerprints.
+    """
+    fingerprints = {}
+    directories = queue.Queue()
+    errors = []
+    file_path_tag = scripting.FILE_PATH_TAG
+    def work():
+      while True:
+        listed_directory = directories.get()
+        if listed_directory is None:
+          return
+        try:
+          (files, subdirectories) = _list_directory(listed_directory)
+          for subdirectory in subdirectories:
+            directories.put(subdirectory)
+          # The bulk of a check of an unchanged tree; kept lean.
+          cache_get = self._cache.get
+          for (filename, stat_result) in files:
+            stat_key = _stat_key(stat_result)
+            cached = cache_get(filename)
+            fingerprints[(file_path_tag, filename)] = (
+                cached[1] if cached is not None and cached[0] == stat_key
+                else self._rehash(filename, stat_key))
+        except Exception as e:
+          errors.append(e)
+        finally:
+          directories.task_done()
+    workers = [threading.Thread(target=work) for unused in
+               range(self._max_workers)]
+    for worker in workers:
+      worker.daemon = True
+      worker.start()
+    directories.put(directory)
+    directories.join()
+    for unused_worker in workers:
+      directories.put(None)
+    for worker in workers:
+      worker.join()
+    if errors:
+      raise errors[0]
+    return fingerprints
+
+  def save(self):
+    """Write the cache out atomically, if it changed and has a file."""
+    if self._cache_filename is None:
+      return
+    with self._lock:
+      if not self._dirty:
+        return
+      cache = dict(self._cache)
+      self._dirty = False
+    directory = os.path.dirname(os.path.abspath(self._cache_filename))
+    (fd, temporary_filename) = tempfile.mkstemp(dir=directory)
+    try:
+      with os.fdopen(fd, 'wb') as cache_file:
+        pickle.dump((self._hash_name, cache), cache_file,
+                    pickle.HIGHEST_PROTOCOL)
+      os.rename(temporary_filename, self._cache_filename)
+    except Exception:
+      os.remove(temporary_filename)
+      raise
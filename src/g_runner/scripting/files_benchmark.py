@@ -0,0 +1,64 @@
+"""Timings of fingerprinting a tree of files.
+
+Builds a tree of small files, fingerprints it cold (hashing every file), then
+with a fresh fingerprinter loading the cache from disk, as a new process would:
+once by walking the tree and once by the list of its file paths.
+
+Run with `python -m g_runner.scripting.files_benchmark [file count]`."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from g_runner.scripting import files
+
+
+def _make_tree(directory, file_count, files_per_directory=200):
+  modified = time.time() - 60
+  for i in range(file_count):
+    subdirectory = os.path.join(directory, str(i // files_per_directory))
+    if i % files_per_directory == 0:
+      os.mkdir(subdirectory)
+    filename = os.path.join(subdirectory, str(i))
+    with open(filename, 'w') as written_file:
+      written_file.write(str(i))
+    os.utime(filename, (modified, modified))
+
+
+def _seconds(function):
+  start = time.time()
+  result = function()
+  return time.time() - start, result
+
+
+def main():
+  file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+  directory = tempfile.mkdtemp()
+  try:
+    tree = os.path.join(directory, 'tree')
+    os.mkdir(tree)
+    _make_tree(tree, file_count)
+    cache_filename = os.path.join(directory, 'cache')
+    fingerprinter = files.FileFingerprinter(cache_filename)
+    (cold, fingerprints) = _seconds(
+        lambda: fingerprinter.fingerprint_tree(tree))
+    fingerprinter.save()
+    (load, fingerprinter) = _seconds(
+        lambda: files.FileFingerprinter(cache_filename))
+    (warm_tree, unused_fingerprints) = _seconds(
+        lambda: fingerprinter.fingerprint_tree(tree))
+    (warm_paths, unused_fingerprints) = _seconds(
+        lambda: fingerprinter.fingerprint_paths(fingerprints))
+    print('%d files' % len(fingerprints))
+    print('cold tree (hashing everything): %.3fs' % cold)
+    print('loading the cache:              %.3fs' % load)
+    print('unchanged tree:                 %.3fs' % warm_tree)
+    print('unchanged paths:                %.3fs' % warm_paths)
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from g_runner import runner
+from g_runner import scripting
+from g_runner.runner import state_store
+from g_runner.runner import tracker as _tracker
+from g_runner.scripting import files
+
+# the output files the copying functions below made, in order
+runs = []
+
+
+def copy(input_filename, output_filename):
+  runs.append(output_filename)
+  with open(input_filename) as input_file:
+    contents = input_file.read()
+  with open(output_filename, 'w') as output_file:
+    output_file.write(contents)
+
+
+def copy_upper(input_filename, output_filename):
+  runs.append(output_filename)
+  with open(input_filename) as input_file:
+    contents = input_file.read()
+  with open(output_filename, 'w') as output_file:
+    output_file.write(contents.upper())
+  os.chmod(output_filename, 0o750)
+
+
+def copy_lower(input_filename, output_filename):
+  runs.append(output_filename)
+  with open(input_filename) as input_file:
+    contents = input_file.read()
+  with open(output_filename, 'w') as output_file:
+    output_file.write(contents.lower())
+
+
+class FilesTestCase(unittest.TestCase):
+  """A base for tests of tasks on the files of a temporary directory."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    del runs[:]
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def filename(self, name):
+    return os.path.join(self.directory, name)
+
+  def write(self, name, contents):
+    with open(self.filename(name), 'w') as written_file:
+      written_file.write(contents)
+
+  def read(self, name):
+    with open(self.filename(name)) as read_file:
+      return read_file.read()
+
+  def task(self, input_name, output_name):
+    """Get a task of `copy_upper` from one file to another."""
+    return scripting.ScriptedTask(
+        copy_upper, [files.file_path(self.filename(input_name))],
+        [files.file_path(self.filename(output_name))],
+        args=(self.filename(input_name), self.filename(output_name)))
+
+  def run_task(self, action_cache, task, tags=()):
+    """Run a task with an action cache, after its input was updated."""
+    input_path = task.input_paths()[0]
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[input_path] + list(task.output_paths()),
+        new_tagged_tasks={task: tags})
+    source_event = runner.Event(
+        path_selector=lambda unused_tracker: [input_path],
+        flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+    runner.run_tracker(tracker, [source_event], outdated=True,
+                       action_cache=action_cache)
+
+
+class CountingFingerprinter(files.FileFingerprinter):
+
+  def __init__(self, *args, **kwargs):
+    super(CountingFingerprinter, self).__init__(*args, **kwargs)
+    self.hashed = []
+
+  def _hash_file(self, filename):
+    self.hashed.append(filename)
+    return super(CountingFingerprinter, self)._hash_file(filename)
+
+
+class FileFingerprinterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self, name, contents, age=60):
+    """Write a file last modified `age` seconds ago."""
+    filename = os.path.join(self.directory, name)
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as written_file:
+      written_file.write(contents)
+    modified = time.time() - age
+    os.utime(filename, (modified, modified))
+    return filename
+
+  def test_unchanged_files_are_not_rehashed(self):
+    filename = self.write('a', 'a')
+    fingerprinter = CountingFingerprinter()
+    fingerprint = fingerprinter.fingerprint(files.file_path(filename))
+    self.assertEqual(fingerprint,
+                     fingerprinter.fingerprint(files.file_path(filename)))
+    self.assertEqual([filename], fingerprinter.hashed)
+    self.write('a', 'b', age=30)
+    self.assertNotEqual(fingerprint,
+                        fingerprinter.fingerprint(files.file_path(filename)))
+    self.assertEqual([filename] * 2, fingerprinter.hashed)
+
+  def test_recently_modified_files_are_rehashed(self):
+    filename = self.write('a', 'a', age=0)
+    fingerprinter = CountingFingerprinter()
+    fingerprinter.fingerprint_file(filename)
+    fingerprinter.fingerprint_file(filename)
+    self.assertEqual([filename] * 2, fingerprinter.hashed)
+
+  def test_other_paths(self):
+    fingerprinter = files.FileFingerprinter()
+    self.assertIsNone(fingerprinter.fingerprint(('not', 'a file')))
+    missing = fingerprinter.fingerprint_file(
+        os.path.join(self.directory, 'missing'))
+    self.assertNotEqual(missing, fingerprinter.fingerprint_file(
+        self.write('empty', '')))
+    self.assertNotEqual(missing, fingerprinter.fingerprint_file(
+        self.directory))
+
+  def test_tree_and_paths_agree(self):
+    filenames = [self.write(os.path.join(str(i % 7), str(i)), str(i))
+                 for i in range(100)]
+    fingerprinter = files.FileFingerprinter(max_workers=4)
+    fingerprints = fingerprinter.fingerprint_tree(self.directory)
+    self.assertEqual(
+        set(files.file_path(filename) for filename in filenames),
+        set(fingerprints))
+    self.assertEqual(fingerprints, files.FileFingerprinter(
+        max_workers=4).fingerprint_paths(fingerprints))
+
+  def test_cache_persists(self):
+    filename = self.write('a', 'a')
+    cache_filename = os.path.join(self.directory, 'cache')
+    fingerprinter = files.FileFingerprinter(cache_filename)
+    fingerprint = fingerprinter.fingerprint_file(filename)
+    fingerprinter.save()
+    fingerprinter = CountingFingerprinter(cache_filename)
+    self.assertEqual(fingerprint, fingerprinter.fingerprint_file(filename))
+    self.assertEqual([], fingerprinter.hashed)
+
+  def test_changed_files_start_outdated(self):
+    source = files.file_path(self.write('source', 'a'))
+    unchanged = files.file_path(self.write('unchanged', 'a'))
+    tracker = _tracker.Tracker().replaced(new_paths=[source, unchanged])
+    store = state_store.StateStore(
+        os.path.join(self.directory, 'states'), files.FileFingerprinter())
+    store.record(tracker, {source: runner.PathState.up_to_date,
+                           unchanged: runner.PathState.up_to_date})
+    self.write('source', 'b', age=30)
+    self.assertEqual({
+        source: runner.PathState.outdated,
+        unchanged: runner.PathState.up_to_date,
+    }, store.initial_path_states(tracker, runner.PathState.outdated))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
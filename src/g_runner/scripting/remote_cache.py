@@ -0,0 +1,429 @@
+"""An action cache shared between hosts over HTTP, and a server for it.
+
+The protocol keeps blobs and action entries (see `cache`) apart:
+
+  GET /cas/<digest>       a blob's contents (404 if it has none).
+  PUT /cas/<digest>       store a blob; rejected (400) unless the contents hash
+                          to the digest.
+  POST /cas               a JSON list of digests; answers the JSON list of
+                          those it has no blob for.
+  GET /ac/<key>           an action's entry, a JSON object from output
+                          filenames to [digest, mode] (404 if it has none).
+  PUT /ac/<key>           store an action's entry.
+
+`RemoteActionCache` restores outputs as `cache.LocalActionCache` does, but
+records them in the background: a task's outputs are copied to a local spool
+as it finishes, and a few threads ask the server which of them it's missing
+(all at once), upload those from the spool and then the action's entry, while
+the run goes on. `CacheServer` keeps its
+contents in a `cache.ContentStore`; run one standalone with
+
+  python -m g_runner.scripting.remote_cache DIRECTORY [PORT]
+"""
+
+import hashlib
+import io
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+
+from g_runner._compat import http_client
+from g_runner._compat import http_server
+from g_runner._compat import queue
+from g_runner._compat import socketserver
+from g_runner._compat import urllib_parse
+from g_runner.runner import action_cache
+from g_runner.scripting import cache
+from g_runner.scripting import files
+
+
+class RemoteCacheError(Exception):
+  """A request to the cache server failed."""
+
+
+class RemoteActionCache(action_cache.ActionCache):
+  """Restores tasks' output files from, and records them to, a cache server."""
+
+  def __init__(self, url, fingerprinter=None, max_uploads=4, timeout=30,
+               hash_name='sha1', max_queued=64):
+    """
+    Arguments:
+      url (str): where the server is, e.g. 'http://cache.example:8080'.
+      fingerprinter (files.FileFingerprinter): fingerprints the input files;
+        defaults to one of its own.
+      max_uploads (int): how many actions may be uploading at once.
+      timeout (float): seconds to wait on the server before giving up on a
+        request (and treating it as a miss, or not recording).
+      hash_name (str): the `hashlib` algorithm the server names blobs by.
+      max_queued (int): how many recorded actions may wait to be uploaded;
+        actions recorded while that many wait aren't (see the 'dropped'
+        stat).
+    """
+    parsed_url = urllib_parse.urlparse(url)
+    self._host = parsed_url.hostname
+    self._port = parsed_url.port
+    self._prefix = parsed_url.path.rstrip('/')
+    self._fingerprinter = (
+        files.FileFingerprinter() if fingerprinter is None else fingerprinter)
+    self._max_uploads = max_uploads
+    self._timeout = timeout
+    self._hash_name = hash_name
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'misses': 0, 'bytes_restored': 0,
+                   'bytes_uploaded': 0, 'errors': 0, 'dropped': 0}
+    self._uploads = queue.Queue(max_queued)
+    self._uploaders = []
+    # digests being uploaded, so that outputs in common upload once
+    self._uploading = set()
+    # where outputs wait to be uploaded; made as needed
+    self._spool_directory = None
+
+  def stats(self):
+    """Get a dict of the counts of hits, misses, bytes restored and uploaded,
+    failed requests and actions dropped for the uploads falling behind since
+    the cache was made."""
+    with self._lock:
+      return dict(self._stats)
+
+  def _count(self, name, amount=1):
+    with self._lock:
+      self._stats[name] += amount
+
+  def _request(self, method, path, body=None, headers={}):
+    """Make a request of the server.
+
+    Returns:
+      The response, with its body unread, or None if the server has nothing
+      there (404).
+
+    Raises:
+      RemoteCacheError: if the request failed.
+    """
+    connection = http_client.HTTPConnection(
+        self._host, self._port, timeout=self._timeout)
+    try:
+      connection.request(method, self._prefix + path, body, headers)
+      response = connection.getresponse()
+    except (http_client.HTTPException, IOError, OSError) as e:
+      connection.close()
+      raise RemoteCacheError('%s %s failed: %s' % (method, path, e))
+    if response.status == 404:
+      response.read()
+      connection.close()
+      return None
+    if response.status // 100 != 2:
+      message = response.read()
+      connection.close()
+      raise RemoteCacheError('%s %s failed: %d %r' % (
+          method, path, response.status, message))
+    # The connection closes once the body's read.
+    return response
+
+  def missing_blobs(self, digests):
+    """Get the set of digests the server has no blob for, in one request."""
+    digests = sorted(set(digests))
+    if not digests:
+      return set()
+    response = self._request(
+        'POST', '/cas', json.dumps(digests).encode('utf-8'))
+    return set(json.loads(response.read().decode('utf-8')))
+
+  def restore(self, task):
+    key = cache.action_key(task, self._fingerprinter)
+    if key is None:
+      return False
+    restored_bytes = 0
+    try:
+      response = self._request('GET', '/ac/%s' % key)
+      outputs = response and json.loads(response.read().decode('utf-8'))
+      # Only the task's own outputs are written, whatever the entry lists.
+      if (not isinstance(outputs, dict) or
+          set(outputs) != cache.output_filenames(task)):
+        self._count('misses')
+        return False
+      for (filename, (digest, mode)) in outputs.items():
+        response = self._request('GET', '/cas/%s' % digest)
+        if response is None:
+          # The server evicted it; the task will overwrite what was restored.
+          self._count('misses')
+          return False
+        restored_bytes += cache.copy_atomically(
+            response, filename, mode, expected_digest=digest,
+            hash_name=self._hash_name)
+    except (RemoteCacheError, IOError, OSError, ValueError):
+      with self._lock:
+        self._stats['errors'] += 1
+        self._stats['misses'] += 1
+      return False
+    with self._lock:
+      self._stats['hits'] += 1
+      self._stats['bytes_restored'] += restored_bytes
+    return True
+
+  def record(self, task):
+    key = cache.action_key(task, self._fingerprinter)
+    if key is None:
+      return
+    # The outputs are copied now, before later tasks get to change them; the
+    # server's only asked about them on the uploading threads.
+    pending_action = _PendingAction(key)
+    try:
+      for filename in cache.output_filenames(task):
+        self._spool(pending_action, filename)
+    except (IOError, OSError):
+      # A missing output only costs us the entry.
+      pending_action.discard()
+      self._count('errors')
+      return
+    with self._lock:
+      if len(self._uploaders) < self._max_uploads:
+        uploader = threading.Thread(target=self._upload)
+        uploader.daemon = True
+        uploader.start()
+        self._uploaders.append(uploader)
+    try:
+      self._uploads.put_nowait(pending_action)
+    except queue.Full:
+      pending_action.discard()
+      self._count('dropped')
+
+  def _spool(self, pending_action, filename):
+    """Copy an output to the spool, noting it in its pending action."""
+    with self._lock:
+      if self._spool_directory is None:
+        self._spool_directory = tempfile.mkdtemp(prefix='g_runner_uploads_')
+      (descriptor, spooled) = tempfile.mkstemp(dir=self._spool_directory)
+    pending_action.spooled.append(spooled)
+    with os.fdopen(descriptor, 'wb') as spool_file:
+      with open(filename, 'rb') as output_file:
+        mode = stat.S_IMODE(os.fstat(output_file.fileno()).st_mode)
+        hasher = hashlib.new(self._hash_name)
+        size = 0
+        while True:
+          chunk = output_file.read(cache._CHUNK_SIZE)
+          if not chunk:
+            break
+          hasher.update(chunk)
+          spool_file.write(chunk)
+          size += len(chunk)
+    digest = hasher.hexdigest()
+    pending_action.outputs[filename] = (digest, mode)
+    pending_action.blobs[digest] = (spooled, size)
+
+  def _upload(self):
+    while True:
+      pending_action = self._uploads.get()
+      try:
+        self._upload_action(pending_action)
+      except (RemoteCacheError, IOError, OSError, ValueError):
+        self._count('errors')
+      finally:
+        pending_action.discard()
+        self._uploads.task_done()
+
+  def _upload_action(self, pending_action):
+    missing = self.missing_blobs(pending_action.blobs)
+    missing.intersection_update(pending_action.blobs)
+    with self._lock:
+      missing.difference_update(self._uploading)
+      self._uploading.update(missing)
+    try:
+      for digest in missing:
+        (spooled, size) = pending_action.blobs[digest]
+        with open(spooled, 'rb') as spool_file:
+          self._request('PUT', '/cas/%s' % digest, spool_file,
+                        {'Content-Length': str(size)}).read()
+        self._count('bytes_uploaded', size)
+    finally:
+      with self._lock:
+        self._uploading.difference_update(missing)
+    self._request('PUT', '/ac/%s' % pending_action.key, json.dumps(
+        pending_action.outputs, sort_keys=True).encode('utf-8')).read()
+
+  def wait(self):
+    """Wait for what's been recorded to be uploaded."""
+    self._uploads.join()
+
+  def on_run_finished(self):
+    self.wait()
+    with self._lock:
+      if self._spool_directory is not None:
+        try:
+          os.rmdir(self._spool_directory)
+        except OSError:
+          # Something was recorded since; it's removed next time.
+          return
+        self._spool_directory = None
+
+
+class _PendingAction(object):
+  """An action entry waiting for its outputs to be uploaded."""
+
+  def __init__(self, key):
+    self.key = key
+    # output filenames to (digest, mode)
+    self.outputs = {}
+    # digests to the spooled copy of their contents and its size
+    self.blobs = {}
+    self.spooled = []
+
+  def discard(self):
+    """Remove the spooled copies of the outputs."""
+    for spooled in self.spooled:
+      try:
+        os.remove(spooled)
+      except OSError:
+        pass
+
+
+def _is_digest(name):
+  """Whether a name from a request is a (lowercase hex) digest, and so safe
+  to look up in the store."""
+  return (isinstance(name, (str, type(u''))) and bool(name) and
+          all(c in '0123456789abcdef' for c in name))
+
+
+class _RequestHandler(http_server.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def _reply(self, status, body=b'', content_type='application/octet-stream'):
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _reply_json(self, value):
+    self._reply(200, json.dumps(value).encode('utf-8'), 'application/json')
+
+  def _body(self):
+    return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+  def _route(self):
+    """Split the request path into the kind of resource and its name."""
+    parts = self.path.strip('/').split('/')
+    if len(parts) == 1 and parts[0] in ('cas', 'ac'):
+      return (parts[0], None)
+    if len(parts) == 2 and parts[0] in ('cas', 'ac') and _is_digest(parts[1]):
+      return tuple(parts)
+    return (None, None)
+
+  def do_GET(self):
+    store = self.server.store
+    (kind, name) = self._route()
+    if kind == 'cas' and name is not None:
+      try:
+        with open(store.blob_filename(name), 'rb') as blob_file:
+          body = blob_file.read()
+      except (IOError, OSError):
+        return self._reply(404)
+      store.touch_blob(name)
+      return self._reply(200, body)
+    if kind == 'ac' and name is not None:
+      outputs = store.read_action(name)
+      if outputs is None:
+        return self._reply(404)
+      return self._reply_json(outputs)
+    self._reply(404)
+
+  def do_PUT(self):
+    store = self.server.store
+    (kind, name) = self._route()
+    body = self._body()
+    if kind == 'cas' and name is not None:
+      try:
+        store.store(io.BytesIO(body), expected_digest=name)
+      except ValueError as e:
+        return self._reply(400, str(e).encode('utf-8'))
+      return self._reply(201)
+    if kind == 'ac' and name is not None:
+      try:
+        outputs = json.loads(body.decode('utf-8'))
+      except ValueError as e:
+        return self._reply(400, str(e).encode('utf-8'))
+      store.write_action(name, outputs)
+      return self._reply(201)
+    self._reply(404)
+
+  def do_POST(self):
+    (kind, name) = self._route()
+    if kind != 'cas' or name is not None:
+      return self._reply(404)
+    try:
+      digests = json.loads(self._body().decode('utf-8'))
+    except ValueError as e:
+      return self._reply(400, str(e).encode('utf-8'))
+    if not isinstance(digests, list) or not all(
+        _is_digest(digest) for digest in digests):
+      return self._reply(400, b'expected a list of hex digests')
+    self._reply_json([digest for digest in digests
+                      if not self.server.store.has_blob(digest)])
+
+  def log_message(self, format, *args):
+    pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http_server.HTTPServer):
+
+  daemon_threads = True
+
+
+class CacheServer(object):
+  """A reference cache server keeping its contents under a directory."""
+
+  def __init__(self, directory, host='localhost', port=0, max_bytes=1 << 30,
+               hash_name='sha1'):
+    """
+    Arguments:
+      directory (str): where to keep the contents; created if need be.
+      host (str): the address to listen on.
+      port (int): the port to listen on; 0 picks a free one (see `url`).
+      Other arguments are as for `cache.ContentStore`.
+    """
+    self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+    self._server.store = cache.ContentStore(directory, max_bytes, hash_name)
+    self._thread = None
+
+  @property
+  def url(self):
+    (host, port) = self._server.server_address[:2]
+    return 'http://%s:%d' % (host, port)
+
+  def serve_forever(self):
+    self._server.serve_forever()
+
+  def start(self):
+    """Serve on a thread of its own."""
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def shutdown(self):
+    if self._thread is not None:
+      self._server.shutdown()
+      self._thread.join()
+    self._server.server_close()
+
+
+def main(argv):
+  if len(argv) not in (2, 3):
+    sys.stderr.write('usage: %s DIRECTORY [PORT]\n' % argv[0])
+    return 2
+  server = CacheServer(argv[1], host='',
+                       port=int(argv[2]) if len(argv) == 3 else 8080)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.shutdown()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
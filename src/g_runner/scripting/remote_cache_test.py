@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import socket
+import time
+import unittest
+
+from g_runner.runner import action_cache as _action_cache
+from g_runner.scripting import cache
+from g_runner.scripting import files_test
+from g_runner.scripting import remote_cache
+
+class RemoteActionCacheTest(files_test.FilesTestCase):
+
+  def setUp(self):
+    super(RemoteActionCacheTest, self).setUp()
+    self.server = remote_cache.CacheServer(self.filename('server'))
+    self.server.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    super(RemoteActionCacheTest, self).tearDown()
+
+  def test_outputs_are_shared_between_clients(self):
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    self.run_task(remote_cache.RemoteActionCache(self.server.url), task)
+    os.remove(self.filename('out'))
+    other_client = remote_cache.RemoteActionCache(self.server.url)
+    self.run_task(other_client, task)
+    self.assertEqual([self.filename('out')], files_test.runs)
+    self.assertEqual('ABC', self.read('out'))
+    self.assertEqual(1, other_client.stats()['hits'])
+
+  def test_non_cacheable_tasks_bypass_the_cache(self):
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    client = remote_cache.RemoteActionCache(self.server.url)
+    for unused_run in range(2):
+      self.run_task(client, task, tags=(_action_cache.NON_CACHEABLE_TAG,))
+    self.assertEqual(2, len(files_test.runs))
+    self.assertEqual({'hits': 0, 'misses': 0, 'bytes_restored': 0,
+                      'bytes_uploaded': 0, 'errors': 0, 'dropped': 0},
+                     client.stats())
+
+  def test_only_missing_blobs_are_uploaded(self):
+    client = remote_cache.RemoteActionCache(self.server.url)
+    self.write('a', 'same')
+    self.write('b', 'same')
+    for (input_name, output_name) in (('a', 'a.out'), ('b', 'b.out')):
+      task = self.task(input_name, output_name)
+      task.run()
+      client.record(task)
+      client.wait()
+    self.assertEqual(4, client.stats()['bytes_uploaded'])
+    digest = hashlib.sha1(b'SAME').hexdigest()
+    self.assertEqual(set(['0' * 40]),
+                     client.missing_blobs([digest, '0' * 40]))
+
+  def test_server_rejects_mismatched_blobs(self):
+    client = remote_cache.RemoteActionCache(self.server.url)
+    self.assertRaises(remote_cache.RemoteCacheError, client._request,
+                      'PUT', '/cas/%s' % ('0' * 40), b'contents')
+    self.assertIsNone(client._request('GET', '/cas/%s' % ('0' * 40)))
+
+  def test_entries_only_restore_the_tasks_outputs(self):
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    client = remote_cache.RemoteActionCache(self.server.url)
+    self.run_task(client, task)
+    client.wait()
+    key = cache.action_key(task, client._fingerprinter)
+    digest = hashlib.sha1(b'ABC').hexdigest()
+    for outputs in ({self.filename('out'): [digest, 0o644],
+                     self.filename('elsewhere'): [digest, 0o644]},
+                    {self.filename('elsewhere'): [digest, 0o644]}, {}):
+      client._request('PUT', '/ac/%s' % key,
+                      json.dumps(outputs).encode('utf-8')).read()
+      self.assertFalse(client.restore(task))
+    self.assertFalse(os.path.exists(self.filename('elsewhere')))
+    # the first run's, and each of the entries'
+    self.assertEqual(4, client.stats()['misses'])
+
+  def test_server_rejects_malformed_digests(self):
+    client = remote_cache.RemoteActionCache(self.server.url)
+    for digests in (['../../etc/passwd'], [1], {'a': 'b'}, ['']):
+      self.assertRaises(remote_cache.RemoteCacheError, client._request,
+                        'POST', '/cas', json.dumps(digests).encode('utf-8'))
+    self.assertEqual(set(['0' * 40]), client.missing_blobs(['0' * 40]))
+
+  def hanging_server_url(self):
+    """Get the URL of a server that never answers."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(16)
+    self.addCleanup(listener.close)
+    return 'http://localhost:%d' % listener.getsockname()[1]
+
+  def test_recording_doesnt_wait_on_the_server(self):
+    client = remote_cache.RemoteActionCache(
+        self.hanging_server_url(), timeout=0.5)
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    task.run()
+    started = time.time()
+    client.record(task)
+    self.assertLess(time.time() - started, 0.5)
+    self.assertEqual(0, client.stats()['errors'])
+    client.on_run_finished()
+    self.assertEqual(1, client.stats()['errors'])
+    self.assertIsNone(client._spool_directory)
+
+  def test_uploads_falling_behind_drop_actions(self):
+    client = remote_cache.RemoteActionCache(
+        self.hanging_server_url(), timeout=0.5, max_uploads=1, max_queued=1)
+    for i in range(3):
+      self.write('in%d' % i, str(i))
+      task = self.task('in%d' % i, 'out%d' % i)
+      task.run()
+      client.record(task)
+    self.assertLessEqual(1, client.stats()['dropped'])
+    self.assertGreaterEqual(2, len(os.listdir(client._spool_directory)))
+    client.on_run_finished()
+    self.assertEqual(3, client.stats()['dropped'] + client.stats()['errors'])
+    self.assertIsNone(client._spool_directory)
+
+  def test_unreachable_server_misses(self):
+    self.write('in', 'abc')
+    task = self.task('in', 'out')
+    url = self.server.url
+    self.server.shutdown()
+    client = remote_cache.RemoteActionCache(url, timeout=1)
+    self.run_task(client, task)
+    self.assertEqual([self.filename('out')], files_test.runs)
+    self.assertEqual(2, client.stats()['errors'])
+    self.server = remote_cache.CacheServer(self.filename('server'))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -1,6 +1,19 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from g_runner import scripting
+from g_runner._compat import pickle
+
+
+_module_builder = scripting.TrackerBuilder()
+
+
+@_module_builder.task(args=(2,))
+def module_task(value):
+  return value * 21
+
 
 class ScriptingTest(unittest.TestCase):
 
@@ -27,3 +40,49 @@ class ScriptingTest(unittest.TestCase):
     for state_element in state:
       self.assertEqual(1, state_element)
 
+
+  def test_builder_task_pickles(self):
+    for task in (module_task,
+                 scripting.ScriptedTask(len, [], [], args=('abc',))):
+      unpickled_task = pickle.loads(pickle.dumps(task, 2))
+      self.assertIs(task._callee, unpickled_task._callee)
+      self.assertEqual(task.run(), unpickled_task.run())
+    self.assertEqual(42, module_task.run())
+
+  def test_tagged_tasks(self):
+    builder = scripting.TrackerBuilder()
+
+    @builder.task(tags=('tag',))
+    def task0():
+      pass
+
+    self.assertEqual(
+        set([task0]), builder._tracker.tasks_by_tags(['tag']))
+
+  def test_task_resources(self):
+    builder = scripting.TrackerBuilder()
+
+    @builder.task(resources={'cpus': 2})
+    def task0():
+      pass
+
+    command0 = builder.command(resources={'memory': 1e9})(['true'])
+    self.assertEqual({'cpus': 2}, task0.resources())
+    self.assertEqual({'memory': 1e9}, command0.resources())
+    self.assertEqual({'memory': 1e9},
+                     pickle.loads(pickle.dumps(command0, 2)).resources())
+
+  def test_command_run(self):
+    directory = tempfile.mkdtemp()
+    try:
+      builder = scripting.TrackerBuilder()
+      first = os.path.join(directory, 'first')
+      second = os.path.join(directory, 'second')
+      command0 = builder.command()(['touch', first])
+      builder.command(input_paths=(command0,))(['cp', first, second])
+      builder.run(outdated=True)
+      self.assertTrue(os.path.exists(second))
+      self.assertEqual(
+          (['touch', first], {}), command0.command())
+    finally:
+      shutil.rmtree(directory)
@@ -0,0 +1,434 @@
+"""Events for the runner from changes to the files a tracker's paths stand for.
+
+A `FileWatcher` watches files (see `files.file_path`) for changes, with Linux's
+inotify where there is one and by polling their directories' listings
+otherwise. Either way a single thread watches every file, and inotify watches
+directories rather than files, so tens of thousands of files take a few
+thousand watches at most; directories past the system's limit of watches are
+polled.
+
+Changes come in bursts (e.g. an editor writing a temporary file, renaming it
+over the original and then setting its mode), so they're debounced: a burst is
+reported once it's been quiet for a while, as one event outdating whatever the
+changed files are made into. Run a tracker continuously with
+
+  watcher = watch.FileWatcher.for_tracker(tracker)
+  runner.run_tracker(tracker, watcher.events(), callbacks=watcher.callbacks())
+
+until `watcher.close()` is called; the watcher watches the files of the
+tracker's paths, including those added during the run. The callbacks let the
+watcher tell the changes tasks make to the files they make from others', so
+that those files are remade when they're edited or removed, but not when their
+tasks make them."""
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from g_runner import runner
+from g_runner.scripting import files
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+    _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 1 << 16
+
+# How long waiting may go on before checking whether the watcher was closed.
+_CLOSE_CHECK_SECONDS = 0.2
+
+
+def _load_libc():
+  """Get the C library if it has inotify, else None."""
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+  except (OSError, AttributeError):
+    return None
+  libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                     ctypes.c_uint32]
+  return libc
+
+
+class _InotifyBackend(object):
+  """Waits on an inotify instance watching every watched directory.
+
+  Directories past the system's limit of watches are polled instead."""
+
+  def __init__(self, libc, poll_interval):
+    self._libc = libc
+    self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if self._fd < 0:
+      error = ctypes.get_errno()
+      raise OSError(error, os.strerror(error))
+    self._directories_by_descriptor = {}
+    self._watched = set()
+    # Directories that don't exist (yet), so can't be watched.
+    self._unwatched = set()
+    # Directories there were no more watches for.
+    self._polling = _PollingBackend(poll_interval)
+    self._polled = set()
+
+  def add_directory(self, directory, names=()):
+    """Watch a directory (if it isn't already); whether or not it could be."""
+    if directory in self._polled:
+      return self._polling.add_directory(directory, names)
+    if directory in self._watched:
+      return True
+    descriptor = self._libc.inotify_add_watch(
+        self._fd, os.fsencode(directory) if hasattr(os, 'fsencode')
+        else directory, _WATCH_MASK)
+    if descriptor < 0:
+      error = ctypes.get_errno()
+      if error == errno.ENOSPC:
+        self._unwatched.discard(directory)
+        self._polled.add(directory)
+        return self._polling.add_directory(directory, names)
+      if error not in (errno.ENOENT, errno.ENOTDIR):
+        raise OSError(error, 'watching %s: %s' % (
+            directory, os.strerror(error)))
+      self._unwatched.add(directory)
+      return False
+    self._directories_by_descriptor[descriptor] = directory
+    self._watched.add(directory)
+    self._unwatched.discard(directory)
+    return True
+
+  def wait(self, timeout, watched):
+    """Wait for changes to the watched files.
+
+    Arguments:
+      timeout (float): how long to wait for a change at most.
+      watched (dict): the watched directories to the names of the files in
+        them that are watched.
+
+    Returns:
+      A set of the filenames of changed files; empty if none changed.
+    """
+    changed = set()
+    # Directories that have appeared may have brought files with them.
+    for directory in list(self._unwatched):
+      if self.add_directory(directory, watched.get(directory, ())):
+        changed.update(os.path.join(directory, name)
+                       for name in watched.get(directory, ()))
+    if self._polled:
+      changed.update(self._polling.wait(0, dict(
+          (directory, names) for (directory, names) in watched.items()
+          if directory in self._polled)))
+      timeout = min(timeout, self._polling.seconds_to_scan())
+    if changed:
+      return changed
+    (readable, unused_writable, unused_errors) = select.select(
+        [self._fd], [], [], timeout)
+    if not readable:
+      return changed
+    try:
+      data = os.read(self._fd, _READ_SIZE)
+    except OSError as e:
+      if e.errno == errno.EAGAIN:
+        return changed
+      raise
+    offset = 0
+    while offset < len(data):
+      (descriptor, mask, unused_cookie, length) = _EVENT_HEADER.unpack_from(
+          data, offset)
+      offset += _EVENT_HEADER.size
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      if mask & _IN_Q_OVERFLOW:
+        # Events were lost; any file may have changed.
+        for (directory, names) in watched.items():
+          changed.update(os.path.join(directory, name) for name in names)
+        continue
+      directory = self._directories_by_descriptor.get(descriptor)
+      if directory is None:
+        continue
+      if mask & _IN_IGNORED:
+        # The directory went away; watch for it to come back.
+        del self._directories_by_descriptor[descriptor]
+        self._watched.discard(directory)
+        self._unwatched.add(directory)
+      if mask & (_IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF):
+        changed.update(os.path.join(directory, name)
+                       for name in watched.get(directory, ()))
+        continue
+      if not isinstance(name, str):
+        name = name.decode(sys.getfilesystemencoding())
+      if name in watched.get(directory, ()):
+        changed.add(os.path.join(directory, name))
+    return changed
+
+  def close(self):
+    os.close(self._fd)
+
+
+class _PollingBackend(object):
+  """Lists the watched directories every so often, comparing stat data."""
+
+  def __init__(self, interval):
+    self._interval = interval
+    self._next_scan = 0
+    # filename -> stat key, for the watched files that exist
+    self._stat_keys = {}
+
+  def _scan(self, directory, names):
+    try:
+      (listed_files, unused_directories) = files._list_directory(directory)
+    except OSError:
+      listed_files = ()
+    return dict(
+        (filename, files._stat_key(stat_result))
+        for (filename, stat_result) in listed_files
+        if os.path.basename(filename) in names)
+
+  def add_directory(self, directory, names):
+    """Note the current stat data of some files in a directory."""
+    self._stat_keys.update(self._scan(directory, names))
+    return True
+
+  def seconds_to_scan(self):
+    return max(0, self._next_scan - time.time())
+
+  def wait(self, timeout, watched):
+    delay = self._next_scan - time.time()
+    if delay > timeout:
+      time.sleep(timeout)
+      return set()
+    if delay > 0:
+      time.sleep(delay)
+    self._next_scan = time.time() + self._interval
+    stat_keys = {}
+    for (directory, names) in watched.items():
+      stat_keys.update(self._scan(directory, names))
+    changed = set(
+        filename for filename in set(stat_keys).union(self._stat_keys)
+        if stat_keys.get(filename) != self._stat_keys.get(filename))
+    self._stat_keys = stat_keys
+    return changed
+
+  def close(self):
+    pass
+
+
+class FileWatcher(object):
+  """Watches files, reporting bursts of changes to them."""
+
+  def __init__(self, filenames=(), debounce=0.05, max_delay=1.0,
+               poll_interval=1.0, use_inotify=None):
+    """
+    Arguments:
+      filenames (iterable): the files to watch; see also `watch`.
+      debounce (float): how many seconds without changes end a burst.
+      max_delay (float): how many seconds a burst may go on before being
+        reported anyway, so that files changing all the time don't keep the
+        others' changes from being reported.
+      poll_interval (float): how many seconds apart the watched directories
+        are listed when polling.
+      use_inotify (bool): whether to use inotify (which fails where there is
+        none) or poll; defaults to using inotify where there is one.
+    """
+    self._debounce = debounce
+    self._max_delay = max_delay
+    libc = _load_libc() if use_inotify is not False else None
+    if use_inotify and libc is None:
+      raise OSError(errno.ENOSYS, 'inotify is unavailable')
+    self._backend = (_InotifyBackend(libc, poll_interval) if libc is not None
+                     else _PollingBackend(poll_interval))
+    self._lock = threading.Lock()
+    # directory -> names of the watched files in it
+    self._watched = collections.defaultdict(set)
+    self._closed = threading.Event()
+    # Paths of files that tasks are making, and the stat keys (or None) of
+    # those made, as reported to the watcher's callbacks.
+    self._updating = set()
+    self._made = {}
+    self.watch(filenames)
+
+  @classmethod
+  def for_tracker(cls, tracker, **kwargs):
+    """Get a watcher of the files a tracker's paths stand for.
+
+    Run its events with its `callbacks` to watch the files of paths added to
+    the tracker during the run too. Takes the keyword arguments of
+    `FileWatcher`."""
+    return cls([path[1] for path in tracker.paths()
+                if files.is_file_path(path)], **kwargs)
+
+  def watch(self, filenames):
+    """Start watching more files."""
+    added = collections.defaultdict(set)
+    for filename in filenames:
+      (directory, name) = os.path.split(os.path.abspath(filename))
+      added[directory].add(name)
+    with self._lock:
+      for (directory, names) in added.items():
+        self._watched[directory].update(names)
+        self._backend.add_directory(directory, names)
+
+  def _wait(self, timeout):
+    with self._lock:
+      watched = dict((directory, frozenset(names))
+                     for (directory, names) in self._watched.items())
+    return self._backend.wait(timeout, watched)
+
+  def changes(self):
+    """Iterate over bursts of changes, as frozensets of filenames, until the
+    watcher is closed."""
+    try:
+      while not self._closed.is_set():
+        changed = self._wait(_CLOSE_CHECK_SECONDS)
+        if not changed:
+          continue
+        deadline = time.time() + self._max_delay
+        while not self._closed.is_set():
+          timeout = min(self._debounce, deadline - time.time())
+          if timeout <= 0:
+            break
+          more = self._wait(timeout)
+          if not more:
+            break
+          changed.update(more)
+        yield frozenset(changed)
+    finally:
+      self._backend.close()
+
+  def events(self):
+    """Iterate over events outdating what changed files are made into, for
+    `runner.run_tracker`, until the watcher is closed.
+
+    Changes to files that tasks make are only told from the tasks making them
+    when the run has the watcher's `callbacks`; without them, watch the files
+    no task makes only, lest their tasks remake them endlessly."""
+    for changed in self.changes():
+      changed_paths = frozenset(
+          files.file_path(filename) for filename in changed)
+      yield runner.Event(
+          path_selector=lambda tracker, changed_paths=changed_paths: (
+              outdated_by(tracker, self._others_changes(changed_paths))),
+          flags=runner.EventFlags(paths_state=runner.PathState.outdated))
+
+  def callbacks(self, callbacks=None):
+    """Get callbacks to run the watcher's events with.
+
+    They also have the watcher watch the files of paths added to the tracker
+    during the run.
+
+    Arguments:
+      callbacks (runner.RunnerCallbacks): callbacks to pass the calls on to.
+    """
+    return WatcherCallbacks(self, callbacks)
+
+  def _note_path_states(self, tracker, state, paths):
+    made = [path for path in paths
+            if files.is_file_path(path) and tracker.tasks_by_outputs([path])]
+    if not made:
+      return
+    stat_keys = {}
+    if state == runner.PathState.up_to_date:
+      for path in made:
+        stat_keys[path] = _stat_key(path[1])
+    with self._lock:
+      if state == 'updating':
+        self._updating.update(made)
+      else:
+        self._updating.difference_update(made)
+      self._made.update(stat_keys)
+
+  def _others_changes(self, changed_paths):
+    """Leave out the changes that tasks made to the files they make: those
+    being made, and those made and unchanged since."""
+    with self._lock:
+      return [path for path in changed_paths
+              if path not in self._updating and (
+                  path not in self._made or
+                  self._made[path] != _stat_key(path[1]))]
+
+  def close(self):
+    """Stop watching; iterating over changes or events ends soon after."""
+    self._closed.set()
+
+
+class WatcherCallbacks(runner.RunnerCallbacks):
+  """Callbacks telling a `FileWatcher` what the run's tasks make, passing the
+  calls on to other callbacks; see `FileWatcher.callbacks`."""
+
+  def __init__(self, watcher, callbacks=None):
+    self._watcher = watcher
+    self._callbacks = (
+        runner.RunnerCallbacks() if callbacks is None else callbacks)
+
+  def on_paths_state_changed(self, tracker, state, paths):
+    self._watcher._note_path_states(tracker, state, paths)
+    self._callbacks.on_paths_state_changed(tracker, state, paths)
+
+  def on_tasks_state_changed(self, tracker, state, tasks):
+    self._callbacks.on_tasks_state_changed(tracker, state, tasks)
+
+  def on_task_failed(self, tracker, task, error):
+    self._callbacks.on_task_failed(tracker, task, error)
+
+  def on_path_added(self, tracker, path):
+    if files.is_file_path(path):
+      self._watcher.watch([path[1]])
+    self._callbacks.on_path_added(tracker, path)
+
+  def on_event(self, tracker, event):
+    self._callbacks.on_event(tracker, event)
+
+  def on_event_wait(self, tracker):
+    self._callbacks.on_event_wait(tracker)
+
+
+def _stat_key(filename):
+  try:
+    return files._stat_key(os.stat(filename))
+  except OSError:
+    return None
+
+
+def outdated_by(tracker, changed_paths):
+  """Get the paths of a tracker that changes to some paths outdate.
+
+  Those are the changed paths that tasks make (paths no task makes have
+  nothing to remake them, so stay as they are), and every path made from a
+  changed path, directly or not."""
+  paths = tracker.paths()
+  outdated = set(path for path in changed_paths
+                 if path in paths and tracker.tasks_by_outputs([path]))
+  pending = collections.deque(path for path in changed_paths if path in paths)
+  seen = set(pending)
+  while pending:
+    path = pending.popleft()
+    for task in tracker.tasks_by_inputs([path]):
+      for output_path in task.output_paths():
+        if output_path not in seen and output_path in paths:
+          seen.add(output_path)
+          outdated.add(output_path)
+          pending.append(output_path)
+  return outdated
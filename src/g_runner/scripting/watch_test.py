@@ -0,0 +1,182 @@
+import ctypes
+import errno
+import os
+import threading
+import time
+import unittest
+
+from g_runner import runner
+from g_runner import scripting
+from g_runner.runner import tracker as _tracker
+from g_runner.scripting import files
+from g_runner.scripting import files_test
+from g_runner.scripting import watch
+
+_HAS_INOTIFY = watch._load_libc() is not None
+
+
+class FileWatcherTest(files_test.FilesTestCase):
+
+  use_inotify = False
+
+  def watcher(self, filenames):
+    return watch.FileWatcher(filenames, **self.watcher_arguments())
+
+  def watcher_arguments(self):
+    return {'debounce': 0.1, 'poll_interval': 0.02,
+            'use_inotify': self.use_inotify}
+
+  def next_changes(self, changes, change):
+    """Make a change on another thread and get the next burst reported."""
+    threading.Timer(0.05, change).start()
+    return next(changes)
+
+  def test_bursts_are_debounced(self):
+    self.write('watched', 'a')
+    self.write('other', 'a')
+    watcher = self.watcher([self.filename('watched')])
+    changes = watcher.changes()
+    def save_like_an_editor():
+      self.write('watched.tmp', 'b')
+      os.rename(self.filename('watched.tmp'), self.filename('watched'))
+      os.chmod(self.filename('watched'), 0o600)
+      self.write('other', 'b')
+    self.assertEqual(frozenset([self.filename('watched')]),
+                     self.next_changes(changes, save_like_an_editor))
+    watcher.close()
+    self.assertEqual([], list(changes))
+
+  def test_created_and_removed_files(self):
+    watcher = self.watcher([self.filename('new')])
+    changes = watcher.changes()
+    self.assertEqual(
+        frozenset([self.filename('new')]),
+        self.next_changes(changes, lambda: self.write('new', 'a')))
+    self.assertEqual(
+        frozenset([self.filename('new')]),
+        self.next_changes(changes, lambda: os.remove(self.filename('new'))))
+    watcher.close()
+
+  def start_copying(self, watched_names):
+    """Run a tracker copying 'source' to 'made' on the events of a watcher of
+    some files, once 'made' has been made."""
+    source = self.filename('source')
+    made = self.filename('made')
+    self.write('source', 'a')
+    builder = scripting.TrackerBuilder()
+    builder.task(
+        input_paths=[files.file_path(source)],
+        output_paths=[files.file_path(made)],
+        args=(source, made))(files_test.copy)
+    tracker = builder._tracker.replaced(
+        new_paths=[files.file_path(source), files.file_path(made)])
+    watcher = self.watcher([self.filename(name) for name in watched_names])
+    up_to_date = threading.Event()
+    class Callbacks(runner.RunnerCallbacks):
+      def on_event_wait(self, tracker):
+        up_to_date.set()
+    def events():
+      yield runner.Event(
+          path_selector=lambda unused_tracker: [files.file_path(source)],
+          flags=runner.EventFlags(paths_state=runner.PathState.up_to_date))
+      for event in watcher.events():
+        yield event
+    run = threading.Thread(target=runner.run_tracker, args=(
+        tracker, events()), kwargs={
+            'outdated': True, 'callbacks': watcher.callbacks(Callbacks())})
+    run.start()
+    self.assertTrue(up_to_date.wait(10))
+    self.assertEqual('a', self.read('made'))
+    return (watcher, run)
+
+  def wait_for_made(self, contents):
+    deadline = time.time() + 10
+    while self.read('made') != contents and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(contents, self.read('made'))
+
+  def test_events_rerun_what_changed_files_make(self):
+    (watcher, run) = self.start_copying(['source'])
+    try:
+      self.write('source', 'b')
+      self.wait_for_made('b')
+    finally:
+      watcher.close()
+      run.join()
+
+  def test_watched_outputs_are_remade_when_others_change_them(self):
+    (watcher, run) = self.start_copying(['source', 'made'])
+    try:
+      self.write('source', 'b')
+      self.wait_for_made('b')
+      # long enough for a few bursts of changes to have been reported, had
+      # the task's own changes to 'made' outdated it
+      time.sleep(0.5)
+      self.assertEqual(2, len(files_test.runs))
+      self.write('made', 'edited')
+      self.wait_for_made('b')
+      os.remove(self.filename('made'))
+      deadline = time.time() + 10
+      while not os.path.exists(self.filename('made')):
+        self.assertLess(time.time(), deadline)
+        time.sleep(0.01)
+      self.wait_for_made('b')
+      time.sleep(0.5)
+      self.assertEqual(4, len(files_test.runs))
+    finally:
+      watcher.close()
+      run.join()
+
+  def test_watching_a_trackers_files(self):
+    self.write('source', 'a')
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[files.file_path(self.filename('source')), ('not a file',)])
+    watcher = watch.FileWatcher.for_tracker(
+        tracker, **self.watcher_arguments())
+    changes = watcher.changes()
+    self.assertEqual(
+        frozenset([self.filename('source')]),
+        self.next_changes(changes, lambda: self.write('source', 'b')))
+    # as when an event adds the path during a run
+    watcher.callbacks().on_path_added(
+        tracker, files.file_path(self.filename('added')))
+    self.assertEqual(
+        frozenset([self.filename('added')]),
+        self.next_changes(changes, lambda: self.write('added', 'a')))
+    watcher.close()
+
+  def test_outdated_by(self):
+    tracker = _tracker.Tracker().replaced(
+        new_paths=[('source',), ('a',), ('b',), ('unrelated',)],
+        new_tasks=[scripting.ScriptedTask(len, [('source',)], [('a',)]),
+                   scripting.ScriptedTask(len, [('a',)], [('b',)])])
+    self.assertEqual(set([('a',), ('b',)]),
+                     watch.outdated_by(tracker, [('source',)]))
+    self.assertEqual(set([('a',), ('b',)]),
+                     watch.outdated_by(tracker, [('a',), ('missing',)]))
+
+
+@unittest.skipUnless(_HAS_INOTIFY, 'needs inotify')
+class InotifyFileWatcherTest(FileWatcherTest):
+
+  use_inotify = True
+
+  def test_directories_past_the_watch_limit_are_polled(self):
+    class ExhaustedLibc(object):
+      def __init__(self, libc):
+        self.inotify_init1 = libc.inotify_init1
+      def inotify_add_watch(self, *unused_args):
+        ctypes.set_errno(errno.ENOSPC)
+        return -1
+    watcher = self.watcher([])
+    watcher._backend._libc = ExhaustedLibc(watcher._backend._libc)
+    watcher.watch([self.filename('watched')])
+    changes = watcher.changes()
+    self.assertEqual(
+        frozenset([self.filename('watched')]),
+        self.next_changes(changes, lambda: self.write('watched', 'a')))
+    watcher.close()
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)